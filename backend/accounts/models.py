@@ -4,8 +4,10 @@ from cryptography.fernet import Fernet
 import base64
 import os
 
+from events.outbox import OutboxModel, OutboxQuerySet
 
-class LinkedAccount(models.Model):
+
+class LinkedAccount(OutboxModel, models.Model):
     """Model for linked external accounts with encrypted tokens."""
     
     SERVICE_CHOICES = [
@@ -29,6 +31,8 @@ class LinkedAccount(models.Model):
     added_at = models.DateTimeField(auto_now_add=True)
     last_synced_at = models.DateTimeField(blank=True, null=True)
     
+    objects = OutboxQuerySet.as_manager()
+    
     class Meta:
         unique_together = ('owner', 'service_name', 'account_identifier')
         ordering = ['-added_at']
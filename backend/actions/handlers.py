@@ -0,0 +1,48 @@
+"""
+Action handlers, dispatched by ``Action.action_type``.
+
+A handler receives the ``ActionExecution`` (with its ``action`` loaded), the
+triggering message and the ``TaskExecution`` it runs for, if any, and returns
+the ``result_data`` dict. Raising
+marks the execution as failed. Handlers run inside the caller's transaction,
+so they should only do local work (write rows, enqueue deliveries) and leave
+slow I/O to background workers. Each runs in a savepoint: what a failing
+handler wrote is rolled back, and a database error in it does not break the
+caller's transaction for the handlers and bookkeeping that follow.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from taskpilotx.sharding import shard_db
+
+
+_handlers = {}
+
+
+def register(action_type):
+    """Decorator registering a handler for ``action_type``."""
+    def decorator(handler):
+        _handlers[action_type] = handler
+        return handler
+    return decorator
+
+
+def record_execution(execution, message=None, task_execution=None):
+    """Fallback for action types without a dedicated handler."""
+    return {'executed': True, 'timestamp': str(execution.started_at)}
+
+
+def run_action(execution, message=None, save=True, task_execution=None):
+    """Run the handler for ``execution`` and record the outcome on it."""
+    handler = _handlers.get(execution.action.action_type, record_execution)
+    try:
+        with transaction.atomic(using=shard_db()):
+            execution.result_data = handler(execution, message=message, task_execution=task_execution)
+        execution.status = 'completed'
+    except Exception as e:
+        execution.status = 'failed'
+        execution.error_message = str(e)
+    execution.completed_at = timezone.now()
+    if save:
+        execution.save(update_fields=['status', 'result_data', 'error_message', 'completed_at'])
+    return execution
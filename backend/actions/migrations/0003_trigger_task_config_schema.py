@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+TRIGGER_TASK_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'task_id': {'type': 'integer'},
+        'task_ids': {'type': 'array', 'items': {'type': 'integer'}, 'minItems': 1},
+    },
+    'anyOf': [{'required': ['task_id']}, {'required': ['task_ids']}],
+}
+
+
+def update_trigger_task_schema(apps, schema_editor):
+    Action = apps.get_model('actions', 'Action')
+    Action.objects.filter(action_type='trigger_task', config_schema={'task_id': 'integer'}).update(
+        config_schema=TRIGGER_TASK_SCHEMA
+    )
+
+
+def restore_trigger_task_schema(apps, schema_editor):
+    Action = apps.get_model('actions', 'Action')
+    Action.objects.filter(action_type='trigger_task', config_schema=TRIGGER_TASK_SCHEMA).update(
+        config_schema={'task_id': 'integer'}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actions', '0002_create_default_actions'),
+    ]
+
+    operations = [
+        migrations.RunPython(update_trigger_task_schema, restore_trigger_task_schema),
+    ]
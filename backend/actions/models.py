@@ -2,6 +2,8 @@ from django.db import models
 from django.conf import settings
 import json
 
+from events.outbox import OutboxModel, OutboxQuerySet
+
 
 class ActionType(models.TextChoices):
     """Enum for different action types."""
@@ -33,7 +35,7 @@ class Action(models.Model):
         return f"{self.name} ({self.get_action_type_display()})"
 
 
-class ActionExecution(models.Model):
+class ActionExecution(OutboxModel, models.Model):
     """Model to track action executions."""
     
     STATUS_CHOICES = [
@@ -55,6 +57,9 @@ class ActionExecution(models.Model):
     # Reference to the task that triggered this action (optional)
     triggering_task = models.ForeignKey('tasks.Task', on_delete=models.SET_NULL, null=True, blank=True)
     
+    objects = OutboxQuerySet.as_manager()
+    change_event_owner = 'executed_by_id'
+    
     class Meta:
         ordering = ['-started_at']
     
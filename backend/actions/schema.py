@@ -1,7 +1,13 @@
 import graphene
 from graphene_django import DjangoObjectType
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from taskpilotx.sharding import shard_db
 from .models import Action, ActionExecution, ActionType as ActionTypeEnum
+from .handlers import run_action
+from .uploads import store_inline_content
+from .validation import validate_config
 
 
 # GraphQL Types
@@ -41,7 +47,9 @@ class ExecuteAction(graphene.Mutation):
 
         try:
             action = Action.objects.get(id=execution_data.action_id)
-            
+            validate_config(action, execution_data.get('config_data'))
+            config_data = store_inline_content(action, execution_data.get('config_data') or {}, user.pk)
+
             task = None
             if execution_data.get('task_id'):
                 from tasks.models import Task
@@ -50,39 +58,84 @@ class ExecuteAction(graphene.Mutation):
             execution = ActionExecution.objects.create(
                 action=action,
                 executed_by=user,
-                config_data=execution_data.get('config_data', {}),
-                triggering_task=task
+                config_data=config_data,
+                triggering_task=task,
+                status='running',
             )
 
-            # Simple execution logic for MVP
-            try:
-                execution.status = 'running'
-                execution.save()
-
-                # Placeholder execution logic
-                result_data = {"executed": True, "timestamp": str(execution.started_at)}
-                
-                # TODO: Implement actual action execution logic here
-                # This would dispatch to specific handlers based on action_type
-                
-                execution.status = 'completed'
-                execution.result_data = result_data
-                execution.save()
-
-                return ExecuteAction(execution=execution, success=True, errors=[])
-
-            except Exception as exec_error:
-                execution.status = 'failed'
-                execution.error_message = str(exec_error)
-                execution.save()
-                return ExecuteAction(execution=execution, success=False, errors=[str(exec_error)])
+            run_action(execution)
+            if execution.status == 'failed':
+                return ExecuteAction(execution=execution, success=False, errors=[execution.error_message])
+            return ExecuteAction(execution=execution, success=True, errors=[])
 
         except Action.DoesNotExist:
             return ExecuteAction(success=False, errors=['Action not found'])
+        except ValidationError as e:
+            return ExecuteAction(success=False, errors=e.messages)
         except Exception as e:
             return ExecuteAction(success=False, errors=[str(e)])
 
 
+class ExecuteActions(graphene.Mutation):
+    """Run several actions; nothing is written unless every input is valid."""
+
+    class Arguments:
+        executions = graphene.List(ExecuteActionInput, required=True)
+
+    executions = graphene.List(ActionExecutionType)
+    success = graphene.Boolean()
+    errors = graphene.List(graphene.String)
+
+    @staticmethod
+    def mutate(root, info, executions):
+        user = info.context.user
+        if not user.is_authenticated:
+            return ExecuteActions(success=False, errors=['Authentication required'])
+
+        try:
+            from tasks.models import Task
+            actions = Action.objects.in_bulk({str(data.action_id) for data in executions})
+            actions = {str(pk): action for pk, action in actions.items()}
+            task_ids = {str(data.task_id) for data in executions if data.get('task_id')}
+            tasks = {str(pk): task for pk, task in Task.objects.filter(owner=user).in_bulk(task_ids).items()}
+
+            errors, configs = [], []
+            for i, data in enumerate(executions):
+                action = actions.get(str(data.action_id))
+                if action is None:
+                    errors.append(f'executions[{i}]: Action not found')
+                    continue
+                if data.get('task_id') and str(data.task_id) not in tasks:
+                    errors.append(f'executions[{i}]: Task not found')
+                try:
+                    validate_config(action, data.get('config_data'))
+                    configs.append(store_inline_content(action, data.get('config_data') or {}, user.pk))
+                except ValidationError as e:
+                    errors += [f'executions[{i}]: {message}' for message in e.messages]
+            if errors:
+                return ExecuteActions(success=False, errors=errors)
+
+            with transaction.atomic(using=shard_db()):
+                created = ActionExecution.objects.bulk_create([
+                    ActionExecution(
+                        action=actions[str(data.action_id)],
+                        executed_by=user,
+                        config_data=config_data,
+                        triggering_task=tasks.get(str(data.task_id)) if data.get('task_id') else None,
+                        status='running',
+                    )
+                    for data, config_data in zip(executions, configs)
+                ])
+                for execution in created:
+                    run_action(execution, save=False)
+                ActionExecution.objects.bulk_update(created, ['status', 'result_data', 'error_message', 'completed_at'])
+
+            failed = [execution.error_message for execution in created if execution.status == 'failed']
+            return ExecuteActions(executions=created, success=not failed, errors=failed)
+        except Exception as e:
+            return ExecuteActions(success=False, errors=[str(e)])
+
+
 # Queries
 class Query(graphene.ObjectType):
     available_actions = graphene.List(ActionObjectType)
@@ -107,4 +160,5 @@ class Query(graphene.ObjectType):
 
 # Mutations
 class Mutation(graphene.ObjectType):
-    execute_action = ExecuteAction.Field()
\ No newline at end of file
+    execute_action = ExecuteAction.Field()
+    execute_actions = ExecuteActions.Field()
\ No newline at end of file
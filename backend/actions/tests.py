@@ -1,3 +1,179 @@
-from django.test import TestCase
+import json
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from taskpilotx import blobs
+from taskpilotx.sharding import prepare_shard, shard_for, use_shard
+from users.tokens import RefreshToken
+from . import validation
+from .handlers import _handlers, run_action
+from .models import Action, ActionExecution, ActionType
+
+
+User = get_user_model()
+
+EXECUTE = '''
+mutation($data: ExecuteActionInput!) {
+  executeAction(executionData: $data) { success errors execution { configData resultData } }
+}
+'''
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class UploadContentTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings_override = override_settings(
+            BLOB_STORE_DIR=f'{root.name}/blobs', UPLOAD_LOCAL_ROOT=f'{root.name}/uploads',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # The store is created once per process, from BLOB_STORE_DIR.
+        blobs._store = None
+        self.addCleanup(setattr, blobs, '_store', None)
+
+        self.action = Action.objects.create(
+            name='Upload', action_type=ActionType.UPLOAD_CONTENT, description='Upload content',
+        )
+        for alias in settings.DATABASE_SHARDS:
+            prepare_shard(alias)
+        self.owner, self.other = (
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ('owner', 'other')
+        )
+
+    def authorize(self, user):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+
+    def upload(self, user, body):
+        self.authorize(user)
+        response = self.client.post('/api/uploads/', body, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['blob']
+
+    def execute(self, user, config):
+        self.authorize(user)
+        variables = {'data': {'actionId': str(self.action.pk), 'configData': json.dumps(config)}}
+        response = self.client.post(
+            '/api/graphql/', json.dumps({'query': EXECUTE, 'variables': variables}),
+            content_type='application/json',
+        )
+        return response.json()['data']['executeAction']
+
+    def test_blob_can_be_uploaded_by_its_owner(self):
+        digest = self.upload(self.owner, b'report')
+        result = self.execute(self.owner, {'destination': 'local:report.txt', 'blob': digest})
+        self.assertTrue(result['success'], result['errors'])
+
+    def test_same_path_of_two_users_is_two_files(self):
+        locations = []
+        for user, body in ((self.owner, b'owner report'), (self.other, b'other report')):
+            result = self.execute(user, {'destination': 'local:report.txt', 'blob': self.upload(user, body)})
+            self.assertTrue(result['success'], result['errors'])
+            locations.append(json.loads(result['execution']['resultData'])['location'])
+        with open(locations[0], 'rb') as owner_file, open(locations[1], 'rb') as other_file:
+            self.assertEqual((owner_file.read(), other_file.read()), (b'owner report', b'other report'))
+
+    def test_blob_of_another_user_is_unknown(self):
+        digest = self.upload(self.owner, b'report')
+        missing = 'f' * 64
+        errors = [
+            self.execute(self.other, {'destination': 'local:copy.txt', 'blob': blob})['errors']
+            for blob in (digest, missing)
+        ]
+        # Refused the same way as a hash that was never stored.
+        self.assertEqual(errors, [[f'Unknown blob: {digest}'], [f'Unknown blob: {missing}']])
+
+    def test_storing_the_same_content_makes_it_usable(self):
+        digest = self.upload(self.owner, b'report')
+        self.assertEqual(self.upload(self.other, b'report'), digest)
+        result = self.execute(self.other, {'destination': 'local:copy.txt', 'blob': digest})
+        self.assertTrue(result['success'], result['errors'])
+
+    def test_inline_content_is_stored_as_a_blob_before_the_execution(self):
+        result = self.execute(self.owner, {'destination': 'local:note.txt', 'content': 'note'})
+        self.assertTrue(result['success'], result['errors'])
+        config = json.loads(result['execution']['configData'])
+        self.assertIsNone(config['content'])
+        self.assertEqual(config['blob'], json.loads(result['execution']['resultData'])['blob'])
+        with blobs.get_blob_store().open(config['blob']) as f:
+            self.assertEqual(f.read(), b'note')
+
+    @override_settings(UPLOAD_INLINE_MAX_BYTES=4)
+    def test_inline_content_over_the_limit_is_refused(self):
+        result = self.execute(self.owner, {'destination': 'local:note.txt', 'content': 'too long'})
+        self.assertFalse(result['success'])
+        self.assertIn('exceeds 4 bytes', result['errors'][0])
+        with use_shard(shard_for(self.owner.pk)):
+            self.assertFalse(ActionExecution.objects.exists())
+
+
+class RunActionTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        for alias in settings.DATABASE_SHARDS:
+            prepare_shard(alias)
+        self.user = User.objects.create_user(username='runner', email='runner@example.com', password='x')
+        self.action = Action.objects.create(name='Summarize', action_type=ActionType.SUMMARIZE_TEXT, description='Summarize')
+
+    def test_failing_handler_is_rolled_back_alone(self):
+        def failing(execution, **kwargs):
+            ActionExecution.objects.create(action=self.action, executed_by=self.user, status='completed')
+            raise RuntimeError('handler failed')
+
+        with use_shard(shard_for(self.user.pk)) as alias, transaction.atomic(using=alias):
+            first, second = ActionExecution.objects.bulk_create([
+                ActionExecution(action=self.action, executed_by=self.user, status='running') for _ in range(2)
+            ])
+            with mock.patch.dict(_handlers, {ActionType.SUMMARIZE_TEXT: failing}):
+                run_action(first)
+            run_action(second)
+            self.assertEqual(ActionExecution.objects.count(), 2)
+
+        with use_shard(alias):
+            first.refresh_from_db()
+            second.refresh_from_db()
+        self.assertEqual((first.status, first.error_message), ('failed', 'handler failed'))
+        self.assertEqual(second.status, 'completed')
+
+
+class ConfigValidationTests(SimpleTestCase):
+    def setUp(self):
+        validation._validators.clear()
+        self.addCleanup(validation._validators.clear)
+        self.action = Action(
+            id=1, name='Send Email', action_type=ActionType.SEND_EMAIL, requires_config=True,
+            config_schema={'to': 'string', 'subject': 'string'},
+        )
+
+    def test_valid_config_passes(self):
+        validation.validate_config(self.action, {'to': 'someone@example.com', 'subject': 'hi'})
+
+    def test_invalid_config_is_rejected_readably(self):
+        with self.assertRaisesMessage(ValidationError, 'Invalid config for Send Email: data.to must be string'):
+            validation.validate_config(self.action, {'to': 5})
+        # Actions that require a config refuse an empty one.
+        with self.assertRaisesMessage(ValidationError, 'Invalid config for Send Email: data must contain at least 1'):
+            validation.validate_config(self.action, None)
+
+    def test_schema_is_compiled_once_until_it_changes(self):
+        with mock.patch('actions.validation.fastjsonschema.compile', wraps=validation.fastjsonschema.compile) as compile:
+            for _ in range(3):
+                validation.validate_config(self.action, {'to': 'someone@example.com'})
+            self.assertEqual(compile.call_count, 1)
+
+            self.action.config_schema['to'] = 'integer'
+            validation.validate_config(self.action, {'to': 5})
+            self.assertEqual(compile.call_count, 2)
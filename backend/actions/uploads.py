@@ -0,0 +1,116 @@
+"""
+UPLOAD_CONTENT: copy content to a destination.
+
+The content is first stored in the blob store (``taskpilotx.blobs``), so
+executions reference it by hash instead of carrying it in ``config_data`` and
+identical uploads are stored once. It is then streamed chunk by chunk to the
+destination named in the config as ``<destination>:<path>``; destinations are
+configured in ``UPLOAD_DESTINATIONS`` (``local`` writes below the executing
+user's own directory in ``UPLOAD_LOCAL_ROOT``).
+
+Config: ``destination`` plus either ``blob`` (the hash returned by
+``POST /api/uploads/``, which must have been uploaded by the user running the
+action), ``content`` (small inline text, at most ``UPLOAD_INLINE_MAX_BYTES``),
+or nothing to upload the triggering message. Inline content is moved to the
+blob store by ``store_inline_content()`` before the execution is created.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils.module_loading import import_string
+
+from taskpilotx.blobs import BlobTooLarge, get_blob_store, owns_blob, record_owner
+from .handlers import register
+from .models import ActionType
+
+
+class Destination:
+    def write(self, owner_id, path, chunks):
+        """Write ``chunks`` to ``path`` for user ``owner_id``; returns where the content ended up."""
+        raise NotImplementedError
+
+
+class LocalDestination(Destination):
+    def __init__(self, root=None):
+        self.root = Path(root or settings.UPLOAD_LOCAL_ROOT).resolve()
+
+    def write(self, owner_id, path, chunks):
+        # Each user has a directory of their own, so the same path never names another user's file.
+        root = self.root / str(owner_id)
+        target = (root / path).resolve()
+        if root not in target.parents:
+            raise ValueError(f'Upload path escapes the destination: {path!r}')
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return str(target)
+
+
+_destinations = {}
+
+
+def get_destination(name):
+    if name not in settings.UPLOAD_DESTINATIONS:
+        raise ValueError(f'Unknown upload destination: {name!r}')
+    if name not in _destinations:
+        _destinations[name] = import_string(settings.UPLOAD_DESTINATIONS[name])()
+    return _destinations[name]
+
+
+def store_inline_content(action, config_data, user_id):
+    """The config to store for an execution of ``action``: inline ``content`` replaced by its blob.
+
+    Raises ``ValidationError`` when the content is over ``UPLOAD_INLINE_MAX_BYTES``.
+    """
+    if action.action_type != ActionType.UPLOAD_CONTENT or not isinstance(config_data, dict) \
+            or config_data.get('content') is None:
+        return config_data
+    try:
+        blob = get_blob_store().put_text(str(config_data['content']), max_size=settings.UPLOAD_INLINE_MAX_BYTES)
+    except BlobTooLarge:
+        raise ValidationError(
+            f'Inline content exceeds {settings.UPLOAD_INLINE_MAX_BYTES} bytes; upload it to /api/uploads/ instead'
+        )
+    record_owner(user_id, blob.hash)
+    return {**config_data, 'content': None, 'blob': blob.hash}
+
+
+@register(ActionType.UPLOAD_CONTENT)
+def upload_content(execution, message=None, task_execution=None):
+    config = execution.config_data or {}
+    name, _, path = (config.get('destination') or '').partition(':')
+    if not name:
+        raise ValueError('No destination: set "destination" in the action config')
+    destination = get_destination(name)
+    store = get_blob_store()
+
+    if config.get('blob'):
+        # Blobs of other users are as unknown as missing ones.
+        if not owns_blob(execution.executed_by_id, config['blob']):
+            raise ValueError(f'Unknown blob: {config["blob"]}')
+        digest, size = config['blob'], store.size(config['blob'])
+    elif config.get('content') is not None:
+        # Executions are created with the content already moved to a blob.
+        raise ValueError('Inline content was not stored; create the execution with store_inline_content()')
+    elif message is not None and message.content_hash:
+        # Offloaded bodies are already in the store.
+        digest, size = message.content_hash, store.size(message.content_hash)
+    elif message is not None:
+        digest, size = store.put_text(message.content)
+        record_owner(execution.executed_by_id, digest)
+    else:
+        raise ValueError('Nothing to upload: set "blob" or "content" in the action config')
+
+    location = destination.write(execution.executed_by_id, path or digest, store.iter_chunks(digest))
+    return {'blob': digest, 'size': size, 'destination': name, 'location': location}
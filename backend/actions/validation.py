@@ -0,0 +1,56 @@
+"""
+Validation of action configs against ``Action.config_schema``.
+
+Schemas are compiled once with fastjsonschema and cached per action together
+with the schema they were compiled from; an edited schema no longer equals the
+cached one and is recompiled on first use. Besides full
+JSON Schemas, ``config_schema`` may use the shorthand of the default actions,
+``{"field": "type"}``, which declares the type of each known field.
+"""
+import copy
+import threading
+
+import fastjsonschema
+from django.core.exceptions import ValidationError
+
+
+_validators = {}  # action id -> (config_schema, requires_config, compiled validator)
+_lock = threading.Lock()
+
+SCHEMA_KEYWORDS = {'$schema', 'type', 'properties', 'required', 'anyOf', 'oneOf', 'allOf'}
+
+
+def json_schema(action):
+    """Return ``action.config_schema`` as a JSON Schema."""
+    schema = action.config_schema if isinstance(action.config_schema, dict) else {}
+    if SCHEMA_KEYWORDS & schema.keys():
+        return schema
+    expanded = {
+        'type': 'object',
+        'properties': {field: {'type': kind} for field, kind in schema.items()},
+    }
+    if action.requires_config:
+        expanded['minProperties'] = 1
+    return expanded
+
+
+def get_validator(action):
+    cached = _validators.get(action.id)
+    # Comparing the (small) schemas is cheaper than serializing and hashing them.
+    if cached is not None and cached[0] == action.config_schema and cached[1] == action.requires_config:
+        return cached[2]
+    validator = fastjsonschema.compile(json_schema(action))
+    with _lock:
+        # A copy, so changes to the action's schema in place still miss.
+        _validators[action.id] = (copy.deepcopy(action.config_schema), action.requires_config, validator)
+    return validator
+
+
+def validate_config(action, config_data):
+    """Raise ``ValidationError`` unless ``config_data`` is valid for ``action``."""
+    try:
+        get_validator(action)(config_data if config_data is not None else {})
+    except fastjsonschema.JsonSchemaValueException as e:
+        raise ValidationError(f'Invalid config for {action.name}: {e.message}')
+    except fastjsonschema.JsonSchemaDefinitionException as e:
+        raise ValidationError(f'Invalid config schema for {action.name}: {e}')
@@ -1,3 +1,25 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
-# Create your views here.
+from taskpilotx.blobs import BlobTooLarge, CHUNK_SIZE, get_blob_store, record_owner
+
+
+@csrf_exempt
+@require_POST
+def upload_view(request):
+    """Store the raw request body as a blob for UPLOAD_CONTENT.
+
+    The body is streamed to disk in chunks; the response holds the ``blob``
+    hash to pass in the action config, which only the uploading user may use.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    chunks = iter(lambda: request.read(CHUNK_SIZE), b'')
+    try:
+        blob = get_blob_store().put(chunks, max_size=settings.UPLOAD_MAX_BYTES)
+    except BlobTooLarge as e:
+        return JsonResponse({'error': str(e)}, status=413)
+    record_owner(request.user.pk, blob.hash)
+    return JsonResponse({'blob': blob.hash, 'size': blob.size}, status=201)
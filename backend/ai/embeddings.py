@@ -0,0 +1,356 @@
+"""
+Embedding store for semantic task matching.
+
+Task prompts and messages are embedded in batches and kept per user in
+on-disk shards: a contiguous float32 matrix that is memory-mapped for search,
+plus the row ids and a hash of the embedded text. Shards are refreshed
+incrementally from ``updated_at`` and only rows whose text changed are
+re-embedded, ``batch_size`` rows at a time: their vectors are spooled to disk,
+so a refresh holds one batch of texts however many rows changed, and a shard
+is only rewritten when its vectors changed. ``shortlist_tasks`` embeds a batch of messages together and scores
+each against every task prompt of its owner with a single matrix-vector
+product, so only the best few candidates ever reach the LLM.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+
+TOKEN_RE = re.compile(r'\w+')
+MESSAGE_TEXT_LIMIT = 4000
+
+
+class Embedder:
+    """Turns texts into L2-normalised float32 vectors of size ``dim``."""
+
+    dim = 256
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic local embedder based on feature hashing.
+
+    Needs no network or model files and gives identical vectors in every
+    process, which makes it suitable for tests and local development.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = TOKEN_RE.findall((text or '').lower())
+            features = tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+                sign = 1.0 if digest & 1 else -1.0
+                vectors[row, (digest >> 1) % self.dim] += sign
+        return _normalise(vectors)
+
+
+class OpenAIEmbedder(Embedder):
+    """Embedder backed by the OpenAI embeddings endpoint."""
+
+    def __init__(self, model='text-embedding-3-small', dim=1536):
+        from openai import OpenAI
+
+        self.model = model
+        self.dim = dim
+        self.client = OpenAI()
+
+    def embed(self, texts):
+        response = self.client.embeddings.create(model=self.model, input=list(texts), dimensions=self.dim)
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        return _normalise(vectors)
+
+
+def _normalise(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+
+def _text_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little', signed=True)
+
+
+@lru_cache(maxsize=None)
+def get_embedder():
+    """Return the embedder configured by ``AI_EMBEDDER``."""
+    return import_string(settings.AI_EMBEDDER)()
+
+
+def embed_in_batches(embedder, texts, batch_size):
+    if not texts:
+        return np.zeros((0, embedder.dim), dtype=np.float32)
+    batches = [embedder.embed(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+    return np.concatenate(batches).astype(np.float32, copy=False)
+
+
+class EmbeddingShard:
+    """Vectors of one kind (``tasks`` or ``messages``) for one user.
+
+    Each write goes to a new generation directory (``tasks.<suffix>/`` with the
+    vectors and the rows), and only then is the manifest (``tasks.json``),
+    which names the current generation, atomically replaced. Readers in other
+    processes open the files of the generation the manifest names, so they
+    never mix the files of two writes. The generation before the current one is
+    kept for readers that are still opening it; older ones are removed. There
+    should be a single writer per shard (the refresh command or worker that
+    owns the user).
+    """
+
+    def __init__(self, root, user_id, kind, dim):
+        self.directory = Path(root) / str(user_id)
+        self.kind = kind
+        self.dim = dim
+        self.meta_path = self.directory / f'{kind}.json'
+        self._loaded_mtime = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.hashes = np.zeros(0, dtype=np.int64)
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.meta = {}
+
+    def load(self):
+        """(Re)load the shard if it changed on disk since the last load."""
+        # A generation read from the manifest can be removed by two later
+        # writes before its files are opened; the manifest is then read again.
+        for _ in range(3):
+            try:
+                mtime = self.meta_path.stat().st_mtime_ns
+                if mtime == self._loaded_mtime:
+                    return self
+                meta = json.loads(self.meta_path.read_text())
+            except FileNotFoundError:
+                return self
+            if meta.get('dim') != self.dim or not meta.get('generation'):
+                # Embedder or layout changed; the shard is rebuilt from scratch on refresh.
+                return self
+            generation = self.directory / meta['generation']
+            try:
+                with np.load(generation / 'rows.npz') as rows:
+                    ids, hashes = rows['ids'], rows['hashes']
+                if len(ids):
+                    vectors = np.memmap(generation / 'vectors.f32', dtype=np.float32, mode='r', shape=(len(ids), self.dim))
+                else:
+                    vectors = np.zeros((0, self.dim), dtype=np.float32)
+            except FileNotFoundError:
+                continue
+            self.ids, self.hashes, self.vectors = ids, hashes, vectors
+            self.meta = meta
+            self._loaded_mtime = mtime
+            return self
+        return self
+
+    @property
+    def watermark(self):
+        value = self.meta.get('watermark')
+        return parse_datetime(value) if value else None
+
+    def write(self, ids, hashes, vectors, watermark):
+        """Write a new generation; ``vectors`` is an array or an iterable of row blocks."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        previous = self._current_generation()
+        generation = Path(tempfile.mkdtemp(prefix=f'{self.kind}.', dir=self.directory))
+        if isinstance(vectors, np.ndarray):
+            vectors = [vectors]
+        with open(generation / 'vectors.f32', 'wb') as f:
+            for block in vectors:
+                np.ascontiguousarray(block, dtype=np.float32).tofile(f)
+        np.savez(generation / 'rows.npz', ids=ids, hashes=hashes)
+        self._write_meta(generation.name, len(ids), watermark)
+        self._remove_generations(keep={generation.name, previous})
+        self._loaded_mtime = None
+        return self.load()
+
+    def advance(self, watermark):
+        """Move the watermark of the current generation, which stays as it is."""
+        self._write_meta(self.meta['generation'], len(self.ids), watermark)
+        self.meta['watermark'] = watermark.isoformat() if watermark else None
+        self._loaded_mtime = self.meta_path.stat().st_mtime_ns
+        return self
+
+    def _write_meta(self, generation, count, watermark):
+        meta = {
+            'dim': self.dim, 'count': int(count),
+            'watermark': watermark.isoformat() if watermark else None, 'generation': generation,
+        }
+        _atomic_write(self.meta_path, lambda f: f.write(json.dumps(meta).encode()))
+
+    def _current_generation(self):
+        try:
+            return json.loads(self.meta_path.read_text()).get('generation')
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _remove_generations(self, keep):
+        for path in self.directory.glob(f'{self.kind}.*'):
+            if path == self.meta_path or path.name in keep:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                # Files of the layout before generations.
+                path.unlink(missing_ok=True)
+
+    def top_k(self, query, k):
+        """Return ``[(id, score), ...]`` for the ``k`` rows most similar to ``query``."""
+        if not len(self.ids) or k <= 0:
+            return []
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(self.ids[i]), float(scores[i])) for i in best]
+
+
+def _atomic_write(path, writer):
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as f:
+        writer(f)
+    os.replace(tmp_path, path)
+
+
+class EmbeddingIndex:
+    """Per-user embedding shards for task prompts and messages."""
+
+    def __init__(self, embedder=None, root=None, batch_size=None):
+        self.embedder = embedder or get_embedder()
+        self.root = Path(root or settings.EMBEDDING_STORE_DIR)
+        self.batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def shard(self, user_id, kind):
+        key = (user_id, kind)
+        with self._lock:
+            if key not in self._shards:
+                self._shards[key] = EmbeddingShard(self.root, user_id, kind, self.embedder.dim)
+            return self._shards[key].load()
+
+    def refresh_tasks(self, user_id):
+        """Embed new or changed prompts of the user's active tasks."""
+        from tasks.models import Task
+
+        shard = self.shard(user_id, 'tasks')
+        live = Task.objects.filter(owner_id=user_id, is_active=True, completed=False)
+        changed = live.filter(updated_at__gt=shard.watermark) if shard.watermark else live
+        rows = (
+            (pk, prompt or '', updated_at)
+            for pk, prompt, updated_at in changed.values_list('id', 'prompt', 'updated_at').iterator(chunk_size=2000)
+        )
+        live_ids = np.fromiter(live.values_list('id', flat=True), dtype=np.int64)
+        return self._refresh(shard, rows, live_ids)
+
+    def refresh_messages(self, user_id):
+        """Embed new or changed messages of the user."""
+        from messages_app.content import full_content
+        from messages_app.models import Message
+
+        shard = self.shard(user_id, 'messages')
+        live = Message.objects.filter(owner_id=user_id)
+        changed = live.filter(updated_at__gt=shard.watermark) if shard.watermark else live
+        rows = (
+            (message.pk, message_text(message.title, message.summary, full_content(message, MESSAGE_TEXT_LIMIT)),
+             message.updated_at)
+            for message in changed.only('id', 'title', 'summary', 'content', 'content_hash', 'updated_at')
+            .iterator(chunk_size=2000)
+        )
+        live_ids = np.fromiter(live.values_list('id', flat=True), dtype=np.int64)
+        return self._refresh(shard, rows, live_ids)
+
+    def _refresh(self, shard, rows, live_ids):
+        """Merge the changed ``rows`` (an iterable) into the shard; returns the number of rows embedded."""
+        keep = np.isin(shard.ids, live_ids)
+        position = {int(pk): i for i, pk in enumerate(shard.ids)}
+        watermark = shard.watermark
+        fresh_ids, fresh_hashes = [], []
+        rows = iter(rows)
+        with tempfile.TemporaryFile() as spool:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                stale = []
+                for pk, text, updated_at in batch:
+                    watermark = updated_at if watermark is None else max(watermark, updated_at)
+                    text_hash = _text_hash(text)
+                    i = position.get(pk)
+                    if i is None or not keep[i] or shard.hashes[i] != text_hash:
+                        stale.append((pk, text, text_hash))
+                if stale:
+                    vectors = self.embedder.embed([text for _, text, _ in stale])
+                    np.ascontiguousarray(vectors, dtype=np.float32).tofile(spool)
+                    fresh_ids += [pk for pk, _, _ in stale]
+                    fresh_hashes += [text_hash for _, _, text_hash in stale]
+
+            if not fresh_ids and keep.all():
+                if watermark != shard.watermark and shard.meta.get('generation'):
+                    shard.advance(watermark)
+                return 0
+
+            replaced = np.array([position[pk] for pk in fresh_ids if pk in position], dtype=np.int64)
+            keep[replaced] = False
+            ids = np.concatenate([shard.ids[keep], np.array(fresh_ids, dtype=np.int64)])
+            hashes = np.concatenate([shard.hashes[keep], np.array(fresh_hashes, dtype=np.int64)])
+            spool.seek(0)
+            shard.write(ids, hashes, self._blocks(shard.vectors, keep, spool, len(fresh_ids)), watermark)
+        return len(fresh_ids)
+
+    def _blocks(self, vectors, keep, spool, fresh_count):
+        """The kept rows of ``vectors``, then the ``fresh_count`` spooled ones, a block at a time."""
+        block = max(self.batch_size, 1024)
+        for start in range(0, len(keep), block):
+            yield np.asarray(vectors[start:start + block])[keep[start:start + block]]
+        for start in range(0, fresh_count, block):
+            count = min(block, fresh_count - start)
+            yield np.fromfile(spool, dtype=np.float32, count=count * self.embedder.dim).reshape(count, -1)
+
+    def shortlist_tasks(self, messages, k=None, min_score=None):
+        """Return, for each of ``messages``, ``[(task_id, score), ...]`` for the tasks closest to it.
+
+        The messages are embedded together, in batches of ``batch_size``.
+        """
+        k = k or settings.AI_SHORTLIST_SIZE
+        min_score = settings.AI_SHORTLIST_MIN_SCORE if min_score is None else min_score
+        from messages_app.content import full_content
+
+        texts = [
+            message_text(message.title, message.summary, full_content(message, MESSAGE_TEXT_LIMIT))
+            for message in messages
+        ]
+        queries = embed_in_batches(self.embedder, texts, self.batch_size)
+        return [
+            [(task_id, score) for task_id, score in self.shard(message.owner_id, 'tasks').top_k(query, k) if score >= min_score]
+            for message, query in zip(messages, queries)
+        ]
+
+
+def message_text(title, summary, content):
+    return '\n'.join(part for part in (title, summary, (content or '')[:MESSAGE_TEXT_LIMIT]) if part)
+
+
+_index = None
+
+
+def get_index():
+    """Process-wide ``EmbeddingIndex`` using the configured embedder."""
+    global _index
+    if _index is None:
+        _index = EmbeddingIndex()
+    return _index
@@ -0,0 +1,356 @@
+"""
+Gateway for every LLM call made by the backend.
+
+Requests are coalesced while in flight (identical prompts share one call),
+admitted through per-user and global request/token budgets, grouped into
+small batches and dispatched to the configured backend with a bounded number
+of concurrent calls, per-attempt timeouts and retries with jittered
+exponential backoff. Only the requests of a batch that failed are sent again,
+and every attempt, retries included, is charged against the budgets.
+``AI_QUEUE_TIMEOUT`` bounds the wait for budget and a free slot; once a
+request is sent, the per-attempt timeout and retries bound it.
+
+A batch is only a unit of dispatch. ``OpenAIBackend`` sends it as concurrent
+individual requests, one per prompt, so batching saves neither requests nor
+tokens; each request counts on its own against the request budgets.
+
+The gateway runs its own event loop on a daemon thread, so synchronous Django
+code calls ``complete()`` and async code awaits ``acomplete()``; both end up on
+the same loop and share budgets and in-flight state.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+Completion = namedtuple('Completion', ['text', 'prompt_tokens', 'completion_tokens'])
+
+
+class AIGatewayError(Exception):
+    """Raised when a request cannot be completed."""
+
+
+class TransientBackendError(AIGatewayError):
+    """A backend failure worth retrying (rate limit, timeout, 5xx)."""
+
+
+class AIRequest:
+    __slots__ = ('kind', 'prompt', 'system', 'user_id', 'max_tokens', 'json_output', 'key', 'future', 'sent')
+
+    def __init__(self, kind, prompt, system='', user_id=None, max_tokens=256, json_output=False):
+        self.kind = kind
+        self.prompt = prompt
+        self.system = system
+        self.user_id = user_id
+        self.max_tokens = max_tokens
+        self.json_output = json_output
+        # The user is not part of the key: identical prompts are paid for once.
+        fingerprint = json.dumps([kind, system, prompt, max_tokens, json_output])
+        self.key = hashlib.blake2b(fingerprint.encode(), digest_size=16).hexdigest()
+        self.future = None
+        self.sent = None
+
+    @property
+    def estimated_tokens(self):
+        return math.ceil((len(self.system) + len(self.prompt)) / 4) + self.max_tokens
+
+
+# Backends
+
+class Backend:
+    """Completes a batch of requests, returning one result per request.
+
+    A result is a ``Completion`` or the exception that request failed with;
+    requests that failed with ``TransientBackendError`` are retried on their
+    own. Raising ``TransientBackendError`` makes the gateway retry the whole
+    batch.
+    """
+
+    async def complete_batch(self, requests):
+        raise NotImplementedError
+
+
+class FakeBackend(Backend):
+    """Deterministic local backend for tests and development; never hits the network."""
+
+    async def complete_batch(self, requests):
+        return [self._complete(request) for request in requests]
+
+    def _complete(self, request):
+        if request.json_output:
+            text = json.dumps({'execute': False, 'action_ids': [], 'reasoning': 'Fake backend: no AI decision'})
+        else:
+            text = request.prompt
+            text = f"AI Summary: {text[:100] + '...' if len(text) > 100 else text}"
+        return Completion(text=text, prompt_tokens=request.estimated_tokens - request.max_tokens, completion_tokens=len(text) // 4)
+
+
+class OpenAIBackend(Backend):
+    """Chat completions backend.
+
+    There is no batch call: ``complete_batch`` sends one chat completion request
+    per prompt, concurrently, and each is billed and rate limited by the API on
+    its own.
+    """
+
+    def __init__(self, model=None):
+        import openai
+
+        self.openai = openai
+        self.model = model or settings.AI_MODEL
+        # Each request times out on its own, so the others' completions are kept.
+        self.client = openai.AsyncOpenAI(max_retries=0, timeout=settings.AI_REQUEST_TIMEOUT)
+
+    async def complete_batch(self, requests):
+        """Concurrent individual requests; each returns its completion or its error."""
+        return await asyncio.gather(*(self._complete(request) for request in requests), return_exceptions=True)
+
+    async def _complete(self, request):
+        messages = [{'role': 'user', 'content': request.prompt}]
+        if request.system:
+            messages.insert(0, {'role': 'system', 'content': request.system})
+        extra = {'response_format': {'type': 'json_object'}} if request.json_output else {}
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model, messages=messages, max_tokens=request.max_tokens, **extra
+            )
+        except (self.openai.RateLimitError, self.openai.APITimeoutError,
+                self.openai.APIConnectionError, self.openai.InternalServerError) as e:
+            raise TransientBackendError(str(e)) from e
+        usage = response.usage
+        return Completion(
+            text=response.choices[0].message.content or '',
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+        )
+
+
+# Budgets
+
+class TokenBucket:
+    """Async token bucket; ``acquire`` waits until ``amount`` tokens are available."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        # Requests larger than the bucket would otherwise wait forever.
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class Budget:
+    """Requests-per-minute and tokens-per-minute limits; 0 disables a limit."""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    async def acquire(self, tokens, requests=1):
+        if self.requests:
+            await self.requests.acquire(requests)
+        if self.tokens:
+            await self.tokens.acquire(tokens)
+
+
+# Gateway
+
+class AIGateway:
+    def __init__(self, backend=None, max_batch_size=None, max_batch_wait=None, max_concurrency=None,
+                 global_rpm=None, global_tpm=None, user_rpm=None, user_tpm=None,
+                 timeout=None, max_retries=None, queue_timeout=None):
+        self.backend = backend or import_string(settings.AI_BACKEND)()
+        self.max_batch_size = max_batch_size or settings.AI_MAX_BATCH_SIZE
+        self.max_batch_wait = settings.AI_MAX_BATCH_WAIT if max_batch_wait is None else max_batch_wait
+        self.max_concurrency = max_concurrency or settings.AI_MAX_CONCURRENCY
+        self.global_limits = (global_rpm if global_rpm is not None else settings.AI_GLOBAL_RPM,
+                              global_tpm if global_tpm is not None else settings.AI_GLOBAL_TPM)
+        self.user_limits = (user_rpm if user_rpm is not None else settings.AI_USER_RPM,
+                            user_tpm if user_tpm is not None else settings.AI_USER_TPM)
+        self.timeout = timeout or settings.AI_REQUEST_TIMEOUT
+        self.max_retries = settings.AI_MAX_RETRIES if max_retries is None else max_retries
+        self.queue_timeout = queue_timeout or settings.AI_QUEUE_TIMEOUT
+
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    # Public API
+
+    def complete(self, prompt, kind='completion', **kwargs):
+        """Blocking call for synchronous code."""
+        future = asyncio.run_coroutine_threadsafe(self._submit(AIRequest(kind, prompt, **kwargs)), self._ensure_loop())
+        return future.result()
+
+    async def acomplete(self, prompt, kind='completion', **kwargs):
+        """Awaitable call usable from any event loop."""
+        future = asyncio.run_coroutine_threadsafe(self._submit(AIRequest(kind, prompt, **kwargs)), self._ensure_loop())
+        return await asyncio.wrap_future(future)
+
+    # Event loop
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                self._thread = threading.Thread(target=self._run_loop, args=(loop, ready), name='ai-gateway', daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def _run_loop(self, loop, ready):
+        asyncio.set_event_loop(loop)
+        self._queue = asyncio.Queue()
+        self._inflight = {}
+        self._user_budgets = {}
+        self._global_budget = Budget(*self.global_limits)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        loop.create_task(self._batcher())
+        loop.call_soon(ready.set)
+        loop.run_forever()
+
+    # Runs on the gateway loop
+
+    async def _submit(self, request):
+        shared = self._inflight.get(request.key)
+        if shared is not None:
+            return await asyncio.shield(shared)
+
+        request.future = asyncio.get_running_loop().create_future()
+        request.sent = asyncio.Event()
+        self._inflight[request.key] = request.future
+        try:
+            try:
+                await asyncio.wait_for(self._enqueue(request), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if not request.future.done():
+                    request.future.set_exception(AIGatewayError('AI request timed out waiting for capacity'))
+            # Waiters sharing this future see the same outcome.
+            return await asyncio.shield(request.future)
+        finally:
+            self._inflight.pop(request.key, None)
+
+    async def _enqueue(self, request):
+        """Wait until ``request`` is sent to the backend (or fails before)."""
+        if request.user_id is not None:
+            await self._user_budget(request.user_id).acquire(request.estimated_tokens)
+        await self._queue.put(request)
+        await request.sent.wait()
+
+    def _user_budget(self, user_id):
+        budget = self._user_budgets.get(user_id)
+        if budget is None:
+            budget = self._user_budgets[user_id] = Budget(*self.user_limits)
+        return budget
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_batch_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            batch = [request for request in batch if not request.future.done()]
+            if batch:
+                await self._slots.acquire()
+                loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        try:
+            await self._call_with_retries(batch)
+        except Exception as e:
+            error = e if isinstance(e, AIGatewayError) else AIGatewayError(str(e))
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(error)
+        finally:
+            for request in batch:
+                request.sent.set()
+            self._slots.release()
+
+    async def _charge(self, batch, retry):
+        # A batch is sent as one request per prompt, so each counts globally.
+        await self._global_budget.acquire(sum(request.estimated_tokens for request in batch), len(batch))
+        if retry:
+            # Users were charged once on admission; a retry sends their prompts again.
+            for request in batch:
+                if request.user_id is not None:
+                    await self._user_budget(request.user_id).acquire(request.estimated_tokens)
+
+    async def _call_with_retries(self, batch):
+        """Resolve the futures of ``batch``, sending again only the requests that failed transiently."""
+        pending = batch
+        for attempt in range(self.max_retries + 1):
+            await self._charge(pending, retry=attempt > 0)
+            if attempt == 0:
+                for request in pending:
+                    request.sent.set()
+                # Some may have timed out waiting for the global budget.
+                pending = [request for request in pending if not request.future.done()]
+            try:
+                results = await asyncio.wait_for(self.backend.complete_batch(pending), self.timeout)
+            except (asyncio.TimeoutError, TransientBackendError):
+                failed = pending
+            else:
+                failed = []
+                for request, result in zip(pending, results):
+                    if isinstance(result, TransientBackendError):
+                        failed.append(request)
+                    elif request.future.done():
+                        continue
+                    elif isinstance(result, AIGatewayError):
+                        request.future.set_exception(result)
+                    elif isinstance(result, BaseException):
+                        request.future.set_exception(AIGatewayError(str(result)))
+                    else:
+                        request.future.set_result(result)
+            pending = [request for request in failed if not request.future.done()]
+            if not pending:
+                return
+            if attempt < self.max_retries:
+                # Full jitter keeps retrying workers from synchronising.
+                await asyncio.sleep(random.uniform(0, min(30.0, 0.5 * 2 ** attempt)))
+        error = AIGatewayError(f'AI backend failed after {self.max_retries + 1} attempts')
+        for request in pending:
+            request.future.set_exception(error)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Process-wide gateway built from settings."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = AIGateway()
+        return _gateway
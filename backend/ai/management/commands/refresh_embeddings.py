@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ai.embeddings import get_index
+from events.feed import ChangeFeed
+from events.outbox import topic
+from messages_app.models import Message
+from tasks.models import Task
+from taskpilotx.sharding import pin_process_shard
+
+
+class Command(BaseCommand):
+    help = 'Incrementally refresh the per-user embedding shards for task prompts and messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='Only refresh these user ids')
+        parser.add_argument('--kind', choices=['tasks', 'messages', 'all'], default='all')
+        parser.add_argument('--shard', choices=settings.DATABASE_SHARDS, default='default',
+                            help='Database shard to work on')
+
+    def handle(self, *args, **options):
+        pin_process_shard(options['shard'])
+        index = get_index()
+        feed = None
+        if options['users']:
+            user_ids = options['users']
+        else:
+            # Only users with task or message changes since the last run.
+            feed = ChangeFeed(topics=[topic(Task), topic(Message)], name='refresh_embeddings')
+            if feed.position is None:
+                feed.seek_latest()
+                user_ids = Task.objects.order_by().values_list('owner_id', flat=True).distinct()
+            else:
+                user_ids = sorted({event.owner_id for event in feed.read_all() if event.owner_id is not None})
+        for user_id in user_ids:
+            embedded = 0
+            if options['kind'] in ('tasks', 'all'):
+                embedded += index.refresh_tasks(user_id)
+            if options['kind'] in ('messages', 'all'):
+                embedded += index.refresh_messages(user_id)
+            self.stdout.write(f'user {user_id}: embedded {embedded} rows')
+        if feed is not None:
+            feed.commit()
@@ -0,0 +1,70 @@
+"""
+AI operations used by the rest of the backend.
+
+Every call goes through the gateway so that budgets, batching and request
+coalescing apply to all consumers.
+"""
+import json
+
+from messages_app.content import full_content
+from .gateway import get_gateway
+
+
+SUMMARY_SYSTEM_PROMPT = (
+    'Summarize the following message in at most two sentences. '
+    'Keep names, dates, amounts and requested actions.'
+)
+
+TASK_EVALUATION_SYSTEM_PROMPT = (
+    'You decide whether an automation task should run for an incoming message. '
+    'Reply with a JSON object: {"execute": true|false, "action_ids": [ids of the actions to run], '
+    '"reasoning": "one sentence"}. Only use action ids from the list you are given.'
+)
+
+MESSAGE_PROMPT_LIMIT = 4000
+
+
+def summarize_text(text, user_id=None):
+    """Return an AI summary of ``text``."""
+    completion = get_gateway().complete(
+        text[:MESSAGE_PROMPT_LIMIT], kind='summary', system=SUMMARY_SYSTEM_PROMPT, user_id=user_id, max_tokens=120
+    )
+    return completion.text.strip()
+
+
+def evaluate_task(task, message=None, actions=None):
+    """Ask the model whether ``task`` should run for ``message``.
+
+    Returns the decision stored in ``TaskExecution.ai_decision``:
+    ``{'execute': bool, 'action_ids': [...], 'reasoning': str}``.
+    """
+    actions = list(task.actions.all()) if actions is None else actions
+    allowed = {action.id for action in actions}
+    lines = [f'Task: {task.title}', f'Instructions: {task.prompt}', 'Available actions:']
+    lines += [f'- {action.id}: {action.name} ({action.action_type})' for action in actions]
+    if message is not None:
+        lines += [
+            '',
+            f'Message title: {message.title}',
+            f'Sender: {json.dumps(message.sender_info)}',
+            f'Priority: {message.priority}',
+            f'Content: {full_content(message, MESSAGE_PROMPT_LIMIT)}',
+        ]
+
+    completion = get_gateway().complete(
+        '\n'.join(lines), kind='task_evaluation', system=TASK_EVALUATION_SYSTEM_PROMPT,
+        user_id=task.owner_id, max_tokens=200, json_output=True,
+    )
+    try:
+        decision = json.loads(completion.text)
+    except ValueError:
+        return {'execute': False, 'action_ids': [], 'reasoning': 'Unparseable AI response'}
+    if not isinstance(decision, dict):
+        return {'execute': False, 'action_ids': [], 'reasoning': 'Unparseable AI response'}
+
+    action_ids = [int(pk) for pk in decision.get('action_ids') or [] if str(pk).isdigit() and int(pk) in allowed]
+    return {
+        'execute': bool(decision.get('execute')) and bool(action_ids),
+        'action_ids': action_ids,
+        'reasoning': str(decision.get('reasoning', ''))[:1000],
+    }
@@ -0,0 +1,172 @@
+import asyncio
+import tempfile
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from .embeddings import EmbeddingIndex, EmbeddingShard, HashingEmbedder
+from .gateway import AIGateway, FakeBackend, TransientBackendError
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__(dim=16)
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(len(texts))
+        return super().embed(texts)
+
+
+class EmbeddingShardTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+
+    def write(self, shard, ids):
+        vectors = np.eye(len(ids), 4, dtype=np.float32)
+        return shard.write(np.array(ids, dtype=np.int64), np.zeros(len(ids), dtype=np.int64), vectors, None)
+
+    def test_readers_see_whole_generations(self):
+        writer = EmbeddingShard(self.root, 1, 'tasks', 4)
+        reader = EmbeddingShard(self.root, 1, 'tasks', 4)
+        self.write(writer, [1, 2])
+        self.assertEqual(reader.load().ids.tolist(), [1, 2])
+        self.write(writer, [3])
+        self.assertEqual(reader.load().ids.tolist(), [3])
+        self.assertEqual(reader.vectors.shape, (1, 4))
+
+    def test_only_the_previous_generation_is_kept(self):
+        shard = EmbeddingShard(self.root, 1, 'tasks', 4)
+        names = [self.write(shard, [i]).meta['generation'] for i in range(3)]
+        self.assertEqual(len(set(names)), 3)
+        kept = sorted(path.name for path in shard.directory.iterdir() if path.is_dir())
+        self.assertEqual(kept, sorted(names[1:]))
+
+
+class RefreshTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.embedder = CountingEmbedder()
+        self.index = EmbeddingIndex(embedder=self.embedder, root=root.name, batch_size=2)
+        self.shard = self.index.shard(1, 'messages')
+
+    def refresh(self, texts, when, live=None):
+        rows = ((pk, text, datetime(2026, 1, when, tzinfo=timezone.utc)) for pk, text in texts.items())
+        return self.index._refresh(self.shard, rows, np.array(live or list(texts), dtype=np.int64))
+
+    def test_rows_are_embedded_in_batches(self):
+        texts = {pk: f'message {pk}' for pk in range(1, 6)}
+        self.assertEqual(self.refresh(texts, 1), 5)
+        self.assertEqual(self.embedder.calls, [2, 2, 1])
+        self.assertEqual(self.shard.ids.tolist(), [1, 2, 3, 4, 5])
+        np.testing.assert_array_equal(self.shard.vectors, self.embedder.embed(list(texts.values())))
+
+        # One changed, one gone: only the changed row is embedded again.
+        self.embedder.calls.clear()
+        self.assertEqual(self.refresh({2: 'changed'}, 2, live=[2, 3, 4, 5]), 1)
+        self.assertEqual(self.embedder.calls, [1])
+        self.assertEqual(self.shard.ids.tolist(), [3, 4, 5, 2])
+        np.testing.assert_array_equal(self.shard.vectors[-1], self.embedder.embed(['changed'])[0])
+
+    def test_unchanged_text_only_moves_the_watermark(self):
+        self.refresh({1: 'same'}, 1)
+        generation = self.shard.meta['generation']
+        self.assertEqual(self.refresh({1: 'same'}, 2), 0)
+        self.assertEqual(self.shard.meta['generation'], generation)
+        self.assertEqual(self.shard.watermark.day, 2)
+        self.assertEqual(EmbeddingShard(self.index.root, 1, 'messages', 16).load().watermark.day, 2)
+
+
+class ShortlistTests(SimpleTestCase):
+    def test_messages_are_embedded_together(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        embedder = CountingEmbedder()
+        index = EmbeddingIndex(embedder=embedder, root=root.name, batch_size=2)
+        prompts = ['invoice payment', 'team meeting']
+        index.shard(1, 'tasks').write(
+            np.array([10, 20], dtype=np.int64), np.zeros(2, dtype=np.int64), embedder.embed(prompts), None,
+        )
+        embedder.calls.clear()
+
+        messages = [
+            SimpleNamespace(owner_id=1, title=title, summary='', content=title, content_hash='')
+            for title in ('invoice payment', 'team meeting', 'invoice payment')
+        ]
+        shortlists = index.shortlist_tasks(messages, k=1)
+        self.assertEqual(embedder.calls, [2, 1])
+        self.assertEqual([[task_id for task_id, _ in shortlist] for shortlist in shortlists], [[10], [20], [10]])
+
+
+class FlakyBackend(FakeBackend):
+    """Fails the first attempt of every batch."""
+
+    def __init__(self):
+        self.attempts = 0
+
+    async def complete_batch(self, requests):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise TransientBackendError('rate limited')
+        return await super().complete_batch(requests)
+
+
+class OneFlakyPromptBackend(FakeBackend):
+    """Fails the prompt 'flaky' transiently on its first attempt; records what each call sent."""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+
+    async def complete_batch(self, requests):
+        self.calls.append(sorted(request.prompt for request in requests))
+        await asyncio.sleep(self.delay)
+        return [
+            TransientBackendError('rate limited') if request.prompt == 'flaky' and len(self.calls) == 1
+            else self._complete(request)
+            for request in requests
+        ]
+
+
+class GatewayTests(SimpleTestCase):
+    def test_retries_are_charged_against_the_budgets(self):
+        backend = FlakyBackend()
+        gateway = AIGateway(
+            backend=backend, max_batch_wait=0, global_rpm=6, global_tpm=600, user_rpm=6, user_tpm=600,
+            timeout=5, max_retries=1, queue_timeout=5,
+        )
+        self.assertTrue(gateway.complete('x' * 40, user_id=1, max_tokens=90).text)
+        self.assertEqual(backend.attempts, 2)
+
+        # 100 tokens and one request per attempt; the backoff before the retry
+        # refills less than half of either.
+        global_budget, user_budget = gateway._global_budget, gateway._user_budgets[1]
+        self.assertLess(global_budget.tokens.tokens, 450)
+        self.assertLess(global_budget.requests.tokens, 4.5)
+        self.assertLess(user_budget.tokens.tokens, 450)
+
+    def test_only_failed_requests_are_retried(self):
+        backend = OneFlakyPromptBackend()
+        gateway = AIGateway(
+            backend=backend, max_batch_wait=0.2, global_rpm=0, global_tpm=0, user_rpm=0, user_tpm=0,
+            timeout=5, max_retries=1, queue_timeout=5,
+        )
+
+        async def complete_both():
+            return await asyncio.gather(gateway.acomplete('flaky'), gateway.acomplete('steady'))
+
+        completions = asyncio.run(complete_both())
+        self.assertEqual([completion.text for completion in completions], ['AI Summary: flaky', 'AI Summary: steady'])
+        self.assertEqual(backend.calls, [['flaky', 'steady'], ['flaky']])
+
+    def test_queue_timeout_does_not_cover_the_backend_call(self):
+        gateway = AIGateway(
+            backend=OneFlakyPromptBackend(delay=0.3), max_batch_wait=0, global_rpm=0, global_tpm=0,
+            user_rpm=0, user_tpm=0, timeout=5, max_retries=0, queue_timeout=0.1,
+        )
+        self.assertEqual(gateway.complete('steady').text, 'AI Summary: steady')
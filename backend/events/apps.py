@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class EventsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'events'
+
+    def ready(self):
+        # Records deletes (including cascades) of every model using the outbox.
+        from .outbox import connect_delete_receivers
+        connect_delete_receivers()
@@ -0,0 +1,180 @@
+"""
+Change feed: incremental reads of the outbox.
+
+The cursor is the event id. Ids are handed out before commit, so on
+PostgreSQL a transaction can commit an event below ids that are already
+visible; a reader that skipped over it would lose it. ``read()`` therefore
+stops at the first gap until every transaction that was running when the gap
+was seen has finished (``pg_current_snapshot()``); after that the gap is a
+rollback and is passed. SQLite serializes writers, so its ids commit in order.
+
+``wait()`` blocks until new events may be there: on PostgreSQL it LISTENs on
+the channel notified by a trigger on the events table, elsewhere it sleeps for
+``CHANGE_FEED_POLL_SECONDS``.
+"""
+import select
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from taskpilotx.sharding import shard_db
+from .models import ChangeEvent, FeedCursor
+
+
+CHANNEL = 'change_events'
+
+
+class ChangeFeed:
+    """Reader of the events of ``topics`` (all topics when ``None``).
+
+    A ``name`` makes the position durable: it is loaded from and saved to
+    ``FeedCursor`` (by ``commit()``), so a restarted consumer resumes where it
+    left off. Unnamed feeds start at the current end of the feed. Events are
+    read from the database of ``using``, by default the current shard.
+    """
+
+    def __init__(self, topics=None, name=None, batch_size=None, using=None):
+        self.topics = list(topics) if topics is not None else None
+        self.name = name
+        self.batch_size = batch_size or settings.CHANGE_FEED_BATCH_SIZE
+        self.using = using or shard_db()
+        self._listening = None  # raw connection the LISTEN was issued on
+        self._gap = None  # (events visible when a gap was seen, snapshot at that time)
+        if name:
+            cursor = FeedCursor.objects.using(self.using).filter(name=name).first()
+            self.position = cursor.position if cursor is not None else None
+        else:
+            self.seek_latest()
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def latest(self):
+        return ChangeEvent.objects.using(self.using).order_by('-id').values_list('id', flat=True).first() or 0
+
+    def seek_latest(self):
+        """Skip to the end of the feed (e.g. right before a full reload).
+
+        Stops short of the end at a gap that may still be filled, so events of
+        transactions in flight are not skipped.
+        """
+        ids = list(ChangeEvent.objects.using(self.using).order_by('-id').values_list('id', flat=True)[:self.batch_size])
+        ids.reverse()
+        self._gap = None
+        self.position = ids[0] - 1 if ids else 0
+        self.position = self._horizon(ids)
+        return self.position
+
+    def commit(self):
+        if self.name and self.position is not None:
+            FeedCursor.objects.using(self.using).update_or_create(name=self.name, defaults={'position': self.position})
+
+    # Reading
+
+    def read(self):
+        """Return the next batch of events, oldest first, and advance the position past it.
+
+        An empty list means the reader is caught up.
+        """
+        if self.position is None:
+            self.position = 0
+        while True:
+            ids = list(
+                ChangeEvent.objects.using(self.using).filter(id__gt=self.position)
+                .order_by('id').values_list('id', flat=True)[:self.batch_size]
+            )
+            horizon = self._horizon(ids)
+            if horizon == self.position:
+                return []
+            events = ChangeEvent.objects.using(self.using).filter(id__gt=self.position, id__lte=horizon)
+            if self.topics is not None:
+                events = events.filter(topic__in=self.topics)
+            events = list(events.order_by('id'))
+            self.position = horizon
+            # A batch of other topics only moves the position; keep going.
+            if events or horizon != ids[-1] or len(ids) < self.batch_size:
+                return events
+
+    def read_all(self):
+        """Read until the feed is caught up; yields events."""
+        while events := self.read():
+            yield from events
+
+    def _horizon(self, ids):
+        """Last id of ``ids`` up to which no earlier event can still appear."""
+        horizon = self.position
+        for pk in ids:
+            if pk != horizon + 1 and not self._gap_settled(pk):
+                break
+            horizon = pk
+        if self._gap is not None and horizon >= self._gap[0]:
+            self._gap = None
+        return horizon
+
+    def _gap_settled(self, pk):
+        if self.connection.vendor != 'postgresql':
+            return True
+        with self.connection.cursor() as cursor:
+            if self._gap is not None and pk <= self._gap[0]:
+                cursor.execute(
+                    'SELECT pg_snapshot_xmin(pg_current_snapshot()) >= pg_snapshot_xmax(%s::pg_snapshot)',
+                    [self._gap[1]],
+                )
+                return cursor.fetchone()[0]
+            # Remember who was running; once they are all done the gap is final.
+            cursor.execute('SELECT pg_current_snapshot()::text, max(id) FROM events_changeevent')
+            snapshot, last_id = cursor.fetchone()
+            self._gap = (last_id or pk, snapshot)
+        return False
+
+    # Waiting
+
+    def wait(self, timeout=None):
+        """Block until events may have been added, or ``timeout`` seconds pass."""
+        timeout = settings.CHANGE_FEED_POLL_SECONDS if timeout is None else timeout
+        if self._gap is not None:
+            # Events are waiting behind a gap; check again shortly.
+            time.sleep(min(timeout, 0.05))
+            return
+        if self.connection.vendor != 'postgresql':
+            time.sleep(timeout)
+            return
+        self.connection.ensure_connection()
+        raw = self.connection.connection
+        if self._listening is not raw:
+            # First wait, or the connection was replaced since.
+            with self.connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            self._listening = raw
+        if callable(raw.notifies):
+            # psycopg 3
+            for _ in raw.notifies(timeout=timeout, stop_after=1):
+                pass
+            return
+        if not raw.notifies and select.select([raw], [], [], timeout)[0]:
+            raw.poll()
+        raw.notifies.clear()
+
+    def follow(self, stopping, timeout=None):
+        """Yield events as they arrive until ``stopping`` (a ``threading.Event``) is set."""
+        while not stopping.is_set():
+            events = self.read()
+            if events:
+                yield from events
+            else:
+                self.wait(timeout)
+
+
+def purge(older_than=None, chunk_size=10000):
+    """Delete events older than ``older_than`` (default ``CHANGE_EVENT_RETENTION_DAYS``); returns the count."""
+    cutoff = timezone.now() - (older_than or timedelta(days=settings.CHANGE_EVENT_RETENTION_DAYS))
+    deleted = 0
+    while True:
+        ids = list(ChangeEvent.objects.filter(created_at__lt=cutoff).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        deleted += ChangeEvent.objects.filter(id__in=ids).delete()[0]
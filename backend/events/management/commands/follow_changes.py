@@ -0,0 +1,37 @@
+import json
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from events.feed import ChangeFeed
+from taskpilotx.sharding import pin_process_shard
+
+
+class Command(BaseCommand):
+    help = 'Print change events as JSON lines as they are committed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--topic', action='append', dest='topics', help='Only these topics, e.g. tasks.task')
+        parser.add_argument('--name', help='Durable consumer name; resumes from its saved position')
+        parser.add_argument('--shard', choices=settings.DATABASE_SHARDS, default='default',
+                            help='Database shard to work on')
+
+    def handle(self, *args, **options):
+        pin_process_shard(options['shard'])
+        feed = ChangeFeed(topics=options['topics'], name=options['name'])
+        stopping = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stopping.set())
+        signal.signal(signal.SIGINT, lambda *args: stopping.set())
+        while not stopping.is_set():
+            events = feed.read()
+            for event in events:
+                self.stdout.write(json.dumps({
+                    'id': event.id, 'topic': event.topic, 'object_id': event.object_id, 'owner_id': event.owner_id,
+                    'op': event.op, 'fields': event.fields, 'created_at': event.created_at.isoformat(),
+                }))
+            if events:
+                feed.commit()
+            else:
+                feed.wait()
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from events.feed import purge
+from taskpilotx.sharding import pin_process_shard
+
+
+class Command(BaseCommand):
+    help = 'Delete change events older than CHANGE_EVENT_RETENTION_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Override the retention in days')
+        parser.add_argument('--shard', choices=settings.DATABASE_SHARDS, default='default',
+                            help='Database shard to work on')
+
+    def handle(self, *args, **options):
+        pin_process_shard(options['shard'])
+        older_than = timedelta(days=options['days']) if options['days'] else None
+        self.stdout.write(f'Deleted {purge(older_than)} change events')
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+
+NOTIFY_SQL = [
+    """
+    CREATE OR REPLACE FUNCTION events_changeevent_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('change_events', '');
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    # One notification per statement; Postgres folds duplicates within a transaction.
+    """
+    CREATE TRIGGER events_changeevent_notify AFTER INSERT ON events_changeevent
+    FOR EACH STATEMENT EXECUTE FUNCTION events_changeevent_notify()
+    """,
+]
+
+DROP_NOTIFY_SQL = [
+    "DROP TRIGGER IF EXISTS events_changeevent_notify ON events_changeevent",
+    "DROP FUNCTION IF EXISTS events_changeevent_notify()",
+]
+
+
+def install_notify_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for statement in NOTIFY_SQL:
+            schema_editor.execute(statement)
+
+
+def uninstall_notify_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for statement in DROP_NOTIFY_SQL:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_notify_trigger, uninstall_notify_trigger),
+    ]
@@ -0,0 +1,40 @@
+from django.db import models
+from django.utils import timezone
+
+
+class ChangeEvent(models.Model):
+    """One row created, updated or deleted, appended in the transaction that wrote it."""
+    
+    OP_CHOICES = [
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    ]
+    
+    # The id is the feed cursor
+    id = models.BigAutoField(primary_key=True)
+    topic = models.CharField(max_length=100, help_text="Model label, e.g. tasks.task")
+    object_id = models.BigIntegerField()
+    owner_id = models.BigIntegerField(blank=True, null=True, help_text="Owning user, for models that have one")
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    fields = models.JSONField(default=list, blank=True, help_text="Updated fields when known; empty means any")
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='change_event_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"#{self.id} {self.op} {self.topic} {self.object_id}"
+
+
+class FeedCursor(models.Model):
+    """Position of a named, durable change feed consumer."""
+    
+    name = models.CharField(max_length=100, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
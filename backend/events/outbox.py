@@ -0,0 +1,145 @@
+"""
+Transactional outbox for the domain models.
+
+Every write to a model that uses ``OutboxModel`` and ``OutboxQuerySet``
+appends ``ChangeEvent`` rows in the same transaction as the write itself:
+
+* ``save()`` runs in a transaction together with its event;
+* ``update()``, ``bulk_create()`` and ``bulk_update()`` on the queryset record
+  one event per affected row (``update()`` reads the affected ids first);
+* deletes, including cascades, are recorded by a ``post_delete`` receiver
+  inside the deletion's transaction. ``QuerySet.delete()`` and
+  ``Model.delete()`` buffer them and write them with one INSERT.
+
+Consumers read the events through ``events.feed.ChangeFeed``.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.db import models, router, transaction
+from django.db.models.signals import post_delete
+
+from .models import ChangeEvent
+
+
+_buffer = ContextVar('change_event_buffer', default=None)
+
+
+def topic(model):
+    return model._meta.label_lower
+
+
+def _owner(instance):
+    field = instance.change_event_owner
+    return getattr(instance, field) if field else None
+
+
+def record(model, rows, op, fields=(), using='default'):
+    """Append events for ``rows``, ``(object id, owner id)`` pairs of ``model``."""
+    events = [
+        ChangeEvent(topic=topic(model), object_id=pk, owner_id=owner_id, op=op, fields=list(fields))
+        for pk, owner_id in rows
+    ]
+    if not events:
+        return
+    buffer = _buffer.get()
+    if buffer is not None:
+        buffer.setdefault(using, []).extend(events)
+    else:
+        ChangeEvent.objects.using(using).bulk_create(events)
+
+
+@contextmanager
+def collecting():
+    """Buffer the events recorded in the block and write them together at its end.
+
+    Use inside the transaction of the writes, so the events commit with them.
+    """
+    if _buffer.get() is not None:
+        yield
+        return
+    buffer = {}
+    token = _buffer.set(buffer)
+    try:
+        yield
+    finally:
+        _buffer.reset(token)
+    for using, events in buffer.items():
+        ChangeEvent.objects.using(using).bulk_create(events, batch_size=1000)
+
+
+class OutboxQuerySet(models.QuerySet):
+    def _write_db(self):
+        return self._db or router.db_for_write(self.model, **self._hints)
+
+    def _rows(self, using):
+        owner = self.model.change_event_owner
+        if owner:
+            return list(self.using(using).values_list('pk', owner))
+        return [(pk, None) for pk in self.using(using).values_list('pk', flat=True)]
+
+    def update(self, **kwargs):
+        using = self._write_db()
+        with transaction.atomic(using=using, savepoint=False):
+            rows = self._rows(using)
+            if not rows:
+                return 0
+            # Rows that stopped matching in between are left alone, as if updated first.
+            count = super(OutboxQuerySet, self.filter(pk__in=[pk for pk, _ in rows])).update(**kwargs)
+            record(self.model, rows, 'update', kwargs, using=using)
+        return count
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        using = self._write_db()
+        with transaction.atomic(using=using, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            # Rows skipped by ignore_conflicts (and their ids) are not known.
+            record(self.model, [(obj.pk, _owner(obj)) for obj in objs if obj.pk is not None], 'create', using=using)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        using = self._write_db()
+        with transaction.atomic(using=using, savepoint=False):
+            count = super().bulk_update(objs, fields, *args, **kwargs)
+            record(self.model, [(obj.pk, _owner(obj)) for obj in objs], 'update', fields, using=using)
+        return count
+
+    def delete(self):
+        using = self._write_db()
+        with transaction.atomic(using=using, savepoint=False), collecting():
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class OutboxModel:
+    """Mixin for models whose changes go to the outbox."""
+
+    # Attribute holding the id of the user the row belongs to (None if there is none)
+    change_event_owner = 'owner_id'
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        op = 'create' if self._state.adding else 'update'
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            record(self.__class__, [(self.pk, _owner(self))], op, kwargs.get('update_fields') or (), using=using)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using, savepoint=False), collecting():
+            return super().delete(*args, **kwargs)
+
+
+def _deleted(sender, instance, using, **kwargs):
+    record(sender, [(instance.pk, _owner(instance))], 'delete', using=using)
+
+
+def connect_delete_receivers():
+    for model in apps.get_models():
+        if issubclass(model, OutboxModel):
+            post_delete.connect(_deleted, sender=model, dispatch_uid=f'outbox-delete-{topic(model)}')
@@ -0,0 +1,90 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TestCase, override_settings
+
+from tasks.models import Task
+from .feed import ChangeFeed
+from .models import ChangeEvent
+from .outbox import topic
+
+
+User = get_user_model()
+
+
+@override_settings(NEW_USER_SHARDS=['default'])
+class OutboxTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='outbox', email='outbox@example.com', password='x')
+        self.tasks = [Task.objects.create(owner=self.user, title=f'task {i}', prompt='p') for i in range(3)]
+        self.updates = ChangeEvent.objects.filter(topic=topic(Task), op='update')
+
+    def test_bulk_update_records_an_event_per_row(self):
+        with self.assertNumQueries(3):
+            # SELECT of the affected rows, the UPDATE, one INSERT for the events.
+            count = Task.objects.filter(owner=self.user).exclude(pk=self.tasks[2].pk).update(status='paused')
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            sorted(self.updates.values_list('object_id', 'owner_id', 'fields')),
+            [(task.pk, self.user.pk, ['status']) for task in self.tasks[:2]],
+        )
+
+    def test_bulk_update_and_its_events_commit_together(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Task.objects.filter(owner=self.user).update(status='paused')
+            raise RuntimeError
+        self.assertFalse(self.updates.exists())
+        self.assertFalse(Task.objects.filter(status='paused').exists())
+
+        # An update whose events cannot be written fails with them.
+        with mock.patch('events.outbox.record', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Task.objects.filter(owner=self.user).update(status='paused')
+        self.assertFalse(Task.objects.filter(status='paused').exists())
+
+    def test_bulk_delete_records_an_event_per_row(self):
+        Task.objects.filter(owner=self.user).delete()
+        deleted = ChangeEvent.objects.filter(topic=topic(Task), op='delete')
+        self.assertEqual(sorted(deleted.values_list('object_id', flat=True)), [task.pk for task in self.tasks])
+
+
+class ChangeFeedTests(TestCase):
+    def add_events(self, count):
+        return [ChangeEvent.objects.create(topic='tasks.task', object_id=i, op='update') for i in range(count)]
+
+    def test_named_feed_resumes_from_its_cursor(self):
+        feed = ChangeFeed(name='consumer', batch_size=2)
+        first = self.add_events(3)
+        self.assertEqual(list(feed.read_all()), first)
+        feed.commit()
+
+        second = self.add_events(2)
+        # A restarted consumer continues after what the last one committed.
+        self.assertEqual(list(ChangeFeed(name='consumer').read_all()), second)
+
+    def test_read_stops_at_a_gap_until_it_is_settled(self):
+        feed = ChangeFeed(name='consumer')
+        before, in_flight, after = self.add_events(3)
+        # An id handed out to a transaction that has not committed yet.
+        in_flight.delete()
+
+        with mock.patch.object(ChangeFeed, '_gap_settled', return_value=False) as settled:
+            self.assertEqual(feed.read(), [before])
+            self.assertEqual(feed.read(), [])
+        settled.assert_called_with(after.pk)
+        feed.commit()
+
+        # Once every transaction that could fill the gap has finished, it is passed.
+        restarted = ChangeFeed(name='consumer')
+        self.assertEqual(restarted.position, before.pk)
+        self.assertEqual(restarted.read(), [after])
+
+    def test_seek_latest_stops_short_of_an_open_gap(self):
+        before, in_flight, after = self.add_events(3)
+        in_flight.delete()
+        with mock.patch.object(ChangeFeed, '_gap_settled', return_value=False):
+            self.assertEqual(ChangeFeed().position, before.pk)
+        self.assertEqual(ChangeFeed().position, after.pk)
@@ -31,6 +31,19 @@
 # 8. Reset database migrations and clear data (use carefully!)
 # python manage.py flush
 
+# 9. Profile process startup (import time by package); workers use the slim settings
+# python manage.py startup_profile
+# python manage.py startup_profile --settings taskpilotx.worker_settings
+
+# 10. Serve in production (see taskpilotx/serving.py) and benchmark the worker types
+# gunicorn -c python:taskpilotx.gunicorn_conf
+# SERVER_WORKER_TYPE=async gunicorn -c python:taskpilotx.gunicorn_conf
+# python manage.py bench_serving
+
+# 11. Run the tests; the sharding tests need two extra shards, e.g. local SQLite files
+# DB_ENGINE=sqlite DB_SHARDS=shard_1,shard_2 DB_SHARD_1_ENGINE=sqlite DB_SHARD_1_NAME=shard_1.sqlite3 \
+#     DB_SHARD_2_ENGINE=sqlite DB_SHARD_2_NAME=shard_2.sqlite3 python manage.py test
+
 import os
 import sys
 
@@ -0,0 +1,73 @@
+"""
+Set-based operations over many messages.
+
+Each operation walks the matching ids in primary-key order and applies one
+``UPDATE``/``DELETE`` per chunk of ``MESSAGE_BULK_CHUNK_SIZE`` ids, each in its
+own short transaction, so a cleanup over a whole inbox neither holds locks for
+long nor builds one huge statement.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from taskpilotx.sharding import shard_db
+
+from .models import Message
+
+
+def _chunks(queryset, chunk_size=None):
+    """Yield lists of ids of ``queryset``, in id order."""
+    chunk_size = chunk_size or settings.MESSAGE_BULK_CHUNK_SIZE
+    ids = queryset.order_by('id').values_list('id', flat=True)
+    last = 0
+    while True:
+        chunk = list(ids.filter(id__gt=last)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+
+
+def select_messages(user, message_ids=None, status=None, before=None):
+    """Return the user's messages matching all of the given filters."""
+    messages = Message.objects.filter(owner=user)
+    if message_ids is not None:
+        messages = messages.filter(id__in=message_ids)
+    if status:
+        messages = messages.filter(status=status)
+    if before:
+        messages = messages.filter(created_at__lt=before)
+    return messages
+
+
+def update_status(messages, status, chunk_size=None):
+    """Move ``messages`` to ``status``; returns the number updated."""
+    now = timezone.now()
+    changes = {'status': status, 'updated_at': now}
+    if status == 'processed':
+        changes['processed_at'] = now
+    elif status == 'unprocessed':
+        changes['processed_at'] = None
+
+    updated = 0
+    for chunk in _chunks(messages, chunk_size):
+        with transaction.atomic(using=shard_db()):
+            updated += Message.objects.filter(id__in=chunk).update(**changes)
+    return updated
+
+
+def requeue_failed(messages, chunk_size=None):
+    """Send failed ``messages`` back to the execution engine; returns the number requeued."""
+    return update_status(messages.filter(status='failed'), 'unprocessed', chunk_size)
+
+
+def delete_messages(messages, chunk_size=None):
+    """Delete ``messages`` with their links and executions; returns the number deleted."""
+    deleted = 0
+    for chunk in _chunks(messages, chunk_size):
+        # The collector removes thread/action links and dependent task
+        # executions with one statement per table for the whole chunk; the
+        # owner is loaded for the change events.
+        with transaction.atomic(using=shard_db()):
+            deleted += Message.objects.filter(id__in=chunk).only('id', 'owner_id').delete()[1].get(Message._meta.label, 0)
+    return deleted
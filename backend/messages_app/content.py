@@ -0,0 +1,106 @@
+"""
+Large message bodies and attachments.
+
+Bodies longer than ``MESSAGE_INLINE_CONTENT_CHARS`` are moved to the blob store
+(``taskpilotx.blobs``): the row keeps the first ``MESSAGE_PREVIEW_CHARS`` in
+``content`` and the blob hash in ``content_hash``, so message rows stay small
+and list queries never carry full bodies. ``full_content`` reads the whole body
+(or just its start) back through a memory map; task rules and AI prompts use
+it, and the search index is given the whole body with ``index_body``.
+Attachments are always blobs, referenced by ``MessageAttachment`` rows.
+"""
+import mmap
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.db.models.functions import Length
+
+from taskpilotx.blobs import get_blob_store, owns_blob, record_owner
+from .models import MessageAttachment
+from .search import index_full_body
+
+
+def split_content(text, owner_id):
+    """Return the ``(content, content_hash)`` to store for the body ``text`` of ``owner_id``."""
+    if len(text) <= settings.MESSAGE_INLINE_CONTENT_CHARS:
+        return text, ''
+    blob = get_blob_store().put_text(text)
+    record_owner(owner_id, blob.hash)
+    return text[:settings.MESSAGE_PREVIEW_CHARS], blob.hash
+
+
+def full_content(message, limit=None):
+    """The body of ``message``, read from the blob store if it was offloaded.
+
+    With ``limit``, only the first ``limit`` characters, read without mapping
+    more of the blob than they can take.
+    """
+    if not message.content_hash or (limit is not None and limit <= len(message.content)):
+        return message.content[:limit]
+    mapped = get_blob_store().map(message.content_hash)
+    if not isinstance(mapped, mmap.mmap):
+        return mapped.decode()
+    with mapped, memoryview(mapped) as view:
+        if limit is None:
+            return str(view, 'utf-8')
+        # At most four bytes a character; one cut short at the end is dropped.
+        return str(view[:limit * 4], 'utf-8', 'ignore')[:limit]
+
+
+def index_body(message, text, using=None):
+    """Give the search index the whole body ``text`` of the offloaded ``message``."""
+    if message.content_hash:
+        index_full_body(message.pk, text, using=using)
+
+
+def reindex_bodies(queryset):
+    """Index the whole bodies of the offloaded messages in ``queryset`` again; returns the count."""
+    count = 0
+    for message in queryset.exclude(content_hash='').only('id', 'content', 'content_hash').iterator():
+        index_full_body(message.pk, full_content(message), using=queryset.db)
+        count += 1
+    return count
+
+
+def add_attachments(message, attachments):
+    """Attach uploaded blobs to ``message``.
+
+    ``attachments`` are mappings with ``blob`` (a hash from
+    ``POST /api/uploads/``), ``filename`` and optionally ``content_type``.
+    Only blobs the message's owner stored may be attached.
+    """
+    store = get_blob_store()
+    rows = []
+    for attachment in attachments:
+        digest = attachment['blob']
+        if not owns_blob(message.owner_id, digest):
+            raise ValidationError(f'Unknown blob: {digest}')
+        rows.append(MessageAttachment(
+            message=message,
+            filename=attachment['filename'][:255],
+            content_type=attachment.get('content_type') or 'application/octet-stream',
+            size=store.size(digest),
+            blob_hash=digest,
+        ))
+    return MessageAttachment.objects.bulk_create(rows)
+
+
+def offload_messages(queryset, batch_size=100):
+    """Move the long bodies of already stored messages to the blob store; returns the count."""
+    long_bodies = (
+        queryset.filter(content_hash='')
+        .annotate(content_length=Length('content'))
+        .filter(content_length__gt=settings.MESSAGE_INLINE_CONTENT_CHARS)
+    )
+    moved = 0
+    for message in long_bodies.only('id', 'owner_id', 'content').iterator(chunk_size=batch_size):
+        body = message.content
+        message.content, message.content_hash = split_content(body, message.owner_id)
+        with transaction.atomic(using=router.db_for_write(queryset.model)):
+            if queryset.model.objects.filter(id=message.id, content_hash='').update(
+                content=message.content, content_hash=message.content_hash
+            ):
+                index_body(message, body)
+                moved += 1
+    return moved
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from messages_app.content import offload_messages, reindex_bodies
+from messages_app.models import Message
+from taskpilotx.sharding import pin_process_shard
+
+
+class Command(BaseCommand):
+    help = 'Move message bodies longer than MESSAGE_INLINE_CONTENT_CHARS to the blob store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='Only offload these user ids')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--shard', choices=settings.DATABASE_SHARDS, default='default',
+                            help='Database shard to work on')
+        parser.add_argument('--reindex', action='store_true',
+                            help='Also give the search index the whole bodies of messages offloaded before')
+
+    def handle(self, *args, **options):
+        pin_process_shard(options['shard'])
+        queryset = Message.objects.all()
+        if options['users']:
+            queryset = queryset.filter(owner_id__in=options['users'])
+        moved = offload_messages(queryset, batch_size=options['batch_size'])
+        self.stdout.write(f'Offloaded {moved} message bodies')
+        if options['reindex']:
+            self.stdout.write(f'Reindexed {reindex_bodies(queryset.using(options["shard"]))} message bodies')
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('actions', '0002_create_default_actions'),
+        ('messages_app', '0002_message_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['status', 'created_at'], name='message_status_created_idx'),
+        ),
+    ]
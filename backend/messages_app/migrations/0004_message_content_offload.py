@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def reinstall_sqlite_search_index(apps, schema_editor):
+    # Adding content_hash rebuilds the table on SQLite, which drops the FTS triggers.
+    if schema_editor.connection.vendor == 'sqlite':
+        from messages_app.search import install_search_index
+        install_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messages_app', '0003_message_status_index'),
+    ]
+
+    operations = [
+        # Runs last when unapplying, after content_hash is removed.
+        migrations.RunPython(migrations.RunPython.noop, reinstall_sqlite_search_index),
+        migrations.AddField(
+            model_name='message',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='Blob holding the full body when offloaded', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='content',
+            field=models.TextField(help_text='Full body, or a preview when content_hash is set'),
+        ),
+        migrations.CreateModel(
+            name='MessageAttachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255)),
+                ('content_type', models.CharField(default='application/octet-stream', max_length=100)),
+                ('size', models.PositiveBigIntegerField()),
+                ('blob_hash', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='messages_app.message')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(reinstall_sqlite_search_index, migrations.RunPython.noop),
+    ]
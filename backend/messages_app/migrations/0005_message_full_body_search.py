@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def reinstall_search_index(apps, schema_editor):
+    # Adds body_vector on PostgreSQL and gives SQLite an FTS5 table with its own copy of the text.
+    from messages_app.search import install_search_index, uninstall_search_index
+    uninstall_search_index(schema_editor)
+    install_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messages_app', '0004_message_content_offload'),
+    ]
+
+    operations = [
+        # The new index also works with the schema of 0004.
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,10 @@
 from django.db import models
 from django.conf import settings
 
+from events.outbox import OutboxModel, OutboxQuerySet
 
-class Message(models.Model):
+
+class Message(OutboxModel, models.Model):
     """Model for messages received from linked accounts."""
     
     STATUS_CHOICES = [
@@ -21,7 +23,8 @@ class Message(models.Model):
     
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='messages')
     title = models.CharField(max_length=255)
-    content = models.TextField()
+    content = models.TextField(help_text="Full body, or a preview when content_hash is set")
+    content_hash = models.CharField(max_length=64, blank=True, help_text="Blob holding the full body when offloaded")
     summary = models.TextField(blank=True, null=True, help_text="AI-generated summary")
     
     # Source information
@@ -42,9 +45,14 @@ class Message(models.Model):
     ai_analysis = models.JSONField(default=dict, blank=True, help_text="AI analysis results")
     triggered_actions = models.ManyToManyField('actions.ActionExecution', blank=True, related_name='triggering_messages')
     
+    objects = OutboxQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
         unique_together = ('source_account', 'external_message_id')
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='message_status_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.source_account.service_name} ({self.created_at.strftime('%Y-%m-%d %H:%M')})"
@@ -57,6 +65,27 @@ class Message(models.Model):
     def has_summary(self):
         return bool(self.summary)
 
+    @property
+    def is_truncated(self):
+        return bool(self.content_hash)
+
+
+class MessageAttachment(models.Model):
+    """File attached to a message; the content lives in the blob store."""
+
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='attachments')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, default='application/octet-stream')
+    size = models.PositiveBigIntegerField()
+    blob_hash = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.filename} ({self.size} bytes)"
+
 
 class MessageThread(models.Model):
     """Model for grouping related messages into threads."""
@@ -1,16 +1,46 @@
 import graphene
 from graphene_django import DjangoObjectType
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.urls import reverse
 from django.utils import timezone
-from .models import Message, MessageThread
+from .bulk import delete_messages, requeue_failed, select_messages, update_status
+from .content import add_attachments, full_content, index_body, split_content
+from .models import Message, MessageAttachment, MessageThread
+from .search import search_messages
+from ai.services import summarize_text
+from taskpilotx.sharding import shard_db
 
 
 # GraphQL Types
+class MessageAttachmentType(DjangoObjectType):
+    url = graphene.String()
+
+    class Meta:
+        model = MessageAttachment
+        fields = ('id', 'filename', 'content_type', 'size', 'blob_hash', 'created_at')
+
+    def resolve_url(self, info):
+        return reverse('message-attachment', args=[self.id])
+
+
 class MessageType(DjangoObjectType):
+    # ``content`` is a preview when the body was offloaded; these read the blob store on request.
+    full_content = graphene.String()
+    is_truncated = graphene.Boolean()
+    attachments = graphene.List(MessageAttachmentType)
+
     class Meta:
         model = Message
         fields = '__all__'
 
+    def resolve_full_content(self, info):
+        return full_content(self)
+
+    def resolve_attachments(self, info):
+        return self.attachments.all()
+
 
 class MessageThreadType(DjangoObjectType):
     class Meta:
@@ -18,7 +48,25 @@ class MessageThreadType(DjangoObjectType):
         fields = '__all__'
 
 
+class MessageSearchHitType(graphene.ObjectType):
+    message = graphene.Field(MessageType)
+    rank = graphene.Float()
+    highlight = graphene.String(description='Escaped HTML of the content with the matches in <b> tags')
+
+
+class MessageSearchResultsType(graphene.ObjectType):
+    hits = graphene.List(MessageSearchHitType)
+    end_cursor = graphene.String()
+    has_next_page = graphene.Boolean()
+
+
 # Input Types for Mutations
+class MessageAttachmentInput(graphene.InputObjectType):
+    filename = graphene.String(required=True)
+    blob = graphene.String(required=True)
+    content_type = graphene.String()
+
+
 class MessageInput(graphene.InputObjectType):
     title = graphene.String(required=True)
     content = graphene.String(required=True)
@@ -26,6 +74,7 @@ class MessageInput(graphene.InputObjectType):
     external_message_id = graphene.String()
     sender_info = graphene.JSONString()
     priority = graphene.String()
+    attachments = graphene.List(MessageAttachmentInput)
 
 
 # Mutations
@@ -50,16 +99,23 @@ class CreateMessage(graphene.Mutation):
                 owner=user
             )
 
-            message = Message.objects.create(
-                owner=user,
-                title=message_data.title,
-                content=message_data.content,
-                source_account=source_account,
-                external_message_id=message_data.get('external_message_id', ''),
-                sender_info=message_data.get('sender_info', {}),
-                priority=message_data.get('priority', 'normal'),
-            )
+            content, content_hash = split_content(message_data.content, user.pk)
+            with transaction.atomic(using=shard_db()):
+                message = Message.objects.create(
+                    owner=user,
+                    title=message_data.title,
+                    content=content,
+                    content_hash=content_hash,
+                    source_account=source_account,
+                    external_message_id=message_data.get('external_message_id', ''),
+                    sender_info=message_data.get('sender_info', {}),
+                    priority=message_data.get('priority', 'normal'),
+                )
+                index_body(message, message_data.content)
+                add_attachments(message, message_data.get('attachments') or [])
             return CreateMessage(message=message, success=True, errors=[])
+        except ValidationError as e:
+            return CreateMessage(success=False, errors=e.messages)
         except Exception as e:
             return CreateMessage(success=False, errors=[str(e)])
 
@@ -81,19 +137,8 @@ class SummarizeMessage(graphene.Mutation):
         try:
             message = Message.objects.get(id=message_id, owner=user)
             
-            # AI Summarization stub - replace with actual AI integration later
             if message.content:
-                # Simple stub summarization - just take first 100 chars with ellipsis
-                content_length = len(message.content)
-                if content_length > 100:
-                    summary = message.content[:100] + "..."
-                else:
-                    summary = message.content
-                
-                # Add AI-like prefix for MVP
-                summary = f"AI Summary: {summary}"
-                
-                message.summary = summary
+                message.summary = summarize_text(full_content(message), user_id=user.id)
                 message.status = 'processed'
                 message.processed_at = timezone.now()
                 message.save()
@@ -131,6 +176,78 @@ class DeleteMessage(graphene.Mutation):
             return DeleteMessage(success=False, errors=[str(e)])
 
 
+class BulkUpdateMessageStatus(graphene.Mutation):
+    class Arguments:
+        status = graphene.String(required=True)
+        message_ids = graphene.List(graphene.ID)
+        current_status = graphene.String()
+
+    updated_count = graphene.Int()
+    success = graphene.Boolean()
+    errors = graphene.List(graphene.String)
+
+    @staticmethod
+    def mutate(root, info, status, message_ids=None, current_status=None):
+        user = info.context.user
+        if not user.is_authenticated:
+            return BulkUpdateMessageStatus(success=False, errors=['Authentication required'])
+        # 'processing' is owned by the execution engine.
+        if status not in dict(Message.STATUS_CHOICES) or status == 'processing':
+            return BulkUpdateMessageStatus(success=False, errors=[f'Invalid status: {status}'])
+
+        try:
+            messages = select_messages(user, message_ids=message_ids, status=current_status)
+            return BulkUpdateMessageStatus(updated_count=update_status(messages, status), success=True, errors=[])
+        except Exception as e:
+            return BulkUpdateMessageStatus(success=False, errors=[str(e)])
+
+
+class RequeueFailedMessages(graphene.Mutation):
+    class Arguments:
+        message_ids = graphene.List(graphene.ID)
+
+    requeued_count = graphene.Int()
+    success = graphene.Boolean()
+    errors = graphene.List(graphene.String)
+
+    @staticmethod
+    def mutate(root, info, message_ids=None):
+        user = info.context.user
+        if not user.is_authenticated:
+            return RequeueFailedMessages(success=False, errors=['Authentication required'])
+
+        try:
+            messages = select_messages(user, message_ids=message_ids)
+            return RequeueFailedMessages(requeued_count=requeue_failed(messages), success=True, errors=[])
+        except Exception as e:
+            return RequeueFailedMessages(success=False, errors=[str(e)])
+
+
+class DeleteMessages(graphene.Mutation):
+    class Arguments:
+        message_ids = graphene.List(graphene.ID)
+        status = graphene.String()
+        before = graphene.DateTime()
+
+    deleted_count = graphene.Int()
+    success = graphene.Boolean()
+    errors = graphene.List(graphene.String)
+
+    @staticmethod
+    def mutate(root, info, message_ids=None, status=None, before=None):
+        user = info.context.user
+        if not user.is_authenticated:
+            return DeleteMessages(success=False, errors=['Authentication required'])
+        if message_ids is None and not status and not before:
+            return DeleteMessages(success=False, errors=['Specify messageIds, status or before'])
+
+        try:
+            messages = select_messages(user, message_ids=message_ids, status=status, before=before)
+            return DeleteMessages(deleted_count=delete_messages(messages), success=True, errors=[])
+        except Exception as e:
+            return DeleteMessages(success=False, errors=[str(e)])
+
+
 # Queries
 class Query(graphene.ObjectType):
     # Message queries
@@ -138,6 +255,14 @@ class Query(graphene.ObjectType):
     message = graphene.Field(MessageType, id=graphene.ID(required=True))
     my_messages = graphene.List(MessageType)
     unprocessed_messages = graphene.List(MessageType)
+    search_messages = graphene.Field(
+        MessageSearchResultsType,
+        query=graphene.String(required=True),
+        account_id=graphene.ID(),
+        status=graphene.String(),
+        first=graphene.Int(default_value=20),
+        after=graphene.String(),
+    )
 
     def resolve_messages(self, info, user_id=None):
         user = info.context.user
@@ -166,9 +291,18 @@ class Query(graphene.ObjectType):
             return []
         return Message.objects.filter(owner=user, status='unprocessed')
 
+    def resolve_search_messages(self, info, query, account_id=None, status=None, first=20, after=None):
+        user = info.context.user
+        if not user.is_authenticated:
+            return None
+        return search_messages(user, query, account_id=account_id, status=status, first=first, after=after)
+
 
 # Mutations
 class Mutation(graphene.ObjectType):
     create_message = CreateMessage.Field()
     summarize_message = SummarizeMessage.Field()
-    delete_message = DeleteMessage.Field()
\ No newline at end of file
+    delete_message = DeleteMessage.Field()
+    bulk_update_message_status = BulkUpdateMessageStatus.Field()
+    requeue_failed_messages = RequeueFailedMessages.Field()
+    delete_messages = DeleteMessages.Field()
\ No newline at end of file
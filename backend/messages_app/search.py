@@ -0,0 +1,246 @@
+"""
+Full-text search over messages.
+
+PostgreSQL keeps a stored, generated ``tsvector`` column on the message table
+behind a GIN index, so rows are indexed on insert/update by the database
+itself. SQLite (local development and tests) uses an FTS5 table kept in sync
+by triggers. Both backends are installed by migrations using the SQL below.
+
+The database only has the preview of an offloaded body (see
+``messages_app.content``), so the application hands it the whole body with
+``index_full_body()``: PostgreSQL stores its ``tsvector`` in ``body_vector``,
+which the generated column then uses in place of the preview's, and the FTS5
+table, which keeps its own copy of the text, has its ``content`` replaced.
+PostgreSQL builds highlights from the preview, so a match further into the
+body is found but not highlighted.
+"""
+from collections import namedtuple
+import html
+import re
+
+from django.db import NotSupportedError, connections, router
+from graphql import GraphQLError
+from graphql_relay import cursor_to_offset, offset_to_cursor
+
+from .models import Message
+
+
+TABLE = Message._meta.db_table
+FTS_TABLE = f'{TABLE}_fts'
+SEARCH_CONFIG = 'english'
+MAX_PAGE_SIZE = 100
+# How much of an offloaded body is indexed; a tsvector holds at most 1 MB.
+MAX_INDEXED_CHARS = 256 * 1024
+
+# The database marks matches with these; the content around them is escaped
+# before they become <b> tags (see highlight_html).
+START_SEL, STOP_SEL = '\x02', '\x03'
+MATCH_RE = re.compile(f'{START_SEL}([^{START_SEL}{STOP_SEL}]*){STOP_SEL}')
+HEADLINE_OPTIONS = f'StartSel={START_SEL}, StopSel={STOP_SEL}, MaxFragments=2, MaxWords=24, MinWords=8'
+
+SearchHit = namedtuple('SearchHit', ['message', 'rank', 'highlight'])
+SearchPage = namedtuple('SearchPage', ['hits', 'end_cursor', 'has_next_page'])
+
+
+POSTGRES_INSTALL_SQL = [
+    f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS body_vector tsvector",
+    f"""
+    ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(summary, '')), 'B') ||
+        setweight(coalesce(body_vector, to_tsvector('{SEARCH_CONFIG}', coalesce(content, ''))), 'C')
+    ) STORED
+    """,
+    # btree_gin lets the tenant filter and the text match share one index.
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    f"CREATE INDEX IF NOT EXISTS {TABLE}_search_idx ON {TABLE} USING gin (owner_id, search_vector)",
+]
+
+POSTGRES_UNINSTALL_SQL = [
+    f"DROP INDEX IF EXISTS {TABLE}_search_idx",
+    f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS search_vector",
+    f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS body_vector",
+]
+
+SQLITE_INSTALL_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, content, summary, tokenize='porter unicode61'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, content, summary)
+        VALUES (new.id, new.title, new.content, new.summary);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {TABLE} BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    # An unchanged content keeps the whole body given by index_full_body().
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, content, summary ON {TABLE} BEGIN
+        UPDATE {FTS_TABLE} SET
+            title = new.title,
+            summary = new.summary,
+            content = CASE WHEN new.content IS old.content THEN content ELSE new.content END
+        WHERE rowid = new.id;
+    END
+    """,
+    f"""
+    INSERT INTO {FTS_TABLE}(rowid, title, content, summary)
+    SELECT id, title, content, summary FROM {TABLE} WHERE id NOT IN (SELECT rowid FROM {FTS_TABLE})
+    """,
+]
+
+SQLITE_UNINSTALL_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def install_search_index(schema_editor):
+    """Create the search index for the current database backend.
+
+    SQLite drops triggers whenever Django rebuilds the message table, so
+    migrations that alter ``Message`` on SQLite call this again afterwards.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        statements = POSTGRES_INSTALL_SQL
+    elif vendor == 'sqlite':
+        statements = SQLITE_INSTALL_SQL
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def uninstall_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        statements = POSTGRES_UNINSTALL_SQL
+    elif vendor == 'sqlite':
+        statements = SQLITE_UNINSTALL_SQL
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def index_full_body(message_id, text, using=None):
+    """Index ``text`` as the content of the offloaded message ``message_id``."""
+    connection = connections[using or router.db_for_write(Message)]
+    if connection.vendor == 'postgresql':
+        sql = f"UPDATE {TABLE} SET body_vector = to_tsvector('{SEARCH_CONFIG}', %s) WHERE id = %s"
+    elif connection.vendor == 'sqlite':
+        sql = f"UPDATE {FTS_TABLE} SET content = %s WHERE rowid = %s"
+    else:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [text[:MAX_INDEXED_CHARS], message_id])
+
+
+def highlight_html(fragment):
+    """HTML for a marked-up fragment: the text escaped, only the matches in ``<b>``.
+
+    Marker characters that were in the content itself, unpaired, are dropped.
+    """
+    if fragment is None:
+        return None
+    parts, end = [], 0
+    for match in MATCH_RE.finditer(fragment):
+        parts += [_escape(fragment[end:match.start()]), f'<b>{html.escape(match[1])}</b>']
+        end = match.end()
+    parts.append(_escape(fragment[end:]))
+    return ''.join(parts)
+
+
+def _escape(text):
+    return html.escape(text.replace(START_SEL, '').replace(STOP_SEL, ''))
+
+
+def search_messages(user, query, account_id=None, status=None, first=20, after=None):
+    """Return one ranked, highlighted page of ``user``'s messages matching ``query``."""
+    first = max(1, min(first or 20, MAX_PAGE_SIZE))
+    offset = 0
+    if after:
+        position = cursor_to_offset(after)
+        if position is None:
+            raise GraphQLError(f'Invalid cursor: {after}')
+        offset = max(position + 1, 0)
+
+    filters = ['m.owner_id = %s']
+    params = [user.pk]
+    if account_id:
+        filters.append('m.source_account_id = %s')
+        params.append(account_id)
+    if status:
+        filters.append('m.status = %s')
+        params.append(status)
+
+    # Fetch one extra row to know whether another page exists.
+    connection = connections[router.db_for_read(Message)]
+    if connection.vendor == 'postgresql':
+        rows = _search_postgres(connection, query, filters, params, first + 1, offset)
+    elif connection.vendor == 'sqlite':
+        rows = _search_sqlite(connection, query, filters, params, first + 1, offset)
+    else:
+        raise NotSupportedError(f'Message search is not available on {connection.vendor}')
+
+    has_next_page = len(rows) > first
+    rows = rows[:first]
+    messages = Message.objects.in_bulk([row[0] for row in rows])
+    hits = [
+        SearchHit(message=messages[message_id], rank=rank, highlight=highlight_html(highlight))
+        for message_id, rank, highlight in rows
+        if message_id in messages
+    ]
+    end_cursor = offset_to_cursor(offset + len(rows) - 1) if rows else None
+    return SearchPage(hits=hits, end_cursor=end_cursor, has_next_page=has_next_page)
+
+
+def _search_postgres(connection, query, filters, params, limit, offset):
+    if not query.strip():
+        return []
+    # Headlines are expensive, so they are only built for the rows on the page.
+    sql = f"""
+        SELECT hit.id, hit.rank,
+               ts_headline('{SEARCH_CONFIG}', m.content, websearch_to_tsquery('{SEARCH_CONFIG}', %s), %s)
+        FROM (
+            SELECT m.id, ts_rank_cd(m.search_vector, q) AS rank
+            FROM {TABLE} m, websearch_to_tsquery('{SEARCH_CONFIG}', %s) q
+            WHERE {' AND '.join(filters)} AND m.search_vector @@ q
+            ORDER BY rank DESC, m.id DESC
+            LIMIT %s OFFSET %s
+        ) hit
+        JOIN {TABLE} m ON m.id = hit.id
+        ORDER BY hit.rank DESC, hit.id DESC
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [query, HEADLINE_OPTIONS, query, *params, limit, offset])
+        return cursor.fetchall()
+
+
+def _search_sqlite(connection, query, filters, params, limit, offset):
+    # Quote every term so user input can never be parsed as FTS5 syntax.
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return []
+    match = ' '.join('"%s"' % term for term in terms)
+    sql = f"""
+        SELECT m.id, -bm25({FTS_TABLE}, 10.0, 1.0, 5.0) AS rank,
+               snippet({FTS_TABLE}, -1, %s, %s, '...', 24)
+        FROM {FTS_TABLE}
+        JOIN {TABLE} m ON m.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH %s AND {' AND '.join(filters)}
+        ORDER BY rank DESC, m.id DESC
+        LIMIT %s OFFSET %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [START_SEL, STOP_SEL, match, *params, limit, offset])
+        return cursor.fetchall()
@@ -1,3 +1,228 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import LinkedAccount
+from taskpilotx import blobs
+from taskpilotx.sharding import shard_for, use_shard
+from users.models import UserBlob
+from users.tokens import RefreshToken
+from .bulk import delete_messages, select_messages, update_status
+from .content import full_content, offload_messages
+from .models import Message
+
+
+User = get_user_model()
+
+CREATE = '''
+mutation($data: MessageInput!) {
+  createMessage(messageData: $data) { success errors message { id attachments { filename size } } }
+}
+'''
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class MessageContentTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings_override = override_settings(BLOB_STORE_DIR=root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # The store is created once per process, from BLOB_STORE_DIR.
+        blobs._store = None
+        self.addCleanup(setattr, blobs, '_store', None)
+
+        self.owner, self.other = (
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ('owner', 'other')
+        )
+        with use_shard(shard_for(self.owner.pk)):
+            self.account = LinkedAccount.objects.create(
+                owner=self.owner, service_name='gmail', account_identifier='owner@example.com',
+                encrypted_token='token',
+            )
+
+    def authorize(self, user):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+
+    def upload(self, user, body):
+        self.authorize(user)
+        return self.client.post('/api/uploads/', body, content_type='application/octet-stream').json()['blob']
+
+    def create_message(self, content='hello', attachments=()):
+        self.authorize(self.owner)
+        variables = {'data': {
+            'title': 'report', 'content': content, 'sourceAccountId': str(self.account.pk),
+            'attachments': [{'filename': 'report.txt', 'blob': blob} for blob in attachments],
+        }}
+        response = self.client.post(
+            '/api/graphql/', json.dumps({'query': CREATE, 'variables': variables}),
+            content_type='application/json',
+        )
+        return response.json()['data']['createMessage']
+
+    def test_attach_own_upload(self):
+        result = self.create_message(attachments=[self.upload(self.owner, b'report')])
+        self.assertTrue(result['success'], result['errors'])
+        self.assertEqual(result['message']['attachments'], [{'filename': 'report.txt', 'size': 6}])
+
+    def test_attach_upload_of_another_user(self):
+        digest = self.upload(self.other, b'secret')
+        result = self.create_message(attachments=[digest])
+        self.assertEqual(result['errors'], [f'Unknown blob: {digest}'])
+        with use_shard(shard_for(self.owner.pk)):
+            self.assertFalse(Message.objects.exists())
+
+    def test_search_highlight_escapes_the_content(self):
+        self.create_message(content='<script>alert(1)</script> zebra & <b>report</b>')
+        self.authorize(self.owner)
+        query = '{ searchMessages(query: "zebra") { hits { highlight } } }'
+        response = self.client.post('/api/graphql/', json.dumps({'query': query}), content_type='application/json')
+        self.assertEqual(
+            response.json()['data']['searchMessages']['hits'],
+            [{'highlight': '&lt;script&gt;alert(1)&lt;/script&gt; <b>zebra</b> &amp; &lt;b&gt;report&lt;/b&gt;'}],
+        )
+
+    def test_search_hits_are_ranked(self):
+        self.create_message(content='zebra')
+        self.authorize(self.owner)
+        query = '{ searchMessages(query: "zebra") { hits { rank highlight } } }'
+        response = self.client.post('/api/graphql/', json.dumps({'query': query}), content_type='application/json')
+        [hit] = response.json()['data']['searchMessages']['hits']
+        self.assertIsInstance(hit['rank'], float)
+
+    def test_search_rejects_a_malformed_cursor(self):
+        self.authorize(self.owner)
+        query = '{ searchMessages(query: "zebra", after: "not-a-cursor") { hits { rank } } }'
+        response = self.client.post('/api/graphql/', json.dumps({'query': query}), content_type='application/json')
+        body = response.json()
+        self.assertIsNone(body['data']['searchMessages'])
+        self.assertEqual(body['errors'][0]['message'], 'Invalid cursor: not-a-cursor')
+
+    def search(self, term):
+        self.authorize(self.owner)
+        query = '{ searchMessages(query: "%s") { hits { message { id } } } }' % term
+        response = self.client.post('/api/graphql/', json.dumps({'query': query}), content_type='application/json')
+        return [hit['message']['id'] for hit in response.json()['data']['searchMessages']['hits']]
+
+    @override_settings(MESSAGE_INLINE_CONTENT_CHARS=60, MESSAGE_PREVIEW_CHARS=20)
+    def test_offloaded_body_is_searched_in_full(self):
+        body = 'quarterly report ' * 10 + 'zebra'
+        message_id = self.create_message(content=body)['message']['id']
+        with use_shard(shard_for(self.owner.pk)):
+            message = Message.objects.get(pk=message_id)
+        self.assertTrue(message.content_hash)
+        self.assertEqual(full_content(message), body)
+        self.assertEqual(self.search('zebra'), [message_id])
+
+        # Changing other fields keeps the whole body in the index.
+        with use_shard(shard_for(self.owner.pk)):
+            Message.objects.filter(pk=message_id).update(summary='summary')
+        self.assertEqual(self.search('zebra'), [message_id])
+
+    @override_settings(MESSAGE_INLINE_CONTENT_CHARS=60, MESSAGE_PREVIEW_CHARS=20)
+    def test_offloading_stored_messages_keeps_them_searchable(self):
+        body = 'quarterly report ' * 10 + 'zebra'
+        with use_shard(shard_for(self.owner.pk)):
+            message = Message.objects.create(owner=self.owner, source_account=self.account, title='t', content=body)
+            self.assertEqual(offload_messages(Message.objects.all()), 1)
+            message.refresh_from_db()
+        self.assertEqual(len(message.content), 20)
+        self.assertEqual(self.search('zebra'), [str(message.pk)])
+
+    def test_collect_garbage_deletes_unreferenced_blobs(self):
+        attached, unused = self.upload(self.owner, b'attached'), self.upload(self.owner, b'unused')
+        message_id = self.create_message(attachments=[attached])['message']['id']
+        # Everything was stored two days ago, except what is uploaded again now.
+        store, old = blobs.get_blob_store(), time.time() - 2 * 86400
+        for digest in (attached, unused):
+            os.utime(store.path(digest), (old, old))
+        UserBlob.objects.update(stored_at=timezone.now() - timedelta(days=2))
+        fresh = self.upload(self.other, b'fresh')
+
+        self.assertEqual([blob.hash for blob in blobs.collect_garbage(dry_run=True)], [unused])
+        self.assertTrue(store.exists(unused))
+        self.assertEqual([blob.hash for blob in blobs.collect_garbage()], [unused])
+        self.assertEqual([store.exists(digest) for digest in (attached, unused, fresh)], [True, False, True])
+        self.assertFalse(UserBlob.objects.filter(blob_hash=unused).exists())
+
+        with use_shard(shard_for(self.owner.pk)):
+            Message.objects.filter(pk=message_id).delete()
+        self.assertEqual([blob.hash for blob in blobs.collect_garbage()], [attached])
+        self.assertEqual(list(UserBlob.objects.values_list('blob_hash', flat=True)), [fresh])
+
+
+BULK_UPDATE = '''
+mutation($ids: [ID], $status: String!) {
+  bulkUpdateMessageStatus(messageIds: $ids, status: $status) { success errors updatedCount }
+}
+'''
+DELETE_MESSAGES = 'mutation($ids: [ID]) { deleteMessages(messageIds: $ids) { success errors deletedCount } }'
+
+
+# Both users on one shard, so only the owner filter keeps their rows apart.
+@override_settings(RATE_LIMIT_ENABLED=False, NEW_USER_SHARDS=['default'], MESSAGE_BULK_CHUNK_SIZE=3)
+class BulkMessageTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.owner, self.other = (
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ('owner', 'other')
+        )
+        self.messages = {user: self.add_messages(user, 4) for user in (self.owner, self.other)}
+
+    def add_messages(self, user, count, start=0):
+        account, _ = LinkedAccount.objects.get_or_create(
+            owner=user, service_name='gmail', account_identifier=user.email, defaults={'encrypted_token': 'token'},
+        )
+        return [
+            Message.objects.create(
+                owner=user, source_account=account, external_message_id=str(i), title=f'message {i}', content='hello',
+            )
+            for i in range(start, start + count)
+        ]
+
+    def graphql(self, user, query, **variables):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+        response = self.client.post(
+            '/api/graphql/', json.dumps({'query': query, 'variables': variables}), content_type='application/json',
+        )
+        return response.json()['data']
+
+    def ids(self, *users):
+        return [str(message.pk) for user in users for message in self.messages[user]]
+
+    def test_bulk_calls_only_touch_the_callers_messages(self):
+        ids = self.ids(self.owner, self.other)
+        result = self.graphql(self.owner, BULK_UPDATE, ids=ids, status='processed')['bulkUpdateMessageStatus']
+        self.assertEqual(result['updatedCount'], 4)
+        self.assertEqual(set(Message.objects.filter(owner=self.other).values_list('status', flat=True)), {'unprocessed'})
+
+        result = self.graphql(self.owner, DELETE_MESSAGES, ids=self.ids(self.other))['deleteMessages']
+        self.assertEqual((result['success'], result['deletedCount']), (True, 0))
+        self.assertEqual(Message.objects.filter(owner=self.other).count(), 4)
+
+    def test_queries_grow_with_chunks_not_rows(self):
+        messages = select_messages(self.owner)
+        # Per chunk of three: its ids, the savepoint, the rows for the change
+        # events, the UPDATE, the events and the release; then one empty read.
+        with self.assertNumQueries(2 * 6 + 1):
+            self.assertEqual(update_status(messages, 'processed'), 4)
+        self.add_messages(self.owner, 2, start=4)
+        with self.assertNumQueries(2 * 6 + 1):
+            self.assertEqual(update_status(messages, 'failed'), 6)
+        # Deletes add the dependent executions and one DELETE per link table.
+        with self.assertNumQueries(2 * 10 + 1):
+            self.assertEqual(delete_messages(messages), 6)
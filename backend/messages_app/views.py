@@ -1,3 +1,23 @@
-from django.shortcuts import render
+from django.http import FileResponse, JsonResponse
+from django.views.decorators.http import require_GET
 
-# Create your views here.
+from taskpilotx.blobs import get_blob_store
+from taskpilotx.streaming import stream_asgi
+from .models import MessageAttachment
+
+
+@require_GET
+def attachment_view(request, attachment_id):
+    """Stream an attachment of one of the caller's messages from the blob store."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    try:
+        attachment = MessageAttachment.objects.get(id=attachment_id, message__owner=request.user)
+    except MessageAttachment.DoesNotExist:
+        return JsonResponse({'error': 'Attachment not found'}, status=404)
+    return stream_asgi(request, FileResponse(
+        get_blob_store().open(attachment.blob_hash),
+        as_attachment=True,
+        filename=attachment.filename,
+        content_type=attachment.content_type,
+    ))
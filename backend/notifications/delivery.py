@@ -0,0 +1,232 @@
+"""
+Delivery worker.
+
+Claims due ``Delivery`` rows in batches (with the same claim protocol as the
+task engine, so several workers can run side by side), merges pending rows that
+share a ``coalesce_key`` into one digest, and sends:
+
+* emails over one SMTP connection kept open across batches and reopened when
+  the server drops it;
+* webhooks with one POST per URL per batch, over a pooled keep-alive client;
+  each delivery in the POST carries the ``user_id`` it belongs to.
+
+Failures are retried with exponential backoff and jitter, up to
+``DELIVERY_MAX_ATTEMPTS``.
+
+For local testing, run an SMTP sink and point ``EMAIL_PORT`` at it::
+
+    python -m aiosmtpd -n -l localhost:8025
+"""
+import logging
+import os
+import random
+import signal
+import smtplib
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections
+from django.utils import timezone
+
+from taskpilotx.sharding import exclude_locked
+from tasks.engine import claim
+from .models import Delivery
+
+
+logger = logging.getLogger(__name__)
+
+
+class EmailTransport:
+    """One SMTP connection, reused across batches."""
+
+    def __init__(self):
+        self.connection = None
+
+    def send(self, units):
+        """Send ``units``; returns ``{unit index: error}`` for the failed ones."""
+        errors = {}
+        for i, unit in enumerate(units):
+            message = EmailMessage(unit.subject, unit.body, settings.DEFAULT_FROM_EMAIL, [unit.destination])
+            try:
+                self._send(message)
+            except Exception as e:
+                errors[i] = str(e) or e.__class__.__name__
+        return errors
+
+    def _send(self, message):
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False)
+            self.connection.open()
+        try:
+            self.connection.send_messages([message])
+        except smtplib.SMTPServerDisconnected:
+            # Idle connections are dropped by servers; reconnect once.
+            self.close()
+            self.connection = get_connection(fail_silently=False)
+            self.connection.open()
+            self.connection.send_messages([message])
+        except (smtplib.SMTPException, OSError):
+            self.close()
+            raise
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+class WebhookTransport:
+    """Keep-alive HTTP client; all units for one URL go in one request."""
+
+    def __init__(self):
+        self.client = None
+
+    def send(self, units):
+        if self.client is None:
+            import httpx
+
+            self.client = httpx.Client(timeout=settings.EMAIL_TIMEOUT, limits=httpx.Limits(max_keepalive_connections=20))
+        by_url = {}
+        for i, unit in enumerate(units):
+            by_url.setdefault(unit.destination, []).append(i)
+
+        errors = {}
+        for url, indexes in by_url.items():
+            body = {'deliveries': [
+                {'user_id': units[i].owner_id, 'subject': units[i].subject, 'body': units[i].body,
+                 'payload': units[i].payload}
+                for i in indexes
+            ]}
+            try:
+                response = self.client.post(url, json=body)
+                error = f'HTTP {response.status_code}' if response.status_code >= 400 else None
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+            if error:
+                errors.update(dict.fromkeys(indexes, error))
+        return errors
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+class Unit:
+    """One message to send, standing for one or more coalesced deliveries."""
+
+    __slots__ = ('deliveries', 'owner_id', 'channel', 'destination', 'subject', 'body', 'payload')
+
+    def __init__(self, deliveries):
+        latest = deliveries[-1]
+        self.deliveries = deliveries
+        # Coalesced deliveries share a key, which includes the user.
+        self.owner_id = latest.owner_id
+        self.channel = latest.channel
+        self.destination = latest.destination
+        if len(deliveries) == 1:
+            self.subject, self.body, self.payload = latest.subject, latest.body, latest.payload
+        else:
+            self.subject = f'{len(deliveries)} new notifications'
+            self.body = '\n\n'.join(delivery.body for delivery in deliveries)
+            self.payload = {'notifications': [delivery.payload for delivery in deliveries]}
+
+
+def backoff(attempts):
+    """Seconds to wait before attempt ``attempts + 1``: capped exponential with full jitter."""
+    ceiling = min(settings.DELIVERY_RETRY_MAX_SECONDS, settings.DELIVERY_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class DeliveryWorker:
+    def __init__(self, worker_id=None, batch_size=None, lease_seconds=None):
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.batch_size = batch_size or settings.DELIVERY_BATCH_SIZE
+        self.lease = timedelta(seconds=lease_seconds or settings.DELIVERY_LEASE_SECONDS)
+        self.transports = {'email': EmailTransport(), 'webhook': WebhookTransport()}
+        self.stopping = threading.Event()
+
+    def run(self, poll_interval=1.0, once=False):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        try:
+            while not self.stopping.is_set():
+                self.recover_stale()
+                sent = self.deliver_due()
+                if once and not sent:
+                    break
+                if not sent:
+                    self.stopping.wait(poll_interval)
+        finally:
+            for transport in self.transports.values():
+                transport.close()
+            close_old_connections()
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def recover_stale(self):
+        expired = timezone.now() - self.lease
+        Delivery.objects.filter(status='sending', claimed_at__lt=expired).update(
+            status='pending', worker_id='', claimed_at=None
+        )
+
+    def claim_due(self):
+        now = timezone.now()
+        claim_fields = {'status': 'sending', 'worker_id': self.worker_id, 'claimed_at': now}
+        due = exclude_locked(Delivery.objects.filter(status='pending', next_attempt_at__lte=now)).order_by('next_attempt_at')
+        ids = claim(due, self.batch_size, **claim_fields)
+        # A due notification takes the rest of its window along with it.
+        keys = set(Delivery.objects.filter(id__in=ids).exclude(coalesce_key='').values_list('coalesce_key', flat=True))
+        if keys:
+            waiting = Delivery.objects.filter(status='pending', coalesce_key__in=keys).order_by('id')
+            ids += claim(waiting, self.batch_size, **claim_fields)
+        return ids
+
+    def deliver_due(self):
+        """Send one batch of due deliveries; returns the number of deliveries handled."""
+        ids = self.claim_due()
+        if not ids:
+            return 0
+
+        groups = {}
+        for delivery in Delivery.objects.filter(id__in=ids).order_by('id'):
+            key = (delivery.channel, delivery.coalesce_key) if delivery.coalesce_key else delivery.id
+            groups.setdefault(key, []).append(delivery)
+        units = [Unit(deliveries) for deliveries in groups.values()]
+
+        sent, failed = [], []
+        for channel, transport in self.transports.items():
+            batch = [unit for unit in units if unit.channel == channel]
+            if not batch:
+                continue
+            errors = transport.send(batch)
+            for i, unit in enumerate(batch):
+                if i in errors:
+                    failed += [(delivery, errors[i]) for delivery in unit.deliveries]
+                else:
+                    sent += [delivery.id for delivery in unit.deliveries]
+
+        mine = Delivery.objects.filter(status='sending', worker_id=self.worker_id)
+        mine.filter(id__in=sent).update(status='sent', sent_at=timezone.now(), worker_id='', claimed_at=None)
+        for delivery, error in failed:
+            attempts = delivery.attempts + 1
+            gave_up = attempts >= settings.DELIVERY_MAX_ATTEMPTS
+            if gave_up:
+                logger.warning('Delivery %s failed after %s attempts: %s', delivery.id, attempts, error)
+            mine.filter(id=delivery.id).update(
+                status='failed' if gave_up else 'pending',
+                attempts=attempts,
+                last_error=error,
+                next_attempt_at=timezone.now() + timedelta(seconds=0 if gave_up else backoff(attempts)),
+                worker_id='',
+                claimed_at=None,
+            )
+        return len(ids)
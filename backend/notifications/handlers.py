@@ -0,0 +1,94 @@
+"""
+Handlers of the action types that send something out.
+
+They only write ``Delivery`` rows, in the action's transaction; the delivery
+worker sends them. Notifications to the same user are coalesced: they wait
+``NOTIFICATION_COALESCE_SECONDS`` and go out as one digest, unless urgent.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from actions.handlers import register
+from actions.models import ActionType
+from messages_app.content import full_content
+from .models import Delivery
+
+
+URGENT = ('high', 'urgent')
+
+
+def queue_delivery(owner_id, channel, destination, subject='', body='', payload=None,
+                   coalesce_key='', delay=None, action_execution=None):
+    now = timezone.now()
+    return Delivery.objects.create(
+        owner_id=owner_id,
+        action_execution=action_execution,
+        channel=channel,
+        destination=destination,
+        subject=subject[:255],
+        body=body,
+        payload=payload or {},
+        coalesce_key=coalesce_key,
+        next_attempt_at=now + delay if delay else now,
+    )
+
+
+@register(ActionType.SEND_EMAIL)
+def send_email(execution, message=None, task_execution=None):
+    config = execution.config_data or {}
+    if not config.get('to'):
+        raise ValueError('No recipient: set "to" in the action config')
+    delivery = queue_delivery(
+        execution.executed_by_id, 'email', config['to'],
+        subject=config.get('subject', ''), body=config.get('body', ''), action_execution=execution,
+    )
+    return {'queued': True, 'delivery_id': delivery.id}
+
+
+@register(ActionType.FORWARD_MESSAGE)
+def forward_message(execution, message=None, task_execution=None):
+    if message is None:
+        raise ValueError('No message to forward')
+    config = execution.config_data or {}
+    to = config.get('to') or execution.executed_by.email
+    if not to:
+        raise ValueError('No recipient: set "to" in the action config')
+    delivery = queue_delivery(
+        execution.executed_by_id, 'email', to,
+        subject=f'Fwd: {message.title}', body=full_content(message), action_execution=execution,
+    )
+    return {'queued': True, 'delivery_id': delivery.id}
+
+
+@register(ActionType.SEND_NOTIFICATION)
+def send_notification(execution, message=None, task_execution=None):
+    config = execution.config_data or {}
+    text = config.get('message') or (message.title if message is not None else '')
+    urgency = config.get('urgency', 'normal')
+    payload = {
+        'message': text,
+        'urgency': urgency,
+        'task_id': execution.triggering_task_id,
+        'message_id': message.id if message is not None else None,
+    }
+
+    if settings.NOTIFICATION_WEBHOOK_URL:
+        channel, destination = 'webhook', settings.NOTIFICATION_WEBHOOK_URL
+    else:
+        channel, destination = 'email', execution.executed_by.email
+        if not destination:
+            raise ValueError('User has no email address to notify')
+
+    if urgency in URGENT:
+        coalesce_key, delay = '', None
+    else:
+        coalesce_key = f'notify:{execution.executed_by_id}'
+        delay = timedelta(seconds=settings.NOTIFICATION_COALESCE_SECONDS)
+    delivery = queue_delivery(
+        execution.executed_by_id, channel, destination,
+        subject='TaskPilotX notification', body=text, payload=payload,
+        coalesce_key=coalesce_key, delay=delay, action_execution=execution,
+    )
+    return {'queued': True, 'delivery_id': delivery.id}
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notifications.delivery import DeliveryWorker
+from taskpilotx.sharding import pin_process_shard
+
+
+class Command(BaseCommand):
+    help = 'Run a delivery worker: send queued emails and webhook notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.DELIVERY_BATCH_SIZE,
+                            help='Deliveries claimed per batch')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when idle')
+        parser.add_argument('--once', action='store_true', help='Exit when there is nothing due')
+        parser.add_argument('--shard', choices=settings.DATABASE_SHARDS, default='default',
+                            help='Database shard to work on')
+
+    def handle(self, *args, **options):
+        pin_process_shard(options['shard'])
+        worker = DeliveryWorker(batch_size=options['batch_size'])
+        self.stdout.write(f'Delivery worker {worker.worker_id} started')
+        worker.run(poll_interval=options['poll_interval'], once=options['once'])
+        self.stdout.write(f'Delivery worker {worker.worker_id} stopped')
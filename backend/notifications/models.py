@@ -0,0 +1,52 @@
+from django.db import models
+from django.conf import settings
+
+
+class Delivery(models.Model):
+    """Outbound email or webhook call, written by actions and sent by the delivery worker."""
+    
+    CHANNEL_CHOICES = [
+        ('email', 'Email'),
+        ('webhook', 'Webhook'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='deliveries')
+    action_execution = models.ForeignKey('actions.ActionExecution', on_delete=models.SET_NULL, null=True, blank=True)
+    
+    channel = models.CharField(max_length=20, choices=CHANNEL_CHOICES)
+    destination = models.CharField(max_length=500, help_text="Email address or webhook URL")
+    subject = models.CharField(max_length=255, blank=True)
+    body = models.TextField(blank=True)
+    payload = models.JSONField(default=dict, blank=True, help_text="Structured data sent to webhooks")
+    
+    # Pending deliveries sharing a key are merged into one (e.g. a user's notifications)
+    coalesce_key = models.CharField(max_length=100, blank=True)
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(help_text="Not sent before this time")
+    last_error = models.TextField(blank=True)
+    
+    # Worker claim, as for task executions
+    worker_id = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name_plural = 'deliveries'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='delivery_status_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.channel} to {self.destination} - {self.status}"
@@ -0,0 +1,132 @@
+import json
+import smtplib
+from datetime import timedelta
+from unittest import mock
+
+import httpx
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from actions.models import Action, ActionExecution, ActionType
+from .delivery import DeliveryWorker, backoff
+from .handlers import send_notification
+from .models import Delivery
+
+
+User = get_user_model()
+
+
+class RefusingBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPException('refused')
+
+
+# Everyone on one shard, so one worker sees all deliveries; mail goes to the locmem outbox.
+@override_settings(
+    NEW_USER_SHARDS=['default'], NOTIFICATION_WEBHOOK_URL='', NOTIFICATION_COALESCE_SECONDS=60,
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+)
+class DeliveryWorkerTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.action = Action.objects.create(
+            name='Notify', action_type=ActionType.SEND_NOTIFICATION, description='Notify',
+        )
+        self.alice, self.bob = (
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ('alice', 'bob')
+        )
+        self.worker = DeliveryWorker(worker_id='test')
+        self.addCleanup(self.worker.transports['email'].close)
+
+    def notify(self, user, text, urgency='normal'):
+        execution = ActionExecution.objects.create(
+            action=self.action, executed_by=user, status='running',
+            config_data={'message': text, 'urgency': urgency},
+        )
+        return Delivery.objects.get(pk=send_notification(execution)['delivery_id'])
+
+    def make_due(self, *deliveries):
+        Delivery.objects.filter(pk__in=[delivery.pk for delivery in deliveries]).update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_notifications_are_coalesced_per_user_per_window(self):
+        first = self.notify(self.alice, 'one')
+        self.notify(self.alice, 'two')
+        bob = self.notify(self.bob, 'three')
+        urgent = self.notify(self.alice, 'fire', urgency='urgent')
+        # Only the urgent one is due before the window is over.
+        self.assertEqual(self.worker.deliver_due(), 1)
+        self.assertEqual([message.body for message in mail.outbox], ['fire'])
+        self.assertEqual(Delivery.objects.get(pk=urgent.pk).status, 'sent')
+
+        # When the first of a user's window is due, the rest of the window goes with it.
+        self.make_due(first, bob)
+        mail.outbox.clear()
+        self.assertEqual(self.worker.deliver_due(), 3)
+        sent = sorted((message.to, message.subject, message.body) for message in mail.outbox)
+        self.assertEqual(sent, [
+            (['alice@example.com'], '2 new notifications', 'one\n\ntwo'),
+            (['bob@example.com'], 'TaskPilotX notification', 'three'),
+        ])
+        self.assertFalse(Delivery.objects.exclude(status='sent').exists())
+
+    def test_batches_share_one_smtp_connection(self):
+        for user in (self.alice, self.bob):
+            self.make_due(self.notify(user, 'one', urgency='high'), self.notify(user, 'two', urgency='high'))
+        with mock.patch('notifications.delivery.get_connection', wraps=get_connection) as connect:
+            self.worker.batch_size = 2
+            self.assertEqual(self.worker.deliver_due(), 2)
+            self.assertEqual(self.worker.deliver_due(), 2)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(connect.call_count, 1)
+
+    @override_settings(
+        EMAIL_BACKEND='notifications.tests.RefusingBackend', DELIVERY_MAX_ATTEMPTS=2,
+        DELIVERY_RETRY_BASE_SECONDS=30, DELIVERY_RETRY_MAX_SECONDS=100,
+    )
+    def test_failures_are_retried_with_backoff(self):
+        delivery = self.notify(self.alice, 'one', urgency='high')
+        before = timezone.now()
+        self.worker.deliver_due()
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.attempts, delivery.last_error), ('pending', 1, 'refused'))
+        self.assertGreaterEqual(delivery.next_attempt_at, before + timedelta(seconds=15))
+        self.assertLessEqual(delivery.next_attempt_at, timezone.now() + timedelta(seconds=30))
+        # Not due again until the backoff has passed.
+        self.assertEqual(self.worker.deliver_due(), 0)
+
+        self.make_due(delivery)
+        with self.assertLogs('notifications.delivery', 'WARNING'):
+            self.worker.deliver_due()
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.attempts), ('failed', 2))
+
+        # Each attempt waits up to twice as long as the one before, up to the cap.
+        for attempts, ceiling in ((1, 30), (2, 60), (3, 100), (6, 100)):
+            self.assertTrue(ceiling / 2 <= backoff(attempts) <= ceiling)
+
+    @override_settings(NOTIFICATION_WEBHOOK_URL='https://hooks.example.com/notify')
+    def test_webhook_deliveries_name_their_user(self):
+        self.make_due(self.notify(self.alice, 'one'), self.notify(self.bob, 'two'))
+        requests = []
+
+        def receive(request):
+            requests.append(json.loads(request.content))
+            return httpx.Response(204)
+
+        self.worker.transports['webhook'].client = httpx.Client(transport=httpx.MockTransport(receive))
+        self.addCleanup(self.worker.transports['webhook'].close)
+        self.assertEqual(self.worker.deliver_due(), 2)
+        # One POST for the URL, with a delivery per user.
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(
+            sorted((entry['user_id'], entry['body']) for entry in requests[0]['deliveries']),
+            [(self.alice.pk, 'one'), (self.bob.pk, 'two')],
+        )
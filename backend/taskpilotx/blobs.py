@@ -0,0 +1,217 @@
+"""
+Content-addressed blob store on local disk.
+
+Blobs are named by the SHA-256 of their content and stored as
+``<root>/<h[:2]>/<h[2:4]>/<h>``, so storing the same content twice keeps one
+copy. Writes stream through a temporary file in the same filesystem and are
+renamed into place, so readers never see partial blobs and memory stays
+bounded by the chunk size.
+
+Because a blob is named by its content, knowing a hash says nothing about who
+may use it: every user who stores a blob is recorded as one of its owners
+(``users.UserBlob``, on the default database), and hashes that come from
+clients are only accepted when ``owns_blob()`` says the user stored them.
+
+Blobs are shared, so deleting a message or an execution leaves its blobs in
+place; ``collect_garbage()`` (``manage.py collect_blobs``) deletes the ones no
+row on any shard references any more.
+"""
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+from collections import namedtuple
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+
+CHUNK_SIZE = 64 * 1024
+
+Blob = namedtuple('Blob', ['hash', 'size'])
+
+HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, digest):
+        if not HASH_RE.match(digest or ''):
+            raise ValueError(f'Invalid blob hash: {digest!r}')
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def put(self, chunks, max_size=None):
+        """Store the content of ``chunks`` (an iterable of bytes); returns the ``Blob``."""
+        tmp_dir = self.root / 'tmp'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        sha256, size = hashlib.sha256(), 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise BlobTooLarge(f'Content exceeds {max_size} bytes')
+                    sha256.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            digest = sha256.hexdigest()
+            path = self.path(digest)
+            if path.exists():
+                os.unlink(tmp_path)
+                # Stored again: a running collect_garbage() must keep it.
+                os.utime(path)
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return Blob(digest, size)
+
+    def put_bytes(self, data):
+        return self.put(data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE))
+
+    def put_text(self, text, chunk_chars=16 * 1024, max_size=None):
+        """Store ``text`` as UTF-8, encoding it a chunk at a time."""
+        return self.put((text[i:i + chunk_chars].encode() for i in range(0, len(text), chunk_chars)), max_size=max_size)
+
+    def exists(self, digest):
+        return self.path(digest).exists()
+
+    def size(self, digest):
+        return self.path(digest).stat().st_size
+
+    def open(self, digest):
+        return open(self.path(digest), 'rb')
+
+    def iter_chunks(self, digest, chunk_size=CHUNK_SIZE):
+        with self.open(digest) as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    def map(self, digest):
+        """Return a read-only memory map of the blob (``b''`` when empty)."""
+        with self.open(digest) as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def delete(self, digest):
+        try:
+            self.path(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, keep, older_than, dry_run=False):
+        """Delete the blobs not in ``keep`` last stored before the timestamp ``older_than``.
+
+        Temporary files of writes that never finished go too. Returns the
+        deleted ``Blob``s.
+        """
+        deleted = []
+        for path in self.root.glob('??/??/*'):
+            if path.name in keep or not HASH_RE.match(path.name):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime >= older_than:
+                continue
+            if not dry_run:
+                path.unlink(missing_ok=True)
+            deleted.append(Blob(path.name, stat.st_size))
+        for path in self.root.glob('tmp/*'):
+            try:
+                if path.stat().st_mtime < older_than and not dry_run:
+                    path.unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass
+        return deleted
+
+
+_store = None
+
+
+def get_blob_store():
+    """Process-wide store rooted at ``BLOB_STORE_DIR``."""
+    global _store
+    if _store is None:
+        _store = BlobStore(settings.BLOB_STORE_DIR)
+    return _store
+
+
+def record_owner(user_id, digest):
+    """Record that the user ``user_id`` stored the blob ``digest``."""
+    from users.models import UserBlob
+
+    UserBlob.objects.using('default').update_or_create(
+        user_id=user_id, blob_hash=digest, defaults={'stored_at': timezone.now()},
+    )
+
+
+def owns_blob(user_id, digest):
+    """Whether ``user_id`` stored the blob ``digest`` and it is still in the store."""
+    from users.models import UserBlob
+
+    if not isinstance(digest, str) or not HASH_RE.match(digest):
+        return False
+    return (
+        UserBlob.objects.using('default').filter(user_id=user_id, blob_hash=digest).exists()
+        and get_blob_store().exists(digest)
+    )
+
+
+def referenced_blobs(stored_since):
+    """Hashes in use: referenced by a row on any shard, or stored by a user after ``stored_since``."""
+    from actions.models import ActionExecution
+    from messages_app.models import Message, MessageAttachment
+    from users.models import UserBlob
+
+    # Recent uploads are kept until the action or message that will use them is created.
+    hashes = set(
+        UserBlob.objects.using('default').filter(stored_at__gte=stored_since).values_list('blob_hash', flat=True)
+    )
+    for alias in settings.DATABASE_SHARDS:
+        hashes.update(
+            Message.objects.using(alias).exclude(content_hash='').values_list('content_hash', flat=True).iterator()
+        )
+        hashes.update(MessageAttachment.objects.using(alias).values_list('blob_hash', flat=True).iterator())
+        for field in ('config_data', 'result_data'):
+            hashes.update(
+                ActionExecution.objects.using(alias).filter(**{f'{field}__has_key': 'blob'})
+                .values_list(f'{field}__blob', flat=True).iterator()
+            )
+    hashes.discard(None)
+    return hashes
+
+
+def collect_garbage(grace_seconds=None, dry_run=False, batch_size=1000):
+    """Delete the blobs nothing references and their ownership records; returns the deleted ``Blob``s.
+
+    Blobs stored within the last ``grace_seconds`` (``BLOB_GC_GRACE_SECONDS``)
+    are kept, which also covers blobs stored while the collection runs.
+    """
+    from users.models import UserBlob
+
+    grace = settings.BLOB_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    deleted = get_blob_store().sweep(referenced_blobs(cutoff), cutoff.timestamp(), dry_run=dry_run)
+    if not dry_run:
+        for i in range(0, len(deleted), batch_size):
+            UserBlob.objects.using('default').filter(
+                blob_hash__in=[blob.hash for blob in deleted[i:i + batch_size]], stored_at__lt=cutoff,
+            ).delete()
+    return deleted
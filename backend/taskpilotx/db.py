@@ -0,0 +1,105 @@
+"""
+Database settings built from environment configuration.
+
+Used by ``settings.py``; must not import Django models.
+
+Connection strategy (per ``<PREFIX>_*`` variables):
+
+* ``CONN_MAX_AGE`` / ``CONN_HEALTH_CHECKS`` keep connections open across
+  requests and verify them before reuse.
+* ``POOL`` enables Django's psycopg 3 connection pool instead (persistent
+  connections are then handled by the pool, so ``CONN_MAX_AGE`` is forced to 0).
+  It needs ``psycopg[binary,pool]``; without it settings fail to load.
+* ``POOLER_MODE=transaction`` is for PgBouncer/Supavisor transaction mode
+  (Supabase port 6543): server-side cursors and prepared statements do not
+  survive a transaction there, so both are disabled.
+
+Read replicas are listed in ``<PREFIX>_REPLICAS`` (hosts, or file names for
+SQLite) and otherwise share the primary's settings.
+
+Additional shards for user data are listed in ``<PREFIX>_SHARDS`` (aliases);
+each is configured like the primary from its own ``<PREFIX>_<ALIAS>_*``
+variables, e.g. ``DB_SHARD_1_HOST`` for the alias ``shard_1``.
+"""
+from importlib.util import find_spec
+
+from decouple import Csv, config
+from django.core.exceptions import ImproperlyConfigured
+
+
+def psycopg3_available():
+    return find_spec('psycopg') is not None
+
+
+def database(prefix='DB', **defaults):
+    """Return a ``DATABASES`` entry configured from ``<prefix>_*`` variables."""
+    def setting(name, default=None, cast=str):
+        return config(f'{prefix}_{name}', default=defaults.get(name.lower(), default), cast=cast)
+
+    engine = setting('ENGINE', 'postgresql')
+    if engine == 'sqlite':
+        return {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': setting('NAME', 'db.sqlite3'),
+            'CONN_MAX_AGE': setting('CONN_MAX_AGE', 60, cast=int),
+            # Take the write lock at BEGIN: outbox writes read ids before updating,
+            # and a deferred transaction could not upgrade after another commit.
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        }
+
+    options = {}
+    connect_timeout = setting('CONNECT_TIMEOUT', 10, cast=int)
+    if connect_timeout:
+        options['connect_timeout'] = connect_timeout
+    sslmode = setting('SSLMODE', '')
+    if sslmode:
+        options['sslmode'] = sslmode
+
+    transaction_pooler = setting('POOLER_MODE', 'session') == 'transaction'
+    use_pool = setting('POOL', False, cast=bool)
+    if transaction_pooler and psycopg3_available():
+        # psycopg 3 prepares statements server-side after repeated use.
+        options['prepare_threshold'] = None
+    if use_pool:
+        if not psycopg3_available():
+            raise ImproperlyConfigured(
+                f'{prefix}_POOL needs psycopg 3 with its pool: pip install "psycopg[binary,pool]"'
+            )
+        options['pool'] = {
+            'min_size': setting('POOL_MIN_SIZE', 2, cast=int),
+            'max_size': setting('POOL_MAX_SIZE', 10, cast=int),
+            'timeout': setting('POOL_TIMEOUT', 10, cast=int),
+        }
+
+    return {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': setting('NAME', 'postgres'),
+        'USER': setting('USER', 'postgres'),
+        'PASSWORD': setting('PASSWORD') if 'password' in defaults else config(f'{prefix}_PASSWORD'),
+        'HOST': setting('HOST', 'localhost'),
+        'PORT': setting('PORT', '5432'),
+        'CONN_MAX_AGE': 0 if use_pool else setting('CONN_MAX_AGE', 60, cast=int),
+        'CONN_HEALTH_CHECKS': setting('CONN_HEALTH_CHECKS', True, cast=bool),
+        'DISABLE_SERVER_SIDE_CURSORS': transaction_pooler,
+        'OPTIONS': options,
+    }
+
+
+def replicas(primary, prefix='DB'):
+    """Return ``{alias: settings}`` for the replicas of ``primary``."""
+    databases = {}
+    for i, location in enumerate(config(f'{prefix}_REPLICAS', default='', cast=Csv())):
+        replica = dict(primary, OPTIONS=dict(primary.get('OPTIONS', {})))
+        replica['NAME' if primary['ENGINE'].endswith('sqlite3') else 'HOST'] = location
+        # Tests run against the primary; replicas see its data instead of a copy.
+        replica['TEST'] = {'MIRROR': 'default'}
+        databases[f'replica_{i + 1}'] = replica
+    return databases
+
+
+def shards(prefix='DB'):
+    """Return ``{alias: settings}`` for the additional shards."""
+    return {
+        alias: database(f'{prefix}_{alias.upper()}')
+        for alias in config(f'{prefix}_SHARDS', default='', cast=Csv())
+    }
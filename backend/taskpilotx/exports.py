@@ -0,0 +1,130 @@
+"""
+Streaming NDJSON export of messages and execution history.
+
+Rows are read with ``QuerySet.iterator(chunk_size=...)`` (a server-side cursor
+on PostgreSQL), serialized with orjson and written out in fixed-size chunks,
+optionally zstd-compressed, so memory use does not grow with the export size.
+Offloaded message bodies are read back from the blob store one row at a time,
+so ``content`` is always the whole body.
+"""
+import orjson
+import zstandard
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_GET
+
+from .sharding import shard_db
+from .streaming import stream_asgi
+
+
+CHUNK_SIZE = 2000
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+def _messages(user_id):
+    from messages_app.models import Message
+
+    queryset = Message.objects.all() if user_id is None else Message.objects.filter(owner_id=user_id)
+    return queryset, 'created_at', (
+        'id', 'owner_id', 'source_account_id', 'external_message_id', 'title', 'content', 'content_hash',
+        'summary', 'sender_info', 'status', 'priority', 'ai_analysis', 'created_at', 'updated_at', 'processed_at',
+    )
+
+
+def _with_full_body(row):
+    from messages_app.content import full_content
+    from messages_app.models import Message
+
+    if row['content_hash']:
+        row['content'] = full_content(Message(content=row['content'], content_hash=row['content_hash']))
+    return row
+
+
+def _action_executions(user_id):
+    from actions.models import ActionExecution
+
+    queryset = ActionExecution.objects.all() if user_id is None else ActionExecution.objects.filter(executed_by_id=user_id)
+    return queryset, 'started_at', (
+        'id', 'action_id', 'action__action_type', 'executed_by_id', 'triggering_task_id', 'status',
+        'config_data', 'result_data', 'error_message', 'started_at', 'completed_at',
+    )
+
+
+def _task_executions(user_id):
+    from tasks.models import TaskExecution
+
+    queryset = TaskExecution.objects.all() if user_id is None else TaskExecution.objects.filter(task__owner_id=user_id)
+    return queryset, 'started_at', (
+        'id', 'task_id', 'task__owner_id', 'triggering_message_id', 'status', 'ai_decision',
+        'error_message', 'started_at', 'completed_at',
+    )
+
+
+EXPORTS = {
+    'messages': _messages,
+    'action-executions': _action_executions,
+    'task-executions': _task_executions,
+}
+
+
+def export_queryset(kind, user_id=None, since=None, using=None):
+    """Return the ``values()`` queryset for an export, ordered by id, read from ``using`` if given."""
+    queryset, timestamp_field, fields = EXPORTS[kind](user_id)
+    if using is not None:
+        queryset = queryset.using(using)
+    if since is not None:
+        queryset = queryset.filter(**{f'{timestamp_field}__gte': since})
+    return queryset.order_by('id').values(*fields)
+
+
+def iter_export(kind, user_id=None, since=None, compression=None, chunk_size=CHUNK_SIZE, using=None):
+    """Yield the export as NDJSON byte chunks, zstd-compressed if requested."""
+    compressor = zstandard.ZstdCompressor(level=3).compressobj() if compression == 'zstd' else None
+    buffer = bytearray()
+    rows = export_queryset(kind, user_id, since, using).iterator(chunk_size=chunk_size)
+    if kind == 'messages':
+        # Offloaded rows hold a preview only.
+        rows = map(_with_full_body, rows)
+    for row in rows:
+        buffer += orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+        if len(buffer) >= WRITE_BUFFER_SIZE:
+            chunk = compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+            buffer.clear()
+            if chunk:
+                yield chunk
+    tail = bytes(buffer)
+    if compressor:
+        tail = compressor.compress(tail) + compressor.flush()
+    if tail:
+        yield tail
+
+
+@require_GET
+def export_view(request, kind):
+    """Stream the authenticated user's history as NDJSON.
+
+    Query parameters: ``since`` (ISO timestamp) and ``compression=zstd``.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    if kind not in EXPORTS:
+        return JsonResponse({'error': f'Unknown export {kind!r}'}, status=404)
+
+    since = request.GET.get('since')
+    if since is not None:
+        since = parse_datetime(since)
+        if since is None:
+            return JsonResponse({'error': 'Invalid since timestamp'}, status=400)
+    compression = request.GET.get('compression')
+    if compression not in (None, 'zstd'):
+        return JsonResponse({'error': 'Unsupported compression'}, status=400)
+
+    filename = f'{kind}.jsonl' + ('.zst' if compression else '')
+    # The body is generated after the middleware has returned, outside the
+    # request's shard context, so the shard is bound to the querysets here.
+    response = StreamingHttpResponse(
+        iter_export(kind, request.user.pk, since, compression, using=shard_db()),
+        content_type='application/zstd' if compression else 'application/x-ndjson',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return stream_asgi(request, response)
@@ -0,0 +1,52 @@
+"""
+gunicorn configuration, run from backend/:
+
+    gunicorn -c python:taskpilotx.gunicorn_conf
+    SERVER_WORKER_TYPE=async gunicorn -c python:taskpilotx.gunicorn_conf
+
+``SERVER_WORKER_TYPE`` picks the pool, sync (gthread, WSGI) or async (uvicorn,
+ASGI); see taskpilotx/serving.py for which endpoints each should serve and what
+the hooks do. ``python manage.py bench_serving`` compares the two.
+"""
+import multiprocessing
+
+# Not imported as ``config``: gunicorn would take it for its own setting of that name.
+from decouple import config as env
+
+from taskpilotx import serving
+
+
+WORKER_TYPE = env('SERVER_WORKER_TYPE', default='sync')
+# Recycle a worker whose own memory (USS) passes this (0 disables the check)
+MAX_MEMORY_MB = env('SERVER_MAX_MEMORY_MB', default=384, cast=int)
+MEMORY_CHECK_SECONDS = env('SERVER_MEMORY_CHECK_SECONDS', default=10, cast=int)
+
+wsgi_app = serving.APPLICATIONS[WORKER_TYPE]
+worker_class = serving.WORKER_CLASSES[WORKER_TYPE]
+bind = env('SERVER_BIND', default='0.0.0.0:8000')
+# Sync workers wait on the database with their threads; async ones are one per core.
+workers = env(
+    'SERVER_WORKERS',
+    default=multiprocessing.cpu_count() * (2 if WORKER_TYPE == 'sync' else 1),
+    cast=int,
+)
+threads = env('SERVER_THREADS', default=4, cast=int)
+preload_app = env('SERVER_PRELOAD', default=True, cast=bool)
+max_requests = env('SERVER_MAX_REQUESTS', default=5000, cast=int)
+max_requests_jitter = env('SERVER_MAX_REQUESTS_JITTER', default=500, cast=int)
+timeout = env('SERVER_TIMEOUT', default=30, cast=int)
+graceful_timeout = env('SERVER_GRACEFUL_TIMEOUT', default=30, cast=int)
+keepalive = env('SERVER_KEEPALIVE', default=5, cast=int)
+accesslog = env('SERVER_ACCESS_LOG', default='-') or None
+
+
+def when_ready(server):
+    # With preload_app the project is imported by now and no worker is forked yet.
+    if preload_app:
+        serving.preload()
+
+
+def post_worker_init(worker):
+    serving.warm_worker(worker, WORKER_TYPE)
+    if MAX_MEMORY_MB:
+        serving.watch_memory(MAX_MEMORY_MB, MEMORY_CHECK_SECONDS)
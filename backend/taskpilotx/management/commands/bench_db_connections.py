@@ -0,0 +1,67 @@
+import statistics
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure per-request database connection overhead, comparing a new connection per '
+        'request (CONN_MAX_AGE=0) with the configured connection strategy'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        connection = connections[alias]
+        configured = connection.settings_dict['CONN_MAX_AGE']
+        uses_pool = bool(connection.settings_dict['OPTIONS'].get('pool'))
+
+        baseline = dict(connection.settings_dict)
+        baseline['OPTIONS'] = {k: v for k, v in baseline['OPTIONS'].items() if k != 'pool'}
+        baseline['CONN_MAX_AGE'] = 0
+
+        strategy = 'psycopg pool' if uses_pool else f'CONN_MAX_AGE={configured}'
+        self._report('new connection per request', alias, baseline, options['requests'])
+        self._report(f'configured ({strategy})', alias, connection.settings_dict, options['requests'])
+
+    def _report(self, label, alias, settings_dict, requests):
+        connection = connections[alias]
+        connection.close()
+        original = connection.settings_dict
+        connection.settings_dict = settings_dict
+        opened = []
+
+        def count(sender, connection, **kwargs):
+            if connection.alias == alias:
+                opened.append(1)
+
+        connection_created.connect(count)
+        timings = []
+        try:
+            for _ in range(requests):
+                # Replays the request lifecycle signals a real request goes through.
+                start = time.perf_counter()
+                request_started.send(sender=WSGIHandler)
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                request_finished.send(sender=WSGIHandler)
+                timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            connection_created.disconnect(count)
+            connection.close()
+            connection.settings_dict = original
+
+        timings.sort()
+        self.stdout.write(
+            f'{label}: {requests} requests, {len(opened)} connections opened, '
+            f'mean {statistics.mean(timings):.2f} ms, p50 {timings[len(timings) // 2]:.2f} ms, '
+            f'p95 {timings[int(len(timings) * 0.95)]:.2f} ms'
+        )
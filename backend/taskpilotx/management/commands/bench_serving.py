@@ -0,0 +1,150 @@
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from importlib.util import find_spec
+
+import psutil
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from taskpilotx.serving import WORKER_CLASSES
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve the project with taskpilotx/gunicorn_conf.py and measure requests/sec, latency '
+        'and memory per worker for the sync and async worker types'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-type', choices=['sync', 'async', 'both'], default='both')
+        parser.add_argument('--path', default='/api/graphql/')
+        parser.add_argument('--body', default='{"query": "{ __typename }"}', help='POSTed as JSON; empty for GET')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=10.0)
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--no-preload', action='store_true')
+        parser.add_argument(
+            '--rate-limit', action='store_true',
+            help='Keep rate limiting on (every request comes from one address)',
+        )
+
+    def handle(self, *args, **options):
+        for module in ('gunicorn', 'uvicorn'):
+            if find_spec(module) is None:
+                raise CommandError(f'{module} is not installed')
+        types = ['sync', 'async'] if options['worker_type'] == 'both' else [options['worker_type']]
+        for worker_type in types:
+            self._bench(worker_type, options)
+
+    def _bench(self, worker_type, options):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        env = dict(
+            os.environ,
+            SERVER_WORKER_TYPE=worker_type,
+            SERVER_BIND=f'127.0.0.1:{port}',
+            SERVER_WORKERS=str(options['workers']),
+            SERVER_THREADS=str(options['threads']),
+            SERVER_PRELOAD=str(not options['no_preload']),
+            SERVER_ACCESS_LOG='',
+            RATE_LIMIT_ENABLED=str(options['rate_limit']),
+        )
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'python:taskpilotx.gunicorn_conf'],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        try:
+            self._wait_until_serving(server, port, options)
+            startup = time.perf_counter() - start
+            # Let every worker finish warming before measuring.
+            time.sleep(1)
+            statuses, latencies, elapsed = self._load(port, options)
+            memory = [child.memory_full_info() for child in psutil.Process(server.pid).children()]
+            master = psutil.Process(server.pid).memory_info().rss
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+        latencies.sort()
+        mb = 2**20
+        preload = 'no preload' if options['no_preload'] else 'preload'
+        self.stdout.write(
+            f'{worker_type} ({WORKER_CLASSES[worker_type]}, {options["workers"]} workers, {preload}): '
+            f'first response after {startup * 1000:.0f} ms'
+        )
+        self.stdout.write(
+            f'  {len(latencies) / elapsed:.0f} req/s over {elapsed:.1f} s at concurrency {options["concurrency"]}, '
+            f'p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, '
+            f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, '
+            f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms, '
+            f'status {dict(sorted(statuses.items()))}'
+        )
+        self.stdout.write(f'  master RSS {master / mb:.1f} MB')
+        for info in memory:
+            # USS is what the worker does not share with the master or the other workers.
+            self.stdout.write(f'  worker RSS {info.rss / mb:.1f} MB, USS {info.uss / mb:.1f} MB')
+
+    def _wait_until_serving(self, server, port, options):
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'gunicorn exited:\n{server.stderr.read()[-2000:]}')
+            try:
+                self._request(http.client.HTTPConnection('127.0.0.1', port, timeout=5), options)
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise CommandError('gunicorn did not start serving within 60 s')
+
+    def _request(self, connection, options):
+        body = options['body'].encode()
+        headers = {'Content-Type': 'application/json'} if body else {}
+        connection.request('POST' if body else 'GET', options['path'], body=body or None, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def _load(self, port, options):
+        statuses = Counter()
+        latencies = []
+        lock = threading.Lock()
+        stop = time.perf_counter() + options['duration']
+
+        def client():
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            mine, counts = [], Counter()
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                try:
+                    status = self._request(connection, options)
+                except (OSError, http.client.HTTPException):
+                    status = 'error'
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                mine.append(time.perf_counter() - start)
+                counts[str(status)] += 1
+            connection.close()
+            with lock:
+                latencies.extend(mine)
+                statuses.update(counts)
+
+        start = time.perf_counter()
+        clients = [threading.Thread(target=client) for _ in range(options['concurrency'])]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        return statuses, latencies, time.perf_counter() - start
+
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from taskpilotx.blobs import collect_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete blobs that no message, attachment or action execution on any shard references '
+        'and that were stored longer than BLOB_GC_GRACE_SECONDS ago'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-seconds', type=int, help='Override BLOB_GC_GRACE_SECONDS')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+
+    def handle(self, *args, **options):
+        deleted = collect_garbage(options['grace_seconds'], dry_run=options['dry_run'])
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(f'{verb} {len(deleted)} blobs ({sum(blob.size for blob in deleted)} bytes)')
@@ -0,0 +1,43 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from taskpilotx.exports import EXPORTS, iter_export
+from taskpilotx.sharding import pin_process_shard, shard_db
+
+
+class Command(BaseCommand):
+    help = 'Stream messages or execution history as NDJSON (optionally zstd-compressed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--user', type=int, help='Only export this user id (default: all users)')
+        parser.add_argument('--since', help='Only rows created at or after this ISO timestamp')
+        parser.add_argument('--compression', choices=['zstd'])
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per database round trip')
+        parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+        parser.add_argument('--shard', choices=settings.DATABASE_SHARDS, default='default',
+                            help='Database shard to work on')
+
+    def handle(self, *args, **options):
+        pin_process_shard(options['shard'])
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('Invalid --since timestamp')
+
+        chunks = iter_export(
+            options['kind'], options['user'], since, options['compression'],
+            chunk_size=options['chunk_size'], using=shard_db(),
+        )
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,106 @@
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# What a fresh process runs for each stage, in a child so nothing is imported yet.
+STAGES = {
+    'setup': 'import django; django.setup()',
+    # A web worker ready for its first request.
+    'urls': (
+        'import django; django.setup(); '
+        'from django.urls import get_resolver; get_resolver().url_patterns'
+    ),
+    # What the first GraphQL request adds on top.
+    'schema': (
+        'import django; django.setup(); '
+        'from django.urls import get_resolver; get_resolver().url_patterns; '
+        'from taskpilotx.views import load_schema; load_schema()'
+    ),
+}
+
+
+def parse_importtime(output):
+    """``-X importtime`` lines -> list of ``(module, self_us, cumulative_us, depth)``."""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue  # header
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the startup of a fresh process with these settings and break the import time '
+        'down by package (python -X importtime); use --settings to compare profiles'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stage', choices=sorted(STAGES),
+            help='Defaults to urls, or to setup for settings without a URLconf (worker_settings)',
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument(
+            '--modules', action='store_true',
+            help='List the slowest top-level imports (cumulative) instead of packages',
+        )
+
+    def handle(self, *args, **options):
+        stage = options['stage'] or ('urls' if settings.ROOT_URLCONF else 'setup')
+        if stage != 'setup' and not settings.ROOT_URLCONF:
+            raise CommandError(f'{settings.SETTINGS_MODULE} has no ROOT_URLCONF; only --stage setup can run')
+        # The first run may still be compiling .pyc files; it is not counted.
+        self._run(stage)
+        runs = [self._run(stage) for _ in range(max(1, options['repeat']))]
+        wall, output = min(runs)
+        modules = parse_importtime(output)
+        total = sum(self_us for _, self_us, _, _ in modules)
+        self.stdout.write(
+            f'{stage} ({settings.SETTINGS_MODULE}): '
+            f'{wall * 1000:.0f} ms wall (best of {len(runs)}, median '
+            f'{statistics.median(w for w, _ in runs) * 1000:.0f} ms), '
+            f'{total / 1000:.0f} ms importing {len(modules)} modules'
+        )
+        if options['modules']:
+            self._modules(modules, options['limit'])
+        else:
+            self._packages(modules, options['limit'])
+
+    def _run(self, stage):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STAGES[stage]],
+            capture_output=True, text=True,
+        )
+        wall = time.perf_counter() - start
+        if result.returncode:
+            raise CommandError(f'{stage} failed:\n{result.stderr[-2000:]}')
+        return wall, result.stderr
+
+    def _packages(self, modules, limit):
+        packages = defaultdict(lambda: [0, 0])
+        for name, self_us, _, _ in modules:
+            package = packages[name.partition('.')[0]]
+            package[0] += self_us
+            package[1] += 1
+        self.stdout.write(f'{"package":<32} {"ms":>8} {"modules":>8}')
+        for name, (self_us, count) in sorted(packages.items(), key=lambda item: -item[1][0])[:limit]:
+            self.stdout.write(f'{name:<32} {self_us / 1000:>8.1f} {count:>8}')
+
+    def _modules(self, modules, limit):
+        top = [(name, cumulative_us) for name, _, cumulative_us, depth in modules if depth == 0]
+        self.stdout.write(f'{"module":<48} {"cumulative ms":>14}')
+        for name, cumulative_us in sorted(top, key=lambda item: -item[1])[:limit]:
+            self.stdout.write(f'{name:<48} {cumulative_us / 1000:>14.1f}')
@@ -1,8 +1,24 @@
+import json
+import math
+import time
+
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.urls import reverse
 from django.utils.decorators import sync_and_async_middleware
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from graphql import FieldNode, FragmentDefinitionNode, InlineFragmentNode, OperationType, parse
+from graphql.error import GraphQLError
+from graphql.utilities import value_from_ast_untyped
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from users.authentication import TokenUserAuthentication
+
+from .ratelimit import client_ip, get_limiter, get_shedder, queue_time
+from .routers import routing
+from .sharding import shard_assignment, use_shard
 
 
 User = get_user_model()
@@ -26,18 +42,245 @@ def JWTAuthenticationMiddleware(get_response):
             
             try:
                 # Use JWT authentication to validate token
-                jwt_auth = JWTAuthentication()
+                jwt_auth = TokenUserAuthentication()
                 validated_token = jwt_auth.get_validated_token(token)
                 user = jwt_auth.get_user(validated_token)
                 
                 if user:
                     request.user = user
                     
-            except (InvalidToken, TokenError, User.DoesNotExist):
+            except (InvalidToken, TokenError, AuthenticationFailed, User.DoesNotExist):
                 # Token is invalid or user doesn't exist
                 request.user = AnonymousUser()
         
         response = get_response(request)
         return response
     
-    return middleware
\ No newline at end of file
+    return middleware
+
+
+GRAPHQL_PATH_SUFFIX = 'graphql/'
+
+
+# Mutations limited like the REST endpoints they duplicate
+GRAPHQL_AUTH_SCOPES = {'login': 'login', 'register': 'register'}
+
+
+def _graphql_mutation_fields(request):
+    """Root fields of the mutations in a GraphQL request as ``(name, arguments)``.
+
+    ``None`` when the body cannot be read. Several middlewares ask; the body is
+    only parsed once.
+    """
+    if not hasattr(request, '_graphql_mutation_fields'):
+        request._graphql_mutation_fields = _parse_graphql_mutations(request)
+    return request._graphql_mutation_fields
+
+
+def _is_graphql_mutation(request):
+    """Whether a GraphQL request contains a mutation (unreadable bodies count as one)."""
+    fields = _graphql_mutation_fields(request)
+    return fields is None or bool(fields)
+
+
+def _parse_graphql_mutations(request):
+    if request.method == 'GET':
+        payloads = [request.GET]
+    else:
+        try:
+            payloads = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        if not isinstance(payloads, list):
+            payloads = [payloads]
+
+    fields = []
+    for payload in payloads:
+        if not hasattr(payload, 'get'):
+            return None
+        query = payload.get('query') or ''
+        # Cheap pre-check; only documents mentioning a mutation are parsed.
+        if 'mutation' not in query:
+            continue
+        try:
+            document = parse(query)
+        except GraphQLError:
+            return None
+        variables = payload.get('variables')
+        if isinstance(variables, str):
+            # GET requests carry them as JSON in the query string.
+            try:
+                variables = json.loads(variables)
+            except ValueError:
+                variables = None
+        if not isinstance(variables, dict):
+            variables = {}
+        fragments = {
+            definition.name.value: definition
+            for definition in document.definitions if isinstance(definition, FragmentDefinitionNode)
+        }
+        operation_name = payload.get('operationName')
+        for definition in document.definitions:
+            if getattr(definition, 'operation', None) != OperationType.MUTATION:
+                continue
+            if not operation_name or (definition.name and definition.name.value == operation_name):
+                fields.extend(_root_fields(definition.selection_set, fragments, variables, set()))
+    return fields
+
+
+def _root_fields(selection_set, fragments, variables, seen):
+    # Aliases and fragments do not hide a field: each occurrence is returned.
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            arguments = {
+                argument.name.value: value_from_ast_untyped(argument.value, variables)
+                for argument in selection.arguments
+            }
+            yield selection.name.value, arguments
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _root_fields(selection.selection_set, fragments, variables, seen)
+        elif selection.name.value in fragments and selection.name.value not in seen:
+            seen.add(selection.name.value)
+            yield from _root_fields(fragments[selection.name.value].selection_set, fragments, variables, seen)
+
+
+def ShardRoutingMiddleware(get_response):
+    """
+    Middleware that runs each request against the database shard of its user,
+    refusing writes while the user's data is being moved to another shard
+    """
+
+    def middleware(request):
+        if not request.user.is_authenticated:
+            return get_response(request)
+
+        alias, locked = shard_assignment(request.user.pk)
+        if locked:
+            if request.path.endswith(GRAPHQL_PATH_SUFFIX):
+                writes = _is_graphql_mutation(request)
+            else:
+                writes = request.method not in ('GET', 'HEAD', 'OPTIONS')
+            if writes:
+                response = JsonResponse({'error': 'Your data is being moved; try again shortly'}, status=503)
+                response['Retry-After'] = '30'
+                return response
+
+        with use_shard(alias):
+            return get_response(request)
+
+    return middleware
+
+
+def _sticky_key(user_id):
+    return f'db-routing:wrote:{user_id}'
+
+
+def DatabaseRoutingMiddleware(get_response):
+    """
+    Middleware that sends GraphQL queries to read replicas and everything that
+    writes, plus a user's requests shortly after a write, to the primary
+    """
+
+    def middleware(request):
+        if not settings.DATABASE_REPLICAS:
+            return get_response(request)
+
+        user_id = request.user.pk if request.user.is_authenticated else None
+        if request.path.endswith(GRAPHQL_PATH_SUFFIX):
+            use_replicas = not _is_graphql_mutation(request)
+        else:
+            use_replicas = request.method in ('GET', 'HEAD', 'OPTIONS')
+        if use_replicas and user_id is not None and cache.get(_sticky_key(user_id)):
+            use_replicas = False
+
+        with routing(use_replicas=use_replicas) as state:
+            response = get_response(request)
+
+        if state.wrote and user_id is not None:
+            cache.set(_sticky_key(user_id), True, settings.READ_YOUR_WRITES_SECONDS)
+        return response
+
+    return middleware
+
+
+def _account_key(data):
+    """The account login ``data`` names, for limiting attempts per account."""
+    if not hasattr(data, 'get'):
+        return None
+    email, username = data.get('email'), data.get('username')
+    if isinstance(email, str) and email.strip():
+        return email.strip().lower()
+    if isinstance(username, str) and username.strip():
+        return f'username:{username.strip().lower()}'
+    return None
+
+
+def _login_account(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        data = request.POST
+    return _account_key(data)
+
+
+def _auth_checks(scope, ip, account=None):
+    # Unauthenticated endpoints are limited per address.
+    checks = [(scope, f'ip:{ip}')]
+    if scope == 'login' and account:
+        checks.append(('login_account', account))
+    return checks
+
+
+def _retry_response(message, status, retry_after):
+    response = JsonResponse({'error': message}, status=status)
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def RateLimitMiddleware(get_response):
+    """
+    Middleware that limits how fast each client may call each kind of
+    operation (429 with Retry-After), and turns away the heaviest clients
+    first while this process is overloaded (503 with Retry-After)
+    """
+    auth_scopes = {
+        reverse('token_obtain_pair'): 'login',
+        reverse('register'): 'register',
+        reverse('token_refresh'): 'token_refresh',
+    }
+    limiter = get_limiter()
+    shedder = get_shedder()
+
+    def middleware(request):
+        if not settings.RATE_LIMIT_ENABLED:
+            return get_response(request)
+
+        start = time.time()
+        client = f'user:{request.user.pk}' if request.user.is_authenticated else f'ip:{client_ip(request)}'
+        scope = auth_scopes.get(request.path)
+        if scope is not None:
+            checks = _auth_checks(scope, client_ip(request), _login_account(request) if scope == 'login' else None)
+        elif request.path.endswith(GRAPHQL_PATH_SUFFIX):
+            checks = [('graphql_mutation' if _is_graphql_mutation(request) else 'graphql_query', client)]
+            # Every login or register in the request is charged, however many it batches.
+            for name, arguments in _graphql_mutation_fields(request) or ():
+                scope = GRAPHQL_AUTH_SCOPES.get(name)
+                if scope is not None:
+                    checks += _auth_checks(scope, client_ip(request), _account_key(arguments.get('credentials')))
+        else:
+            checks = [('api', client)]
+
+        decisions = [limiter.check(scope, key) for scope, key in checks]
+        denied = [decision.retry_after for decision in decisions if not decision.allowed]
+        if denied:
+            return _retry_response('Rate limit exceeded', 429, max(denied))
+        if shedder.should_shed(min(decision.level for decision in decisions)):
+            return _retry_response('Server is busy; try again shortly', 503, 1)
+
+        shedder.started()
+        try:
+            return get_response(request)
+        finally:
+            shedder.finished(queue_time(request, start) + time.time() - start)
+
+    return middleware
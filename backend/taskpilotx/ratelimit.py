@@ -0,0 +1,173 @@
+"""
+Rate limiting and load shedding.
+
+Every request is charged to a token bucket per scope (the kind of operation,
+see ``RateLimitMiddleware``) and client: the user for authenticated requests, the IP
+address otherwise. Login attempts are also charged to the account they name, so
+credential stuffing from many addresses is limited per account too. Rates are
+``RATE_LIMITS`` entries such as ``'120/min'``; a bucket holds up to that many
+tokens and refills evenly over the period, so short bursts pass.
+
+Buckets live in process memory, or in the Django cache with
+``RATE_LIMIT_BACKEND = 'cache'`` so all workers share them (through Redis when
+``REDIS_URL`` is set). The shared buckets are read and written without a lock;
+concurrent requests of one client can overshoot by a few tokens.
+
+``LoadShedder`` tracks requests in flight and an average of their latency
+(including time spent queued in front of the worker when the proxy sends
+``X-Request-Start``). Once either passes its limit, requests of the clients who
+have used most of their budget are turned away first, so well-behaved clients
+keep their latency while the process is overloaded.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+Rate = namedtuple('Rate', 'capacity per_second')
+# level: share of the bucket that was left before this request
+Decision = namedtuple('Decision', 'allowed retry_after level')
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def parse_rate(text):
+    """``'120/min'`` -> ``Rate(capacity=120, per_second=2.0)``."""
+    count, _, period = text.partition('/')
+    count = int(count)
+    seconds = PERIODS[period.strip()]
+    return Rate(capacity=count, per_second=count / seconds)
+
+
+def _take(tokens, stamp, rate, now):
+    """Refill a bucket to ``now`` and take one token; returns ``(tokens, Decision)``."""
+    tokens = min(rate.capacity, tokens + (now - stamp) * rate.per_second)
+    level = tokens / rate.capacity
+    if tokens >= 1:
+        return tokens - 1, Decision(True, 0.0, level)
+    return tokens, Decision(False, (1 - tokens) / rate.per_second, level)
+
+
+class MemoryBuckets:
+    """Buckets of this process, the least recently used dropped beyond ``max_keys``."""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> (tokens, monotonic time of the last update)
+        self.lock = threading.Lock()
+
+    def take(self, key, rate):
+        now = time.monotonic()
+        with self.lock:
+            tokens, stamp = self.buckets.pop(key, (rate.capacity, now))
+            tokens, decision = _take(tokens, stamp, rate, now)
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return decision
+
+
+class CacheBuckets:
+    """Buckets in the Django cache, shared by every process using it."""
+
+    def take(self, key, rate):
+        now = time.time()
+        cache_key = f'ratelimit:{key}'
+        tokens, stamp = cache.get(cache_key) or (rate.capacity, now)
+        tokens, decision = _take(tokens, stamp, rate, now)
+        # A bucket left alone long enough is full again and need not be kept.
+        cache.set(cache_key, (tokens, now), math.ceil(rate.capacity / rate.per_second))
+        return decision
+
+
+class RateLimiter:
+    def __init__(self, rates=None, buckets=None):
+        rates = settings.RATE_LIMITS if rates is None else rates
+        self.rates = {scope: parse_rate(rate) for scope, rate in rates.items() if rate}
+        if buckets is None:
+            buckets = CacheBuckets() if settings.RATE_LIMIT_BACKEND == 'cache' else MemoryBuckets()
+        self.buckets = buckets
+
+    def check(self, scope, client):
+        """Charge one request of ``client`` to ``scope``; scopes without a rate are not limited."""
+        rate = self.rates.get(scope)
+        if rate is None:
+            return Decision(True, 0.0, 1.0)
+        return self.buckets.take(f'{scope}:{client}', rate)
+
+
+class LoadShedder:
+    def __init__(self, max_in_flight=None, target_latency=None, smoothing=0.1):
+        self.max_in_flight = max_in_flight or settings.RATE_LIMIT_MAX_IN_FLIGHT
+        self.target_latency = (target_latency or settings.RATE_LIMIT_TARGET_LATENCY_MS) / 1000
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.latency = 0.0  # exponentially weighted average, seconds
+        self.lock = threading.Lock()
+
+    def load(self):
+        """How far over its limits the process is; above 1.0 means overloaded."""
+        return max(self.in_flight / self.max_in_flight, self.latency / self.target_latency)
+
+    def should_shed(self, level):
+        """Whether to turn away a request whose client has ``level`` of its budget left."""
+        load = self.load()
+        # The more overloaded, the fuller a client's bucket must be to get in;
+        # clients that have used no more than a tenth of it always are.
+        return load > 1.0 and level < min(0.9, settings.RATE_LIMIT_SHED_LEVEL * load)
+
+    def started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finished(self, latency):
+        with self.lock:
+            self.in_flight -= 1
+            # Capped, so one slow upload or export does not read as overload.
+            latency = min(latency, 2 * self.target_latency)
+            self.latency += self.smoothing * (latency - self.latency)
+
+
+def queue_time(request, now):
+    """Seconds the request waited before reaching Django, from the proxy's ``X-Request-Start``."""
+    header = request.META.get('HTTP_X_REQUEST_START', '')
+    try:
+        start = float(header.removeprefix('t='))
+    except ValueError:
+        return 0.0
+    # nginx sends seconds, Heroku and others milliseconds or microseconds.
+    while start > now * 100:
+        start /= 1000
+    return min(max(now - start, 0.0), 60.0)
+
+
+def client_ip(request):
+    if settings.RATE_LIMIT_TRUST_X_FORWARDED_FOR:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            # The last entry is the one the proxy added; earlier ones come from the client.
+            return forwarded.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+_limiter = None
+_shedder = None
+
+
+def get_limiter():
+    """Process-wide limiter with the rates of ``RATE_LIMITS``."""
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter()
+    return _limiter
+
+
+def get_shedder():
+    global _shedder
+    if _shedder is None:
+        _shedder = LoadShedder()
+    return _shedder
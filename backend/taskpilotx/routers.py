@@ -0,0 +1,76 @@
+"""
+Primary/replica database routing.
+
+Reads go to a random replica unless the current request is pinned to the
+primary. A request is pinned when it is a GraphQL mutation or other unsafe
+request, when its user wrote recently (read-your-writes stickiness, see
+``DatabaseRoutingMiddleware``), or as soon as it performs a write itself.
+Code running outside a request (workers, management commands) reads from
+replicas only inside ``replica_reads()``.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+class RoutingState:
+    """Mutable per-request state, shared with threads the request hands work to."""
+
+    __slots__ = ('use_replicas', 'wrote')
+
+    def __init__(self, use_replicas=True):
+        self.use_replicas = use_replicas
+        self.wrote = False
+
+
+_state = ContextVar('db_routing_state', default=None)
+
+
+@contextmanager
+def routing(use_replicas=True):
+    """Route the enclosed block with a fresh ``RoutingState``, which is yielded."""
+    state = RoutingState(use_replicas=use_replicas)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+def replica_reads():
+    return routing(use_replicas=True)
+
+
+def pin_primary():
+    state = _state.get()
+    if state is not None:
+        state.use_replicas = False
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replicas or not settings.DATABASE_REPLICAS:
+            return 'default'
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+            state.use_replicas = False
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
@@ -0,0 +1,141 @@
+"""
+Production serving under gunicorn; the hooks of ``taskpilotx/gunicorn_conf.py``.
+
+There are two worker types, and a deployment under load runs a pool of each
+with the proxy splitting traffic between them:
+
+- ``sync``: gthread workers running ``taskpilotx.wsgi``. Views, the ORM and
+  GraphQL resolvers are synchronous, so the API and GraphQL are served here,
+  a thread per request.
+- ``async``: uvicorn workers running ``taskpilotx.asgi``. They read request
+  bodies and write streamed responses without holding a thread while a slow
+  client sends or receives, so uploads (``/api/uploads/``), exports
+  (``/api/export/``) and attachments (``/api/messages/attachments/``) are served
+  here; the latter two hand their chunks to the server one at a time
+  (``taskpilotx.streaming``) instead of Django buffering them. Django runs
+  each request's sync code in a thread of its own (``ThreadSensitiveContext``),
+  so database connections are opened per request and not kept between
+  requests, which makes this pool a poor fit for everything else.
+
+With ``preload_app`` the master imports the project, routes every URL and builds
+the GraphQL schema and the token blacklist filter once (``preload()``), then
+forks. Workers share those pages copy-on-write; ``gc.freeze()`` keeps the
+collector from writing to (and so copying) them. Before it accepts requests,
+a sync worker opens its database connections on the threads of its request
+pool, which keep them (``warm_worker()``); an async worker has no thread that
+outlives a request, so it only loads what ``preload()`` does.
+
+Workers are recycled after ``max_requests`` requests (with jitter, so they do
+not all restart together) or, checked by ``watch_memory()``, once the memory
+they do not share with the master (USS) passes a limit. Either way the worker
+finishes the requests it has and the master starts a fresh one.
+"""
+import gc
+import logging
+import os
+import signal
+import threading
+import time
+
+import psutil
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connections
+
+
+logger = logging.getLogger(__name__)
+
+WORKER_CLASSES = {
+    'sync': 'gthread',
+    'async': 'uvicorn.workers.UvicornWorker',
+}
+APPLICATIONS = {
+    'sync': 'taskpilotx.wsgi:application',
+    'async': 'taskpilotx.asgi:application',
+}
+
+
+def _load():
+    from django.urls import get_resolver
+    from users.blacklist import get_blacklist
+    from .views import load_schema
+
+    get_resolver().url_patterns
+    load_schema()
+    try:
+        get_blacklist().warm()
+    except DatabaseError:
+        logger.warning('Could not load the token blacklist', exc_info=True)
+
+
+def preload():
+    """Load what every worker uses, in the master before it forks them."""
+    try:
+        _load()
+    finally:
+        # Sockets must not be shared with the workers.
+        connections.close_all()
+        caches.close_all()
+    # Everything loaded so far lives as long as the workers do.
+    gc.collect()
+    gc.freeze()
+
+
+def _open_connections():
+    for alias in settings.DATABASES:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            logger.warning('Could not connect to database %s', alias, exc_info=True)
+    caches['default'].get('serving:warm')
+
+
+def _on_request_threads(worker, func):
+    """Call ``func`` once on every thread of the gthread worker's request pool."""
+    threads = worker.cfg.threads
+    # Each call waits for the others, so no thread can take two of them.
+    barrier = threading.Barrier(threads)
+
+    def call():
+        try:
+            func()
+        finally:
+            barrier.wait(timeout=30)
+
+    for future in [worker.tpool.submit(call) for _ in range(threads)]:
+        future.result()
+
+
+def warm_worker(worker, worker_type):
+    """Load what a new worker needs, and open the connections a sync worker keeps, before it takes requests."""
+    start = time.perf_counter()
+    _load()
+    # Connections belong to a thread. Async workers run each request's sync code
+    # on a new thread, so there is nothing for them to open in advance.
+    if worker_type == 'sync':
+        if getattr(worker, 'tpool', None) is not None:
+            _on_request_threads(worker, _open_connections)
+        else:
+            _open_connections()
+    logger.info('Worker %s warmed in %.0f ms', os.getpid(), (time.perf_counter() - start) * 1000)
+
+
+def watch_memory(limit_mb, interval):
+    """Gracefully stop this worker once its USS passes ``limit_mb``; the master replaces it.
+
+    RSS would count the pages shared with the master too, which recycling
+    does not give back.
+    """
+    process = psutil.Process()
+
+    def watch():
+        while True:
+            time.sleep(interval)
+            uss = process.memory_full_info().uss
+            if uss > limit_mb * 2**20:
+                logger.warning('Worker %s at %d MB USS, over %d MB; recycling it', process.pid, uss >> 20, limit_mb)
+                # What gunicorn sends for a graceful stop of a worker.
+                os.kill(process.pid, signal.SIGTERM)
+                return
+
+    threading.Thread(target=watch, name='memory-limit', daemon=True).start()
@@ -10,9 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
-from decouple import config
+from decouple import Csv, config
 from pathlib import Path
 
+from .db import database, replicas, shards
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -47,11 +49,15 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework_simplejwt',
     'graphene_django',
+    'taskpilotx',
     'users',
     'tasks',
     'messages_app',
     'accounts',
     'actions',
+    'ai',
+    'notifications',
+    'events',
 ]
 
 MIDDLEWARE = [
@@ -64,6 +70,9 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'taskpilotx.middleware.JWTAuthenticationMiddleware',
+    'taskpilotx.middleware.RateLimitMiddleware',
+    'taskpilotx.middleware.ShardRoutingMiddleware',
+    'taskpilotx.middleware.DatabaseRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'taskpilotx.urls'
@@ -89,16 +98,41 @@ WSGI_APPLICATION = 'taskpilotx.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Connection behaviour (persistent connections, psycopg pool, transaction-mode
+# pooler) is configured through DB_* environment variables, see taskpilotx/db.py.
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'postgres',  # database name from the URL
-        'USER': 'postgres.podnmrbyibkjkcvwjrzo',  # username from the URL
-        'PASSWORD': config('DB_PASSWORD'),  # password from the URL
-        'HOST': 'aws-1-us-east-2.pooler.supabase.com',  # host from the URL
-        'PORT': '5432',  # port from the URL
-    }
+    'default': database(
+        'DB',
+        name='postgres',
+        user='postgres.podnmrbyibkjkcvwjrzo',
+        host='aws-1-us-east-2.pooler.supabase.com',
+        port='5432',
+    ),
 }
+DATABASES.update(replicas(DATABASES['default']))
+DATABASES.update(shards())
+
+# User data is kept on the shard of its owner (see taskpilotx/sharding.py);
+# 'default' is a shard too and holds users, auth and the shard map.
+# GraphQL queries read from replicas; mutations, writes and a short window after
+# a user's last write use the primary (see taskpilotx/routers.py).
+DATABASE_ROUTERS = ['taskpilotx.sharding.ShardRouter', 'taskpilotx.routers.PrimaryReplicaRouter']
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica_')]
+DATABASE_SHARDS = ['default', *config('DB_SHARDS', default='', cast=Csv())]
+# Shards new users are placed on (all shards when empty)
+NEW_USER_SHARDS = config('NEW_USER_SHARDS', default='', cast=Csv())
+SHARD_MAP_CACHE_SECONDS = config('SHARD_MAP_CACHE_SECONDS', default=300, cast=int)
+READ_YOUR_WRITES_SECONDS = config('READ_YOUR_WRITES_SECONDS', default=5, cast=int)
+
+# Cache shared between workers when REDIS_URL is set (needs the redis package), per-process otherwise.
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
 
 # CORS Configuration
 CORS_ALLOWED_ORIGINS = [
@@ -149,7 +183,7 @@ from datetime import timedelta
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.TokenUserAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -180,8 +214,21 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_EXP_CLAIM': 'refresh_exp',
     'SLIDING_TOKEN_LIFETIME': timedelta(minutes=5),
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
+    'TOKEN_REFRESH_SERIALIZER': 'users.tokens.TokenRefreshSerializer',
 }
 
+# Authenticate requests from the token's claims without loading the user (users/tokens.py)
+TOKEN_CLAIMS_USER = config('TOKEN_CLAIMS_USER', default=True, cast=bool)
+TOKEN_VERSION_CACHE_SECONDS = config('TOKEN_VERSION_CACHE_SECONDS', default=300, cast=int)
+
+# Blacklist of rotated refresh tokens (users/blacklist.py)
+# Revoked tokens expected within one refresh lifetime; sizes the Bloom filter.
+TOKEN_BLACKLIST_CAPACITY = config('TOKEN_BLACKLIST_CAPACITY', default=1_000_000, cast=int)
+TOKEN_BLACKLIST_FALSE_POSITIVE_RATE = config('TOKEN_BLACKLIST_FALSE_POSITIVE_RATE', default=0.01, cast=float)
+TOKEN_BLACKLIST_SYNC_SECONDS = config('TOKEN_BLACKLIST_SYNC_SECONDS', default=5, cast=int)
+TOKEN_BLACKLIST_REBUILD_SECONDS = config('TOKEN_BLACKLIST_REBUILD_SECONDS', default=3600, cast=int)
+TOKEN_BLACKLIST_PURGE_SECONDS = config('TOKEN_BLACKLIST_PURGE_SECONDS', default=600, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -200,6 +247,23 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing (users/hashers.py, users/auth.py)
+# Existing PBKDF2 and scrypt hashes are upgraded to Argon2 at the next login.
+PASSWORD_HASHERS = [
+    'users.hashers.TunedArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_ARGON2_TIME_COST = config('PASSWORD_ARGON2_TIME_COST', default=2, cast=int)
+PASSWORD_ARGON2_MEMORY_KIB = config('PASSWORD_ARGON2_MEMORY_KIB', default=102400, cast=int)
+PASSWORD_ARGON2_PARALLELISM = config('PASSWORD_ARGON2_PARALLELISM', default=8, cast=int)
+# Hashes run in a pool of this many threads per process; a login that cannot get
+# a place in the pool (threads + queue) within the timeout fails fast.
+PASSWORD_HASHING_THREADS = config('PASSWORD_HASHING_THREADS', default=4, cast=int)
+PASSWORD_HASHING_QUEUE = config('PASSWORD_HASHING_QUEUE', default=32, cast=int)
+PASSWORD_HASHING_TIMEOUT = config('PASSWORD_HASHING_TIMEOUT', default=5.0, cast=float)
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -225,3 +289,106 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Custom User Model
 AUTH_USER_MODEL = 'users.User'
+
+# Semantic task matching
+# Dotted path of the embedder class; the hashing embedder is a deterministic local fake.
+AI_EMBEDDER = config('AI_EMBEDDER', default='ai.embeddings.HashingEmbedder')
+EMBEDDING_STORE_DIR = config('EMBEDDING_STORE_DIR', default=str(BASE_DIR / 'var' / 'embeddings'))
+EMBEDDING_BATCH_SIZE = config('EMBEDDING_BATCH_SIZE', default=64, cast=int)
+AI_SHORTLIST_SIZE = config('AI_SHORTLIST_SIZE', default=3, cast=int)
+AI_SHORTLIST_MIN_SCORE = config('AI_SHORTLIST_MIN_SCORE', default=0.05, cast=float)
+
+# AI gateway
+# Every LLM call goes through ai.gateway; the fake backend is deterministic and offline.
+AI_BACKEND = config('AI_BACKEND', default='ai.gateway.FakeBackend')
+AI_MODEL = config('AI_MODEL', default='gpt-4o-mini')
+AI_MAX_BATCH_SIZE = config('AI_MAX_BATCH_SIZE', default=16, cast=int)
+AI_MAX_BATCH_WAIT = config('AI_MAX_BATCH_WAIT', default=0.02, cast=float)  # seconds
+AI_MAX_CONCURRENCY = config('AI_MAX_CONCURRENCY', default=8, cast=int)
+AI_GLOBAL_RPM = config('AI_GLOBAL_RPM', default=500, cast=int)
+AI_GLOBAL_TPM = config('AI_GLOBAL_TPM', default=200000, cast=int)
+AI_USER_RPM = config('AI_USER_RPM', default=60, cast=int)
+AI_USER_TPM = config('AI_USER_TPM', default=20000, cast=int)
+AI_REQUEST_TIMEOUT = config('AI_REQUEST_TIMEOUT', default=30.0, cast=float)
+AI_MAX_RETRIES = config('AI_MAX_RETRIES', default=3, cast=int)
+AI_QUEUE_TIMEOUT = config('AI_QUEUE_TIMEOUT', default=120.0, cast=float)  # waiting for budget and a slot
+
+
+# Task execution engine (manage.py run_task_worker)
+TASK_WORKER_PREFETCH = config('TASK_WORKER_PREFETCH', default=32, cast=int)
+TASK_WORKER_CONCURRENCY = config('TASK_WORKER_CONCURRENCY', default=4, cast=int)
+TASK_EXECUTION_LEASE_SECONDS = config('TASK_EXECUTION_LEASE_SECONDS', default=600, cast=int)
+
+# Task rules (tasks/rules.py): characters of a body they see, seconds one regex may run per message
+TASK_RULES_TEXT_CHARS = config('TASK_RULES_TEXT_CHARS', default=8192, cast=int)
+TASK_RULES_REGEX_TIMEOUT = config('TASK_RULES_REGEX_TIMEOUT', default=0.05, cast=float)
+
+# Task chaining (TRIGGER_TASK): limits on how far and how wide one execution can spread
+TASK_CHAIN_MAX_DEPTH = config('TASK_CHAIN_MAX_DEPTH', default=8, cast=int)
+TASK_CHAIN_MAX_FANOUT = config('TASK_CHAIN_MAX_FANOUT', default=16, cast=int)
+
+# Bulk message operations: ids per UPDATE/DELETE statement and transaction
+MESSAGE_BULK_CHUNK_SIZE = config('MESSAGE_BULK_CHUNK_SIZE', default=1000, cast=int)
+
+# Outbound email (used by the delivery worker)
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=10, cast=int)
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='TaskPilotX <noreply@localhost>')
+
+# Delivery queue (manage.py run_delivery_worker)
+# Notifications go to this webhook when set, by email to the user otherwise.
+NOTIFICATION_WEBHOOK_URL = config('NOTIFICATION_WEBHOOK_URL', default='')
+NOTIFICATION_COALESCE_SECONDS = config('NOTIFICATION_COALESCE_SECONDS', default=60, cast=int)
+DELIVERY_BATCH_SIZE = config('DELIVERY_BATCH_SIZE', default=100, cast=int)
+DELIVERY_MAX_ATTEMPTS = config('DELIVERY_MAX_ATTEMPTS', default=8, cast=int)
+DELIVERY_RETRY_BASE_SECONDS = config('DELIVERY_RETRY_BASE_SECONDS', default=30, cast=int)
+DELIVERY_RETRY_MAX_SECONDS = config('DELIVERY_RETRY_MAX_SECONDS', default=3600, cast=int)
+DELIVERY_LEASE_SECONDS = config('DELIVERY_LEASE_SECONDS', default=300, cast=int)
+
+# Content-addressed blobs (uploads) and UPLOAD_CONTENT destinations
+BLOB_STORE_DIR = config('BLOB_STORE_DIR', default=str(BASE_DIR / 'var' / 'blobs'))
+UPLOAD_MAX_BYTES = config('UPLOAD_MAX_BYTES', default=100 * 1024 * 1024, cast=int)
+# Largest inline "content" an UPLOAD_CONTENT config may carry; bigger content goes through /api/uploads/
+UPLOAD_INLINE_MAX_BYTES = config('UPLOAD_INLINE_MAX_BYTES', default=1024 * 1024, cast=int)
+UPLOAD_LOCAL_ROOT = config('UPLOAD_LOCAL_ROOT', default=str(BASE_DIR / 'var' / 'uploads'))
+UPLOAD_DESTINATIONS = {
+    'local': 'actions.uploads.LocalDestination',
+}
+# collect_blobs keeps unreferenced blobs stored more recently than this
+BLOB_GC_GRACE_SECONDS = config('BLOB_GC_GRACE_SECONDS', default=24 * 3600, cast=int)
+
+# Message bodies longer than this move to the blob store; the row keeps a preview
+MESSAGE_INLINE_CONTENT_CHARS = config('MESSAGE_INLINE_CONTENT_CHARS', default=8192, cast=int)
+MESSAGE_PREVIEW_CHARS = config('MESSAGE_PREVIEW_CHARS', default=2000, cast=int)
+
+
+# Change feed (events app): outbox events read incrementally by consumers
+CHANGE_FEED_BATCH_SIZE = config('CHANGE_FEED_BATCH_SIZE', default=1000, cast=int)
+CHANGE_FEED_POLL_SECONDS = config('CHANGE_FEED_POLL_SECONDS', default=1.0, cast=float)
+CHANGE_EVENT_RETENTION_DAYS = config('CHANGE_EVENT_RETENTION_DAYS', default=7, cast=int)
+
+# Rate limiting and load shedding (taskpilotx/ratelimit.py)
+# Buckets are per process with 'memory', shared through the cache with 'cache'.
+RATE_LIMIT_ENABLED = config('RATE_LIMIT_ENABLED', default=True, cast=bool)
+RATE_LIMIT_BACKEND = config('RATE_LIMIT_BACKEND', default='cache' if REDIS_URL else 'memory')
+RATE_LIMITS = {
+    'login': config('RATE_LIMIT_LOGIN', default='10/min'),
+    'login_account': config('RATE_LIMIT_LOGIN_ACCOUNT', default='5/min'),
+    'register': config('RATE_LIMIT_REGISTER', default='10/hour'),
+    'token_refresh': config('RATE_LIMIT_TOKEN_REFRESH', default='30/min'),
+    'graphql_query': config('RATE_LIMIT_GRAPHQL_QUERY', default='300/min'),
+    'graphql_mutation': config('RATE_LIMIT_GRAPHQL_MUTATION', default='120/min'),
+    'api': config('RATE_LIMIT_API', default='300/min'),
+}
+# Only behind a proxy that sets X-Forwarded-For; clients could forge it otherwise.
+RATE_LIMIT_TRUST_X_FORWARDED_FOR = config('RATE_LIMIT_TRUST_X_FORWARDED_FOR', default=False, cast=bool)
+# Overloaded above this many concurrent requests per process or this average latency
+RATE_LIMIT_MAX_IN_FLIGHT = config('RATE_LIMIT_MAX_IN_FLIGHT', default=32, cast=int)
+RATE_LIMIT_TARGET_LATENCY_MS = config('RATE_LIMIT_TARGET_LATENCY_MS', default=500, cast=int)
+# While overloaded, clients with less than this share of their budget left are turned away
+RATE_LIMIT_SHED_LEVEL = config('RATE_LIMIT_SHED_LEVEL', default=0.5, cast=float)
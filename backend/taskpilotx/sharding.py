@@ -0,0 +1,436 @@
+"""
+Sharding of user data by owner.
+
+Every tenant row (tasks, messages, linked accounts, executions, deliveries and
+their change events) lives on the shard of its owner; ``ShardAssignment`` maps
+a user id to a database alias in ``DATABASE_SHARDS``. Users without an
+assignment live on ``default``, which is also where users, auth, the shard map
+and the action catalog are kept. Each shard holds a copy of its users' rows and
+of the action catalog, so its foreign keys resolve locally.
+
+Requests are bound to the shard of their user by ``ShardRoutingMiddleware``;
+workers are bound to one shard per process with ``pin_process_shard()`` (the
+``--shard`` option of the worker commands). ``ShardRouter`` then sends tenant
+models to that shard and leaves everything else to ``PrimaryReplicaRouter``.
+
+Ids are unique across shards: ``prepare_shard()`` starts the id sequences of
+shard ``n`` (its position in ``DATABASE_SHARDS``) at ``n << SHARD_ID_BITS``, so
+``move_user()`` can copy rows between shards with their ids. Change events are
+the exception: their id is the position in the shard's feed, so a moved user's
+history is appended to the target's feed with new ids.
+
+The shard map is cached for ``SHARD_MAP_CACHE_SECONDS``. With a per-process
+cache (no ``REDIS_URL``) other processes only see a changed assignment when
+their entry expires, so ``move_user()`` waits that long after locking the user
+and again after switching the shard.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Count
+
+
+SHARD_ID_BITS = 40
+
+SHARDED_APPS = {'tasks', 'messages_app', 'accounts', 'notifications', 'events'}
+SHARDED_MODELS = {'actions.actionexecution'}
+# Copied to every shard; read from the shard when reached from a tenant row.
+REPLICATED_MODELS = {'actions.action', settings.AUTH_USER_MODEL.lower()}
+
+# Tenant rows of one user, in copy order: (model label, lookup of the owner id).
+OWNED_ROWS = [
+    ('accounts.linkedaccount', 'owner_id'),
+    ('tasks.task', 'owner_id'),
+    ('tasks.task_linked_accounts', 'task__owner_id'),
+    ('tasks.task_actions', 'task__owner_id'),
+    ('messages_app.message', 'owner_id'),
+    ('messages_app.messageattachment', 'message__owner_id'),
+    ('messages_app.messagethread', 'owner_id'),
+    ('messages_app.messagethread_messages', 'messagethread__owner_id'),
+    ('tasks.taskexecution', 'task__owner_id'),
+    ('actions.actionexecution', 'executed_by_id'),
+    ('messages_app.message_triggered_actions', 'message__owner_id'),
+    ('notifications.delivery', 'owner_id'),
+]
+
+_shard = ContextVar('db_shard', default=None)
+_process_shard = None
+
+
+def sharding_enabled():
+    return len(settings.DATABASE_SHARDS) > 1
+
+
+def is_sharded(model):
+    return model._meta.app_label in SHARDED_APPS or model._meta.label_lower in SHARDED_MODELS
+
+
+def current_shard():
+    """Alias of the shard the current request or process is bound to, if any."""
+    return _shard.get() or _process_shard
+
+
+def shard_db():
+    """Database alias for tenant queries and transactions in the current context."""
+    return current_shard() or 'default'
+
+
+@contextmanager
+def use_shard(alias):
+    token = _shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _shard.reset(token)
+
+
+def pin_process_shard(alias):
+    """Bind the whole process (and its worker threads) to one shard."""
+    global _process_shard
+    if alias not in settings.DATABASE_SHARDS:
+        raise ValueError(f'Unknown shard: {alias!r}')
+    _process_shard = alias
+
+
+class ShardRouter:
+    def _tenant_db(self, model, hints):
+        instance = hints.get('instance')
+        if instance is not None and is_sharded(type(instance)) and instance._state.db in settings.DATABASE_SHARDS:
+            return instance._state.db
+        # A user (e.g. ``user.tasks``) does not tell where its rows are.
+        return current_shard()
+
+    def _route(self, model, hints):
+        if not sharding_enabled():
+            return None
+        if is_sharded(model):
+            alias = self._tenant_db(model, hints)
+        elif model._meta.label_lower in REPLICATED_MODELS:
+            # e.g. task.actions or execution.executed_by: use the tenant row's shard copy.
+            instance = hints.get('instance')
+            alias = instance._state.db if instance is not None and is_sharded(type(instance)) else None
+        else:
+            alias = None
+        # The default shard is left to the replica router.
+        return alias if alias != 'default' else None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not sharding_enabled():
+            return None
+        sharded1, sharded2 = is_sharded(type(obj1)), is_sharded(type(obj2))
+        if sharded1 and sharded2:
+            return obj1._state.db == obj2._state.db
+        if sharded1 or sharded2:
+            # Users and the catalog exist on every shard.
+            return True
+        return None
+
+
+# Shard map
+
+def _cache_key(user_id):
+    return f'shard:{user_id}'
+
+
+def shard_assignment(user_id):
+    """Return ``(alias, locked)`` for ``user_id``."""
+    if not sharding_enabled() or user_id is None:
+        return 'default', False
+    cached = cache.get(_cache_key(user_id))
+    if cached is None:
+        from users.models import ShardAssignment
+
+        row = ShardAssignment.objects.using('default').filter(user_id=user_id).values_list('alias', 'locked').first()
+        cached = tuple(row) if row else ('default', False)
+        cache.set(_cache_key(user_id), cached, settings.SHARD_MAP_CACHE_SECONDS)
+    return tuple(cached)
+
+
+def shard_for(user_id):
+    return shard_assignment(user_id)[0]
+
+
+def _set_assignment(user_id, **fields):
+    from users.models import ShardAssignment
+
+    ShardAssignment.objects.using('default').update_or_create(user_id=user_id, defaults=fields)
+    cache.delete(_cache_key(user_id))
+
+
+def _wait_for_shard_map(user_id, log):
+    """Wait until every process sees the current assignment of ``user_id``."""
+    backend = settings.CACHES['default']['BACKEND']
+    if backend.endswith('LocMemCache') and settings.SHARD_MAP_CACHE_SECONDS > 0:
+        log(f'Waiting {settings.SHARD_MAP_CACHE_SECONDS}s for cached shard maps of other processes to expire')
+        time.sleep(settings.SHARD_MAP_CACHE_SECONDS)
+    # A reader that loaded the row before it changed may have cached it after our delete.
+    cache.delete(_cache_key(user_id))
+
+
+def locked_owner_ids():
+    """Users being moved; workers leave their rows alone meanwhile."""
+    if not sharding_enabled():
+        return []
+    from users.models import ShardAssignment
+
+    return list(ShardAssignment.objects.using('default').filter(locked=True).values_list('user_id', flat=True))
+
+
+def exclude_locked(queryset, owner_lookup='owner_id'):
+    locked = locked_owner_ids()
+    return queryset.exclude(**{f'{owner_lookup}__in': locked}) if locked else queryset
+
+
+def place_user(user):
+    """Assign a new user to the shard with the fewest users among ``NEW_USER_SHARDS``."""
+    from users.models import ShardAssignment
+
+    candidates = settings.NEW_USER_SHARDS or settings.DATABASE_SHARDS
+    counts = dict(
+        ShardAssignment.objects.using('default').filter(alias__in=candidates)
+        .values_list('alias').annotate(users=Count('user_id'))
+    )
+    alias = min(candidates, key=lambda candidate: (counts.get(candidate, 0), candidate))
+    if alias != 'default':
+        prepare_shard(alias)
+        copy_user(user.pk, alias)
+    _set_assignment(user.pk, alias=alias, locked=False)
+    return alias
+
+
+# Shard setup
+
+def _save_copy(instance, alias):
+    db = instance._state.db
+    try:
+        instance.save(using=alias)
+    finally:
+        instance._state.db = db
+
+
+def copy_user(user_id, alias):
+    """Create or refresh the copy of a user row on ``alias``."""
+    from django.contrib.auth import get_user_model
+
+    _save_copy(get_user_model().objects.using('default').get(pk=user_id), alias)
+
+
+def sync_catalog(alias):
+    """Copy the action catalog from ``default`` to ``alias``, keeping ids."""
+    from actions.models import Action
+
+    actions = list(Action.objects.using('default').all())
+    fields = [field.attname for field in Action._meta.concrete_fields if not field.primary_key]
+    Action.objects.using(alias).bulk_create(
+        actions, update_conflicts=True, unique_fields=['id'], update_fields=fields,
+    )
+
+
+def sharded_tables():
+    """Tables of sharded models with a generated id."""
+    return [
+        model._meta.db_table for model in apps.get_models(include_auto_created=True)
+        if is_sharded(model) and model._meta.pk.get_internal_type().endswith('AutoField')
+    ]
+
+
+def reset_sequences(alias):
+    """Continue the id sequences of ``alias`` within its own id range.
+
+    Rows moved in from other shards keep their ids, which lie outside the range.
+    """
+    start = settings.DATABASE_SHARDS.index(alias) << SHARD_ID_BITS
+    end = start + (1 << SHARD_ID_BITS)
+    connection = connections[alias]
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        for table in sharded_tables():
+            quoted = connection.ops.quote_name(table)
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(%s, max(id), 1), "
+                    f"GREATEST(%s, max(id), 0) > 0) FROM {quoted} WHERE id >= %s AND id < %s",
+                    [table, start, start, start, end],
+                )
+            elif connection.vendor == 'sqlite':
+                cursor.execute(f'SELECT max(id) FROM {quoted} WHERE id >= %s AND id < %s', [start, end])
+                last = max(cursor.fetchone()[0] or 0, start)
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [last, table])
+                if not cursor.rowcount and last:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, last])
+
+
+def prepare_shard(alias):
+    """Give ``alias`` its id range and a current action catalog; idempotent."""
+    reset_sequences(alias)
+    if alias != 'default':
+        sync_catalog(alias)
+
+
+def _user_saved(sender, instance, created, using, raw=False, **kwargs):
+    if using != 'default' or raw or not sharding_enabled():
+        return
+    if created:
+        place_user(instance)
+    elif shard_for(instance.pk) != 'default':
+        _save_copy(instance, shard_for(instance.pk))
+
+
+def _user_deleted(sender, instance, using, **kwargs):
+    if using == 'default' and sharding_enabled():
+        for alias in settings.DATABASE_SHARDS[1:]:
+            sender._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+def _action_saved(sender, instance, using, raw=False, **kwargs):
+    if using == 'default' and not raw:
+        for alias in settings.DATABASE_SHARDS[1:]:
+            _save_copy(instance, alias)
+
+
+def _action_deleted(sender, instance, using, **kwargs):
+    if using == 'default':
+        for alias in settings.DATABASE_SHARDS[1:]:
+            sender._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+def connect_receivers():
+    """Place new users on a shard and keep the copies of users and actions current."""
+    from django.contrib.auth import get_user_model
+    from django.db.models.signals import post_delete, post_save
+
+    from actions.models import Action
+
+    User = get_user_model()
+    post_save.connect(_user_saved, sender=User, dispatch_uid='sharding-user-saved')
+    post_delete.connect(_user_deleted, sender=User, dispatch_uid='sharding-user-deleted')
+    post_save.connect(_action_saved, sender=Action, dispatch_uid='sharding-action-saved')
+    post_delete.connect(_action_deleted, sender=Action, dispatch_uid='sharding-action-deleted')
+
+
+# Rebalancing
+
+class ShardMoveError(Exception):
+    pass
+
+
+def _owned(label, lookup, user_id, alias):
+    model = apps.get_model(label)
+    return model, model._base_manager.using(alias).filter(**{lookup: user_id}).order_by('pk')
+
+
+def _in_flight(user_id, alias):
+    from messages_app.models import Message
+    from notifications.models import Delivery
+    from tasks.models import TaskExecution
+
+    return (
+        Message.objects.using(alias).filter(owner_id=user_id, status='processing').exists()
+        or TaskExecution.objects.using(alias).filter(task__owner_id=user_id, status='running').exists()
+        or Delivery.objects.using(alias).filter(owner_id=user_id, status='sending').exists()
+    )
+
+
+def _copy_change_events(user_id, source, target, batch_size):
+    """Append the change events of ``user_id`` on ``source`` to the feed of ``target``.
+
+    Returns the copied events, as a queryset on ``source``, and their count.
+    """
+    from events.models import ChangeEvent
+
+    events = ChangeEvent.objects.using(source).filter(owner_id=user_id)
+    last = events.order_by('-pk').values_list('pk', flat=True).first() or 0
+    history = events.filter(pk__lte=last)
+    copied, batch = 0, []
+    for event in history.order_by('pk').iterator(chunk_size=batch_size):
+        event.pk = None
+        batch.append(event)
+        if len(batch) >= batch_size:
+            copied += len(ChangeEvent.objects.using(target).bulk_create(batch))
+            batch = []
+    if batch:
+        copied += len(ChangeEvent.objects.using(target).bulk_create(batch))
+    return history, copied
+
+
+def move_user(user_id, target, drain_timeout=60.0, batch_size=1000, log=None):
+    """Move all rows of ``user_id`` to the shard ``target``.
+
+    The user is locked for the move: API writes are refused and workers skip
+    the user's rows. Once every process sees the lock and work in flight has
+    drained, the user's change events and then their rows (with their ids) are
+    copied in one transaction on the target, counts are checked, the shard map
+    is switched, and once every process sees the switch the rows are deleted
+    from the source.
+    """
+    log = log or (lambda message: None)
+    if target not in settings.DATABASE_SHARDS:
+        raise ShardMoveError(f'Unknown shard: {target!r}')
+    source = shard_for(user_id)
+    if source == target:
+        return 0
+
+    _set_assignment(user_id, alias=source, locked=True)
+    try:
+        _wait_for_shard_map(user_id, log)
+        deadline = time.monotonic() + drain_timeout
+        while _in_flight(user_id, source):
+            if time.monotonic() > deadline:
+                raise ShardMoveError(f'User {user_id} still has work in flight on {source}')
+            time.sleep(0.5)
+
+        prepare_shard(target)
+        copy_user(user_id, target)
+        copied = {}
+        with transaction.atomic(using=target):
+            history, copied['events.changeevent'] = _copy_change_events(user_id, source, target, batch_size)
+            for label, lookup in OWNED_ROWS:
+                model, rows = _owned(label, lookup, user_id, source)
+                batch, copied[label] = [], 0
+                for row in rows.iterator(chunk_size=batch_size):
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        model.objects.using(target).bulk_create(batch)
+                        copied[label] += len(batch)
+                        batch = []
+                if batch:
+                    model.objects.using(target).bulk_create(batch)
+                    copied[label] += len(batch)
+            for label, lookup in OWNED_ROWS:
+                present = _owned(label, lookup, user_id, target)[1].count()
+                if present != copied[label]:
+                    raise ShardMoveError(f'{label}: copied {copied[label]} rows but found {present} on {target}')
+            reset_sequences(target)
+            # The search index of the target only has the previews of offloaded bodies.
+            from messages_app.content import reindex_bodies
+            from messages_app.models import Message
+
+            reindex_bodies(Message.objects.using(target).filter(owner_id=user_id))
+        log(f'Copied {sum(copied.values())} rows of user {user_id} from {source} to {target}')
+
+        _set_assignment(user_id, alias=target, locked=True)
+        _wait_for_shard_map(user_id, log)
+        with transaction.atomic(using=source):
+            # Reverse order, so dependent rows go before what they point to.
+            for label, lookup in reversed(OWNED_ROWS):
+                _owned(label, lookup, user_id, source)[1].delete()
+            # The delete events just recorded stay for the source's consumers.
+            history.delete()
+            if source != 'default':
+                from django.contrib.auth import get_user_model
+
+                get_user_model()._base_manager.using(source).filter(pk=user_id).delete()
+        log(f'Deleted user {user_id} rows from {source}')
+        return sum(copied.values())
+    finally:
+        _set_assignment(user_id, alias=shard_for(user_id), locked=False)
@@ -0,0 +1,30 @@
+"""
+Streamed responses that stay streamed under ASGI.
+
+Django serves a streaming response with a synchronous iterator to an ASGI
+server by reading the whole iterator into a list first (``sync_to_async(list)``),
+so an export or attachment would be held in memory in full. ``stream_asgi()``
+gives such a response an asynchronous iterator instead, which pulls one chunk
+at a time from the synchronous one on the request's thread (the one its
+database connection belongs to). Under WSGI the response is left as it is, so
+a ``FileResponse`` can still be sent with ``wsgi.file_wrapper``.
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+
+_END = object()
+
+
+async def _chunks(iterator):
+    take = sync_to_async(next, thread_sensitive=True)
+    while (chunk := await take(iterator, _END)) is not _END:
+        yield chunk
+
+
+def stream_asgi(request, response):
+    """Make ``response`` stream chunk by chunk when ``request`` came in over ASGI; returns it."""
+    if isinstance(request, ASGIRequest) and response.streaming and not response.is_async:
+        # The original iterator stays registered to be closed with the response.
+        response.streaming_content = _chunks(iter(response.streaming_content))
+    return response
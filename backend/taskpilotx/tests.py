@@ -0,0 +1,165 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from accounts.models import LinkedAccount
+from messages_app.content import split_content
+from messages_app.models import Message, MessageAttachment
+from tasks.models import Task
+from users.tokens import RefreshToken
+from . import blobs
+from .middleware import _sticky_key
+from .routers import routing
+from .sharding import shard_for, use_shard
+
+
+User = get_user_model()
+
+
+class WorkerSettingsTests(SimpleTestCase):
+    def test_setup_imports_no_web_packages(self):
+        # A fresh process, as this one has the web apps loaded already.
+        code = (
+            'import json, sys, django; django.setup(); '
+            'print(json.dumps([m for m in ("rest_framework", "graphene") if m in sys.modules]))'
+        )
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'taskpilotx.worker_settings'}
+        result = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True, env=env, cwd=settings.BASE_DIR, check=True,
+        )
+        self.assertEqual(json.loads(result.stdout), [])
+
+    @override_settings(ROOT_URLCONF=None)
+    def test_startup_profile_without_urlconf_profiles_setup(self):
+        out = StringIO()
+        call_command('startup_profile', repeat=1, limit=1, stdout=out)
+        self.assertTrue(out.getvalue().startswith('setup '), out.getvalue())
+        with self.assertRaisesMessage(CommandError, 'only --stage setup can run'):
+            call_command('startup_profile', stage='urls', stdout=out)
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class ASGIStreamingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings_override = override_settings(BLOB_STORE_DIR=root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        blobs._store = None
+        self.addCleanup(setattr, blobs, '_store', None)
+
+        self.user = User.objects.create_user(username='streamer', email='streamer@example.com', password='x')
+        self.body = os.urandom(3 * 8192 + 100)
+        with use_shard(shard_for(self.user.pk)):
+            account = LinkedAccount.objects.create(
+                owner=self.user, service_name='gmail', account_identifier='streamer@example.com',
+                encrypted_token='token',
+            )
+            messages = Message.objects.bulk_create([
+                Message(
+                    owner=self.user, source_account=account, external_message_id=str(i), title=f'message {i}',
+                    content='hello',
+                )
+                for i in range(50)
+            ])
+            blob = blobs.get_blob_store().put([self.body])
+            self.attachment = MessageAttachment.objects.create(
+                message=messages[0], filename='body.bin', size=len(self.body), blob_hash=blob.hash,
+            )
+        self.headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    async def stream(self, path):
+        response = await self.async_client.get(path, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        # Served chunk by chunk, not read into a list first.
+        self.assertTrue(response.is_async)
+        return [chunk async for chunk in response.streaming_content]
+
+    async def test_export_streams_under_asgi(self):
+        with mock.patch('taskpilotx.exports.WRITE_BUFFER_SIZE', 1024):
+            chunks = await self.stream('/api/export/messages/')
+        self.assertGreater(len(chunks), 1)
+        rows = [json.loads(line) for line in b''.join(chunks).splitlines()]
+        self.assertEqual([row['title'] for row in rows], [f'message {i}' for i in range(50)])
+
+    async def test_attachment_streams_under_asgi(self):
+        chunks = await self.stream(f'/api/messages/attachments/{self.attachment.pk}/')
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), self.body)
+
+    @override_settings(MESSAGE_INLINE_CONTENT_CHARS=100, MESSAGE_PREVIEW_CHARS=10)
+    def test_export_has_the_whole_body_of_offloaded_messages(self):
+        body = 'long body ' * 50
+        with use_shard(shard_for(self.user.pk)):
+            content, content_hash = split_content(body, self.user.pk)
+            Message.objects.filter(external_message_id='0').update(content=content, content_hash=content_hash)
+        self.client.defaults['HTTP_AUTHORIZATION'] = self.headers['Authorization']
+        response = self.client.get('/api/export/messages/')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual((rows[0]['content'], rows[0]['content_hash']), (body, content_hash))
+        self.assertEqual(rows[1]['content'], 'hello')
+
+    def test_wsgi_responses_are_left_alone(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = self.headers['Authorization']
+        response = self.client.get(f'/api/messages/attachments/{self.attachment.pk}/')
+        self.assertFalse(response.is_async)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+
+
+# shard_1 stands in for a replica that has not caught up: reads that go to it
+# see none of the primary's rows.
+@skipUnless('shard_1' in settings.DATABASES, 'needs a second database, e.g. DB_SHARDS=shard_1,shard_2 (see manage.py)')
+@override_settings(
+    DATABASE_SHARDS=['default'], DATABASE_REPLICAS=['shard_1'], READ_YOUR_WRITES_SECONDS=5,
+    RATE_LIMIT_ENABLED=False,
+)
+class ReplicaRoutingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', email='reader@example.com', password='x')
+        Task.objects.create(owner=self.user, title='on the primary', prompt='p')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+
+    def graphql(self, query):
+        response = self.client.post('/api/graphql/', json.dumps({'query': query}), content_type='application/json')
+        return response.json()['data']
+
+    def my_tasks(self):
+        return [task['title'] for task in self.graphql('{ myTasks { title } }')['myTasks']]
+
+    def test_reads_go_to_replicas_and_writes_to_the_primary(self):
+        with routing() as state:
+            self.assertEqual(Task.objects.all().db, 'shard_1')
+            task = Task.objects.create(owner=self.user, title='new', prompt='p')
+            self.assertEqual(task._state.db, 'default')
+            # The request that wrote reads its own writes.
+            self.assertTrue(state.wrote)
+            self.assertEqual(Task.objects.all().db, 'default')
+        # Outside a request, the primary.
+        self.assertEqual(Task.objects.all().db, 'default')
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        self.assertEqual(self.my_tasks(), [])
+
+        data = self.graphql('mutation { createTask(taskData: {title: "written", prompt: "p"}) { success } }')
+        self.assertTrue(data['createTask']['success'])
+        self.assertEqual(sorted(self.my_tasks()), ['on the primary', 'written'])
+
+        # Once the window is over, queries go back to the replica.
+        cache.delete(_sticky_key(self.user.pk))
+        self.assertEqual(self.my_tasks(), [])
@@ -16,13 +16,17 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
-from graphene_django.views import GraphQLView
-from django.views.decorators.csrf import csrf_exempt
-from .schema import schema
+from actions.views import upload_view
+from messages_app.views import attachment_view
+from .exports import export_view
+from .views import graphql_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/users/', include('users.urls')),
-    path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema))),
-    path('api/graphql/', csrf_exempt(GraphQLView.as_view(schema=schema))),
+    path('api/export/<str:kind>/', export_view, name='export'),
+    path('api/uploads/', upload_view, name='upload'),
+    path('api/messages/attachments/<int:attachment_id>/', attachment_view, name='message-attachment'),
+    path('graphql/', graphql_view(graphiql=True)),
+    path('api/graphql/', graphql_view()),
 ]
@@ -0,0 +1,33 @@
+"""
+GraphQL endpoints, built on their first request.
+
+Importing the schema imports every app's ``schema.py`` and creates all of its
+types. Doing that while ``urls.py`` loads made every process pay for it before
+serving anything, including requests that never touch GraphQL.
+``load_schema()`` builds it ahead of time where that is wanted, e.g. before a
+server forks its workers.
+"""
+from django.views.decorators.csrf import csrf_exempt
+
+
+def load_schema():
+    """Import and build the GraphQL schema; only the first call in a process does any work."""
+    from .schema import schema
+    return schema
+
+
+def graphql_view(**initkwargs):
+    """``GraphQLView.as_view(**initkwargs)`` for the schema, created when first requested."""
+    view = None
+
+    @csrf_exempt
+    def lazy_view(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            # Two threads may both get here; the import lock builds the schema
+            # once and the second view is merely thrown away.
+            from graphene_django.views import GraphQLView
+            view = GraphQLView.as_view(schema=load_schema(), **initkwargs)
+        return view(request, *args, **kwargs)
+
+    return lazy_view
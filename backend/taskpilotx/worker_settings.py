@@ -0,0 +1,30 @@
+"""
+Settings for processes that serve no HTTP: the task worker, scheduler, delivery
+worker and change followers.
+
+    DJANGO_SETTINGS_MODULE=taskpilotx.worker_settings python manage.py run_task_worker
+
+Databases, caches and the project's apps are those of ``settings``. The apps and
+middleware only the web process needs are left out, so ``django.setup()`` does
+not import graphene, DRF, corsheaders or the admin. Compare with
+``python manage.py startup_profile --settings taskpilotx.worker_settings``.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS
+
+WEB_APPS = {
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'corsheaders',
+    'rest_framework',
+    'rest_framework_simplejwt',
+    'graphene_django',
+}
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in WEB_APPS]
+
+MIDDLEWARE = []
+
+# Nothing is routed; this also keeps checks from importing the URLconf.
+ROOT_URLCONF = None
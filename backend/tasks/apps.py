@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class TasksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tasks'
+
+    def ready(self):
+        # Registers the TRIGGER_TASK handler and the signals keeping the chain
+        # graphs and task snapshots current.
+        from . import snapshot, workflow  # noqa: F401
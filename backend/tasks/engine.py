@@ -0,0 +1,270 @@
+"""
+Task execution engine.
+
+Workers claim pending ``TaskExecution`` rows (``SELECT ... FOR UPDATE SKIP
+LOCKED`` where supported, a conditional ``UPDATE`` otherwise), so any number of
+worker processes can run side by side without executing anything twice. Each
+claimed execution is evaluated against its triggering message, the chosen
+actions are dispatched, and the action executions, their links and the final
+state of the execution and task are written in one transaction.
+
+Workers also match new messages to candidate tasks (shortlisted through the
+embedding index, or selected by their declarative rules) and queue a pending
+execution for each; executions decided by rules skip the AI evaluation.
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from actions.handlers import run_action
+from actions.models import ActionExecution
+from actions.uploads import store_inline_content
+from actions.validation import validate_config
+from ai.embeddings import get_index
+from ai.services import evaluate_task
+from messages_app.models import Message
+from taskpilotx.sharding import exclude_locked, shard_db
+from .models import Task, TaskExecution
+from .snapshot import TaskSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+
+class LostClaim(Exception):
+    """The execution was reclaimed by another worker after our lease expired."""
+
+
+def claim(queryset, limit, **claim_fields):
+    """Atomically move up to ``limit`` rows of ``queryset`` to ``claim_fields``.
+
+    Returns the ids this caller won.
+    """
+    using = router.db_for_write(queryset.model)
+    if connections[using].features.has_select_for_update_skip_locked:
+        with transaction.atomic(using=using):
+            ids = list(queryset.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            queryset.model.objects.filter(id__in=ids).update(**claim_fields)
+            return ids
+    # Without row locks, a conditional update per row decides who wins.
+    ids = []
+    for pk in queryset.values_list('id', flat=True)[:limit]:
+        if queryset.filter(id=pk).update(**claim_fields):
+            ids.append(pk)
+    return ids
+
+
+class TaskEngine:
+    def __init__(self, worker_id=None, prefetch=None, concurrency=None, lease_seconds=None, match_messages=True):
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.prefetch = prefetch or settings.TASK_WORKER_PREFETCH
+        self.concurrency = concurrency or settings.TASK_WORKER_CONCURRENCY
+        self.lease = timedelta(seconds=lease_seconds or settings.TASK_EXECUTION_LEASE_SECONDS)
+        self.match_messages = match_messages
+        self.snapshot = TaskSnapshot()
+        self.embedded_versions = {}  # owner_id -> snapshot version when their task embeddings were refreshed
+        self.stopping = threading.Event()
+
+    # Worker loop
+
+    def run(self, poll_interval=1.0, once=False):
+        self._install_signal_handlers()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='task-worker') as pool:
+            while not self.stopping.is_set():
+                self.recover_stale()
+                matched = self.match_pending_messages() if self.match_messages else 0
+                ids = self.claim_executions(self.prefetch)
+                # The prefetch window is drained before claiming more work.
+                for _ in pool.map(self._execute_in_thread, ids):
+                    pass
+                if once and not ids and not matched:
+                    break
+                if not ids and not matched:
+                    self.stopping.wait(poll_interval)
+        close_old_connections()
+
+    def stop(self, *args):
+        logger.info('Worker %s stopping after the current batch', self.worker_id)
+        self.stopping.set()
+
+    def _install_signal_handlers(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+    def _execute_in_thread(self, execution_id):
+        try:
+            if self.stopping.is_set():
+                self.release(execution_id)
+            else:
+                self.execute(execution_id)
+        except Exception:
+            logger.exception('Task execution %s crashed', execution_id)
+        finally:
+            connections.close_all()
+
+    # Claiming
+
+    def claim_executions(self, limit):
+        pending = exclude_locked(TaskExecution.objects.filter(status='pending'), 'task__owner_id').order_by('started_at')
+        return claim(pending, limit, status='running', worker_id=self.worker_id, claimed_at=timezone.now())
+
+    def release(self, execution_id):
+        TaskExecution.objects.filter(id=execution_id, status='running', worker_id=self.worker_id).update(
+            status='pending', worker_id='', claimed_at=None
+        )
+
+    def recover_stale(self):
+        """Requeue executions and messages whose worker died holding the claim."""
+        expired = timezone.now() - self.lease
+        TaskExecution.objects.filter(status='running', claimed_at__lt=expired).update(
+            status='pending', worker_id='', claimed_at=None
+        )
+        Message.objects.filter(status='processing', updated_at__lt=expired).update(status='unprocessed')
+
+    # Matching
+
+    def match_pending_messages(self):
+        """Queue executions for new messages; returns the number of messages matched."""
+        unprocessed = exclude_locked(Message.objects.filter(status='unprocessed')).order_by('created_at')
+        ids = claim(unprocessed, self.prefetch, status='processing', updated_at=timezone.now())
+        if not ids:
+            return 0
+
+        messages = list(Message.objects.filter(id__in=ids).select_related('source_account'))
+        self.snapshot.refresh()
+        index = get_index()
+        for owner_id in {message.owner_id for message in messages}:
+            # Embeddings only go stale when the owner's tasks changed.
+            version = self.snapshot.versions.get(owner_id, 0)
+            if self.embedded_versions.get(owner_id) != version:
+                index.refresh_tasks(owner_id)
+                self.embedded_versions[owner_id] = version
+
+        matches = []
+        shortlists = index.shortlist_tasks(messages)
+        for message, shortlist in zip(messages, shortlists):
+            # Rule-decided tasks run when their rules match and are never sent
+            # to the AI; the shortlist only brings in tasks left to the AI.
+            rules = self.snapshot.rule_set(message.owner_id)
+            ruled = rules.evaluate(message)
+            candidates = {task_id for task_id, _ in shortlist if not rules.decides(task_id)}
+            candidates.update(ruled)
+            for task_id in self.snapshot.watching(message.owner_id, candidates, message.source_account_id):
+                decision = None
+                if task_id in ruled:
+                    decision = {'execute': True, 'action_ids': ruled[task_id], 'reasoning': 'Matched task rules', 'source': 'rules'}
+                matches.append((task_id, message, decision))
+        # The snapshot may still hold tasks deleted since its last refresh.
+        existing = set(Task.objects.filter(id__in={task_id for task_id, _, _ in matches}).values_list('id', flat=True))
+        executions = [
+            TaskExecution(task_id=task_id, triggering_message=message, ai_decision=decision or {})
+            for task_id, message, decision in matches if task_id in existing
+        ]
+
+        with transaction.atomic(using=shard_db()):
+            TaskExecution.objects.bulk_create(executions)
+            Message.objects.filter(id__in=ids).update(
+                status='processed', processed_at=timezone.now(), updated_at=timezone.now()
+            )
+        return len(ids)
+
+    # Execution
+
+    def execute(self, execution_id):
+        execution = TaskExecution.objects.select_related('task', 'triggering_message').get(id=execution_id)
+        task, message = execution.task, execution.triggering_message
+        if not task.can_execute:
+            return self._finalize(execution, 'failed', {}, [], error='Task cannot execute')
+
+        actions = {action.id: action for action in task.actions.filter(is_active=True)}
+        if execution.ai_decision.get('source') == 'rules':
+            decision = dict(execution.ai_decision)
+            if decision['action_ids'] is None:
+                decision['action_ids'] = list(actions)
+        else:
+            try:
+                decision = evaluate_task(task, message, list(actions.values()))
+            except Exception as e:
+                return self._finalize(execution, 'failed', {}, [], error=f'AI evaluation failed: {e}')
+
+        action_config = task.ai_config.get('action_config', {}) if isinstance(task.ai_config, dict) else {}
+        planned = [
+            ActionExecution(
+                action=actions[action_id],
+                executed_by_id=task.owner_id,
+                triggering_task=task,
+                config_data=action_config.get(str(action_id), {}),
+                status='running',
+            )
+            for action_id in decision['action_ids'] if decision['execute'] and action_id in actions
+        ]
+        invalid = []
+        for action_execution in planned:
+            try:
+                validate_config(action_execution.action, action_execution.config_data)
+                action_execution.config_data = store_inline_content(
+                    action_execution.action, action_execution.config_data, task.owner_id,
+                )
+            except ValidationError as e:
+                invalid += e.messages
+        if invalid:
+            return self._finalize(execution, 'failed', decision, [], error='; '.join(invalid))
+        return self._finalize(execution, None, decision, planned)
+
+    def _finalize(self, execution, status, decision, planned, error=None):
+        """Dispatch ``planned`` actions and record the outcome in one transaction."""
+        now = timezone.now()
+        try:
+            with transaction.atomic(using=shard_db()):
+                action_executions = ActionExecution.objects.bulk_create(planned)
+                for action_execution in action_executions:
+                    run_action(
+                        action_execution, message=execution.triggering_message, save=False, task_execution=execution
+                    )
+                ActionExecution.objects.bulk_update(
+                    action_executions, ['status', 'result_data', 'error_message', 'completed_at']
+                )
+                self._link(execution, action_executions)
+
+                failed = [ae.error_message for ae in action_executions if ae.status == 'failed']
+                if status is None:
+                    status = 'failed' if failed else 'completed'
+                    error = '; '.join(failed) or None
+                updated = TaskExecution.objects.filter(
+                    id=execution.id, status='running', worker_id=self.worker_id
+                ).update(status=status, ai_decision=decision, completed_at=now, error_message=error)
+                if not updated:
+                    raise LostClaim(execution.id)
+
+                if action_executions:
+                    Task.objects.filter(id=execution.task_id).update(
+                        execution_count=F('execution_count') + 1, last_executed_at=now, updated_at=now
+                    )
+        except LostClaim:
+            logger.warning('Lost claim on task execution %s; discarding results', execution.id)
+            return None
+        return status
+
+    def _link(self, execution, action_executions):
+        if not action_executions:
+            return
+        TaskExecution.actions_executed.through.objects.bulk_create([
+            TaskExecution.actions_executed.through(taskexecution_id=execution.id, actionexecution_id=ae.id)
+            for ae in action_executions
+        ])
+        if execution.triggering_message_id:
+            Message.triggered_actions.through.objects.bulk_create([
+                Message.triggered_actions.through(message_id=execution.triggering_message_id, actionexecution_id=ae.id)
+                for ae in action_executions
+            ])
@@ -0,0 +1,70 @@
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from tasks.models import Task
+from tasks.snapshot import FLAG_ACTIVE, TaskSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the memory per task of the compact task snapshot against Task model '
+        'instances, on synthetic tasks (no database access)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=1_000_000)
+        parser.add_argument('--users', type=int, default=50_000)
+        parser.add_argument('--model-sample', type=int, default=20_000,
+                            help='Number of model instances measured and extrapolated from')
+
+    def handle(self, *args, **options):
+        count, users = options['tasks'], options['users']
+        rng = random.Random(0)
+
+        def rows():
+            for pk in range(1, count + 1):
+                owner_id = rng.randrange(users)
+                accounts = tuple(owner_id * 8 + rng.randrange(8) for _ in range(rng.randrange(3)))
+                actions = tuple(rng.sample(range(1, 9), rng.randrange(1, 4)))
+                yield pk, owner_id, FLAG_ACTIVE, 0, rng.randrange(50), accounts, actions, None
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        snapshot = TaskSnapshot()
+        snapshot.load(rows())
+        elapsed = time.perf_counter() - start
+        snapshot_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        for _ in range(10_000):
+            owner_id = rng.randrange(users)
+            snapshot.watching(owner_id, [rng.randrange(1, count + 1) for _ in range(3)], owner_id * 8)
+        lookup_us = (time.perf_counter() - start) / 10_000 * 1e6
+
+        sample = options['model_sample']
+        tracemalloc.start()
+        instances = [
+            Task(
+                id=pk, owner_id=pk % users, title=f'Task {pk}',
+                prompt='Notify me when an invoice from a vendor arrives and file it under finance.',
+                ai_config={'action_config': {'1': {'channel': 'email'}}},
+            )
+            for pk in range(sample)
+        ]
+        model_bytes = tracemalloc.get_traced_memory()[0] / sample
+        tracemalloc.stop()
+        del instances
+
+        self.stdout.write(
+            f'snapshot: {count} tasks loaded in {elapsed:.1f}s, {snapshot_bytes / 2**20:.1f} MiB '
+            f'({snapshot_bytes / count:.0f} B/task, columns {snapshot.nbytes / count:.0f} B/task), '
+            f'watching() {lookup_us:.1f} us'
+        )
+        self.stdout.write(
+            f'model instances: {model_bytes:.0f} B/task, '
+            f'{model_bytes * count / 2**20:.0f} MiB for {count} tasks'
+        )
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tasks.scheduler import Scheduler
+from taskpilotx.sharding import pin_process_shard
+
+
+class Command(BaseCommand):
+    help = 'Fire task executions for due dates and recurring schedules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refresh-interval', type=float, default=5.0,
+                            help='Seconds between incremental reloads of changed tasks')
+        parser.add_argument('--shard', choices=settings.DATABASE_SHARDS, default='default',
+                            help='Database shard to work on')
+
+    def handle(self, *args, **options):
+        pin_process_shard(options['shard'])
+        scheduler = Scheduler(refresh_interval=options['refresh_interval'])
+        self.stdout.write('Scheduler started')
+        scheduler.run()
+        self.stdout.write(f'Scheduler stopped with {len(scheduler)} pending triggers')
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tasks.engine import TaskEngine
+from taskpilotx.sharding import pin_process_shard
+
+
+class Command(BaseCommand):
+    help = 'Run a task execution worker: match new messages to tasks and execute pending task executions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefetch', type=int, default=settings.TASK_WORKER_PREFETCH,
+                            help='Executions claimed per batch')
+        parser.add_argument('--concurrency', type=int, default=settings.TASK_WORKER_CONCURRENCY,
+                            help='Executions run in parallel within this process')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when idle')
+        parser.add_argument('--no-match', action='store_true', help='Only execute, do not match new messages')
+        parser.add_argument('--once', action='store_true', help='Exit when there is no more work')
+        parser.add_argument('--shard', choices=settings.DATABASE_SHARDS, default='default',
+                            help='Database shard to work on')
+
+    def handle(self, *args, **options):
+        pin_process_shard(options['shard'])
+        engine = TaskEngine(
+            prefetch=options['prefetch'],
+            concurrency=options['concurrency'],
+            match_messages=not options['no_match'],
+        )
+        self.stdout.write(f'Task worker {engine.worker_id} started')
+        engine.run(poll_interval=options['poll_interval'], once=options['once'])
+        self.stdout.write(f'Task worker {engine.worker_id} stopped')
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actions', '0002_create_default_actions'),
+        ('messages_app', '0002_message_search_index'),
+        ('tasks', '0004_remove_task_inputs_remove_task_settings_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskexecution',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='taskexecution',
+            name='worker_id',
+            field=models.CharField(blank=True, help_text='Worker that claimed this execution', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='taskexecution',
+            index=models.Index(fields=['status', 'started_at'], name='taskexec_status_started_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actions', '0002_create_default_actions'),
+        ('messages_app', '0003_message_status_index'),
+        ('tasks', '0005_taskexecution_worker_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskexecution',
+            name='scheduled_for',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='taskexecution',
+            constraint=models.UniqueConstraint(fields=('task', 'scheduled_for'), name='taskexec_unique_scheduled_for'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0006_taskexecution_scheduled_for'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskexecution',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Number of chained executions above this one'),
+        ),
+        migrations.AddField(
+            model_name='taskexecution',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='children', to='tasks.taskexecution'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0007_taskexecution_chain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskexecution',
+            name='root',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tasks.taskexecution'),
+        ),
+        migrations.AddConstraint(
+            model_name='taskexecution',
+            constraint=models.UniqueConstraint(fields=('root', 'task'), name='taskexec_unique_chain_task'),
+        ),
+    ]
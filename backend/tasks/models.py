@@ -1,8 +1,10 @@
 from django.db import models
 from django.conf import settings
 
+from events.outbox import OutboxModel, OutboxQuerySet
 
-class Task(models.Model):
+
+class Task(OutboxModel, models.Model):
     """Enhanced Task model for AI-driven automation."""
     
     STATUS_CHOICES = [
@@ -54,6 +56,8 @@ class Task(models.Model):
     # AI processing configuration
     ai_config = models.JSONField(default=dict, blank=True, help_text="AI processing configuration")
     
+    objects = OutboxQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
 
@@ -70,7 +74,7 @@ class Task(models.Model):
         return True
 
 
-class TaskExecution(models.Model):
+class TaskExecution(OutboxModel, models.Model):
     """Model to track individual task executions."""
     
     STATUS_CHOICES = [
@@ -91,8 +95,32 @@ class TaskExecution(models.Model):
     completed_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(blank=True, null=True)
     
+    # Set for executions fired by the scheduler; unique per task so a trigger fires once
+    scheduled_for = models.DateTimeField(null=True, blank=True)
+    
+    # Worker claim, used by the execution engine to avoid double execution
+    worker_id = models.CharField(max_length=100, blank=True, help_text="Worker that claimed this execution")
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    
+    # Set for executions queued by a TRIGGER_TASK action of another execution
+    parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='children')
+    depth = models.PositiveSmallIntegerField(default=0, help_text="Number of chained executions above this one")
+    # First execution of the chain; unique per task so each task runs once per chain
+    root = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    
+    objects = OutboxQuerySet.as_manager()
+    # Executions have no direct owner column
+    change_event_owner = None
+    
     class Meta:
         ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['status', 'started_at'], name='taskexec_status_started_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'scheduled_for'], name='taskexec_unique_scheduled_for'),
+            models.UniqueConstraint(fields=['root', 'task'], name='taskexec_unique_chain_task'),
+        ]
     
     def __str__(self):
         return f"{self.task.title} execution - {self.status} ({self.started_at.strftime('%Y-%m-%d %H:%M')})"
@@ -0,0 +1,307 @@
+"""
+Declarative task rules, decided without an LLM call.
+
+A task may declare rules in ``ai_config``::
+
+    {"rules": {
+        "match": "all",
+        "conditions": [
+            {"field": "sender_domain", "op": "in", "value": ["acme.com"]},
+            {"field": "text", "op": "contains_any", "value": ["invoice", "receipt"]},
+            {"field": "priority", "op": "in", "value": ["high", "urgent"]}
+        ],
+        "action_ids": [3],
+        "otherwise": "skip"
+    }}
+
+When the conditions match, the task runs ``action_ids`` (all of its actions if
+omitted). Otherwise it is skipped, or, with ``"otherwise": "ai"``, left to the
+AI evaluation of its prompt.
+
+Rules are validated against ``RULES_SCHEMA`` when a task is saved and compiled
+once per distinct rule set. All rules of one user are evaluated together: the
+keywords of every rule go into one Aho-Corasick automaton, so a message's
+title and content are each scanned once however many rules there are.
+
+Rules are written by users but run in the shared matcher, so they only see the
+first ``TASK_RULES_TEXT_CHARS`` of a body (an offloaded body is not read past
+that), and a regex gets ``TASK_RULES_REGEX_TIMEOUT`` seconds per message before
+it counts as not matching.
+"""
+import json
+import logging
+from collections import deque
+from functools import lru_cache
+
+import regex
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from jsonschema import Draft7Validator
+
+from messages_app.content import full_content
+
+
+logger = logging.getLogger(__name__)
+
+SET_FIELDS = ['sender', 'sender_domain', 'priority', 'account', 'service']
+TEXT_FIELDS = ['title', 'content', 'text']
+
+RULES_SCHEMA = {
+    'type': 'object',
+    'required': ['conditions'],
+    'additionalProperties': False,
+    'properties': {
+        'match': {'enum': ['all', 'any']},
+        'otherwise': {'enum': ['skip', 'ai']},
+        'action_ids': {'type': 'array', 'items': {'type': 'integer'}, 'minItems': 1},
+        'conditions': {
+            'type': 'array',
+            'minItems': 1,
+            'items': {
+                'anyOf': [
+                    {
+                        'type': 'object',
+                        'required': ['field', 'op', 'value'],
+                        'additionalProperties': False,
+                        'properties': {
+                            'field': {'enum': SET_FIELDS},
+                            'op': {'enum': ['in', 'not_in']},
+                            'value': {'type': 'array', 'minItems': 1, 'items': {'type': ['string', 'integer']}},
+                        },
+                    },
+                    {
+                        'type': 'object',
+                        'required': ['field', 'op', 'value'],
+                        'additionalProperties': False,
+                        'properties': {
+                            'field': {'enum': TEXT_FIELDS},
+                            'op': {'enum': ['contains_any', 'contains_all', 'not_contains']},
+                            'value': {'type': 'array', 'minItems': 1, 'items': {'type': 'string', 'minLength': 1}},
+                        },
+                    },
+                    {
+                        'type': 'object',
+                        'required': ['field', 'op', 'value'],
+                        'additionalProperties': False,
+                        'properties': {
+                            'field': {'enum': TEXT_FIELDS + ['sender']},
+                            'op': {'const': 'regex'},
+                            'value': {'type': 'string', 'minLength': 1, 'maxLength': 500},
+                        },
+                    },
+                ],
+            },
+        },
+    },
+}
+
+_validator = Draft7Validator(RULES_SCHEMA)
+
+
+def validate_rules(ai_config):
+    """Raise ``ValidationError`` if the rules in ``ai_config`` are invalid."""
+    rules = ai_config.get('rules') if isinstance(ai_config, dict) else None
+    if rules is None:
+        return
+    errors = [
+        f'rules{"".join(f"[{part!r}]" for part in error.absolute_path)}: {error.message}'
+        for error in _validator.iter_errors(rules)
+    ]
+    if not errors:
+        for condition in rules['conditions']:
+            if condition['op'] == 'regex':
+                try:
+                    regex.compile(condition['value'])
+                except regex.error as e:
+                    errors.append(f'rules: invalid regex {condition["value"]!r}: {e}')
+    if errors:
+        raise ValidationError(errors)
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton finding which of many keywords occur in a text."""
+
+    __slots__ = ('transitions', 'outputs')
+
+    def __init__(self, keywords):
+        self.transitions = [{}]
+        self.outputs = [set()]
+        for index, keyword in enumerate(keywords):
+            state = 0
+            for char in keyword:
+                if char not in self.transitions[state]:
+                    self.transitions[state][char] = self._new_state()
+                state = self.transitions[state][char]
+            self.outputs[state].add(index)
+
+        # Failure links, breadth-first so a state's link is known before its
+        # children's. Then missing transitions are copied from the failure
+        # state (also breadth-first), making matching one lookup per char.
+        fail = [0] * len(self.transitions)
+        order = []
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            order.append(state)
+            for char, target in self.transitions[state].items():
+                queue.append(target)
+                fallback = fail[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = fail[fallback]
+                fail[target] = self.transitions[fallback].get(char, 0) if state else 0
+                self.outputs[target] |= self.outputs[fail[target]]
+        for state in order:
+            for char, target in self.transitions[fail[state]].items():
+                self.transitions[state].setdefault(char, target)
+        self.outputs = [frozenset(output) for output in self.outputs]
+
+    def _new_state(self):
+        self.transitions.append({})
+        self.outputs.append(set())
+        return len(self.transitions) - 1
+
+    def search(self, text):
+        """Return the indices of the keywords found in ``text``."""
+        found = set()
+        transitions, outputs = self.transitions, self.outputs
+        state = 0
+        for char in text:
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                found |= outputs[state]
+        return found
+
+
+class CompiledRules:
+    """One task's rules: keyword conditions plus closures over the message fields."""
+
+    __slots__ = ('match_all', 'conditions', 'keywords', 'action_ids', 'fallback_to_ai')
+
+    def __init__(self, rules):
+        self.match_all = rules.get('match', 'all') == 'all'
+        self.action_ids = tuple(rules['action_ids']) if rules.get('action_ids') else None
+        self.fallback_to_ai = rules.get('otherwise', 'skip') == 'ai'
+        # Keyword conditions stay data, (field, op, keywords): the RuleSet
+        # finds the keywords of all rules at once and passes them in as hits.
+        self.conditions = []
+        self.keywords = set()
+        for condition in rules['conditions']:
+            field, op, value = condition['field'], condition['op'], condition['value']
+            if op in ('in', 'not_in'):
+                self.conditions.append(_set_predicate(field, op == 'in', value))
+            elif op == 'regex':
+                self.conditions.append(_regex_predicate(field, regex.compile(value, regex.IGNORECASE)))
+            else:
+                keywords = tuple(dict.fromkeys(keyword.lower() for keyword in value))
+                self.keywords.update(keywords)
+                self.conditions.append((field, op, keywords))
+
+    def matches(self, fields, hits):
+        """``hits`` maps 'title'/'content'/'text' to the set of keywords found there."""
+        results = (
+            condition(fields) if callable(condition) else _keyword_match(condition, hits)
+            for condition in self.conditions
+        )
+        return all(results) if self.match_all else any(results)
+
+
+def _set_predicate(field, inclusive, values):
+    values = frozenset(str(value).lower() for value in values)
+    if inclusive:
+        return lambda fields: fields[field] in values
+    return lambda fields: fields[field] not in values
+
+
+def _regex_predicate(field, pattern):
+    search = pattern.search
+
+    def predicate(fields):
+        try:
+            return search(fields[field], timeout=settings.TASK_RULES_REGEX_TIMEOUT) is not None
+        except TimeoutError:
+            logger.warning('Task rule regex %r timed out; treated as not matching', pattern.pattern)
+            return False
+    return predicate
+
+
+def _keyword_match(condition, hits):
+    field, op, keywords = condition
+    found = hits[field]
+    if op == 'contains_any':
+        return any(keyword in found for keyword in keywords)
+    if op == 'contains_all':
+        return all(keyword in found for keyword in keywords)
+    return not any(keyword in found for keyword in keywords)
+
+
+@lru_cache(maxsize=4096)
+def _compile(rules_json):
+    return CompiledRules(json.loads(rules_json))
+
+
+def compile_rules(ai_config):
+    """Compile the rules in ``ai_config``; ``None`` if there are none or they are invalid."""
+    rules = ai_config.get('rules') if isinstance(ai_config, dict) else None
+    if rules is None:
+        return None
+    try:
+        validate_rules(ai_config)
+    except ValidationError as e:
+        # Saved before validation existed, or edited in the admin.
+        logger.warning('Ignoring invalid task rules: %s', '; '.join(e.messages))
+        return None
+    # Identical rule sets share one compiled object.
+    return _compile(json.dumps(rules, sort_keys=True))
+
+
+def message_fields(message):
+    sender_info = message.sender_info if isinstance(message.sender_info, dict) else {}
+    sender = str(sender_info.get('email') or sender_info.get('address') or sender_info.get('from') or '').lower()
+    title, content = (message.title or '').lower(), full_content(message, limit=settings.TASK_RULES_TEXT_CHARS).lower()
+    return {
+        'sender': sender,
+        'sender_domain': sender.rpartition('@')[2],
+        'priority': message.priority,
+        'account': str(message.source_account_id),
+        'service': message.source_account.service_name.lower(),
+        'title': title,
+        'content': content,
+        'text': f'{title}\n{content}',
+    }
+
+
+class RuleSet:
+    """The rules of all of one user's tasks, evaluated in one pass per message."""
+
+    __slots__ = ('rules', 'keywords', 'automaton')
+
+    def __init__(self, rules):
+        self.rules = rules  # task_id -> CompiledRules
+        self.keywords = sorted(set().union(*(compiled.keywords for compiled in rules.values())))
+        self.automaton = KeywordAutomaton(self.keywords) if self.keywords else None
+
+    def __contains__(self, task_id):
+        return task_id in self.rules
+
+    def decides(self, task_id):
+        """Whether the rules alone decide the task, with no AI fallback."""
+        compiled = self.rules.get(task_id)
+        return compiled is not None and not compiled.fallback_to_ai
+
+    def evaluate(self, message):
+        """Return ``{task_id: action_ids or None}`` for the tasks whose rules match ``message``."""
+        if not self.rules:
+            return {}
+        fields = message_fields(message)
+        hits = {'title': frozenset(), 'content': frozenset()}
+        if self.automaton is not None:
+            hits = {
+                field: frozenset(self.keywords[i] for i in self.automaton.search(fields[field]))
+                for field in ('title', 'content')
+            }
+        hits['text'] = hits['title'] | hits['content']
+        return {
+            task_id: compiled.action_ids
+            for task_id, compiled in self.rules.items()
+            if compiled.matches(fields, hits)
+        }
@@ -0,0 +1,309 @@
+"""
+Time-based task triggering.
+
+A task fires when its ``due_date`` passes, and on a recurring schedule
+declared in ``ai_config``::
+
+    {"schedule": {"cron": "0 9 * * 1-5", "timezone": "Europe/Berlin"}}
+    {"schedule": {"interval_seconds": 3600}}
+
+The scheduler keeps the next fire time of every trigger in a binary heap
+(O(log n) per insert/fire, stale entries are skipped lazily) and keeps it up
+to date from the change feed (``events.feed``) instead of rescanning tasks.
+Firing creates a pending ``TaskExecution`` with ``scheduled_for`` set; a unique
+constraint on ``(task, scheduled_for)`` makes firing idempotent across
+restarts and multiple scheduler processes. Triggers that already fired are
+looked up first, so only new executions are counted and announced on the
+change feed.
+"""
+import heapq
+import itertools
+import logging
+import signal
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from events.feed import ChangeFeed
+from events.outbox import topic
+from taskpilotx.sharding import locked_owner_ids
+from .models import Task, TaskExecution
+
+
+logger = logging.getLogger(__name__)
+
+# Changed tasks reloaded per query
+LOAD_CHUNK_SIZE = 2000
+
+
+class CronSchedule:
+    """Five-field cron expression: minute hour day-of-month month day-of-week."""
+
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression, tz=None):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression must have 5 fields: {expression!r}')
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.RANGES)
+        )
+        # Sunday may be written as 7.
+        self.weekdays = {0 if day == 7 else day for day in self.weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+        self.tz = ZoneInfo(tz) if tz else dt_timezone.utc
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(','):
+            base, _, step = part.partition('/')
+            if base == '*':
+                start, end = low, high
+            elif '-' in base:
+                start, end = (int(value) for value in base.split('-'))
+            else:
+                # With a step, a single value starts a range that runs to the end of the field.
+                start = int(base)
+                end = high if step else start
+            # Day-of-week accepts 7 as an alias for Sunday.
+            if start < low or end > (7 if high == 6 else high) or start > end:
+                raise ValueError(f'Cron field {field!r} out of range')
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, day):
+        cron_weekday = (day.weekday() + 1) % 7
+        if self.any_day or self.any_weekday:
+            return day.day in self.days and cron_weekday in self.weekdays
+        # Standard cron: when both are restricted, either may match.
+        return day.day in self.days or cron_weekday in self.weekdays
+
+    def next_after(self, moment):
+        """Return the first matching minute strictly after ``moment``."""
+        local = moment.astimezone(self.tz).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = local.date()
+        for _ in range(366 * 5):
+            if day.month in self.months and self._day_matches(day):
+                start = (local.hour, local.minute) if day == local.date() else (0, 0)
+                for hour in sorted(self.hours):
+                    if hour < start[0]:
+                        continue
+                    for minute in sorted(self.minutes):
+                        if (hour, minute) >= start:
+                            candidate = datetime(day.year, day.month, day.day, hour, minute, tzinfo=self.tz)
+                            return candidate.astimezone(dt_timezone.utc)
+            day += timedelta(days=1)
+        return None
+
+
+def recurring_trigger(ai_config):
+    """Build the recurring trigger declared in ``ai_config``, if any."""
+    schedule = ai_config.get('schedule') if isinstance(ai_config, dict) else None
+    if not isinstance(schedule, dict):
+        return None
+    if schedule.get('cron'):
+        return CronSchedule(schedule['cron'], schedule.get('timezone'))
+    if schedule.get('interval_seconds'):
+        return timedelta(seconds=int(schedule['interval_seconds']))
+    return None
+
+
+class Scheduler:
+    def __init__(self, refresh_interval=5.0, batch_size=500):
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self.heap = []
+        self.entries = {}     # (task_id, kind) -> sequence number of the live heap entry
+        self.recurring = {}   # task_id -> (schedule config, CronSchedule or timedelta)
+        self.fired_due = {}   # task_id -> due date already fired by this process
+        self.held = []        # triggers of users being moved to another shard, retried on refresh
+        self.feed = None
+        self._sequence = itertools.count()
+        self.stopping = threading.Event()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Heap
+
+    def schedule(self, task_id, kind, when):
+        sequence = next(self._sequence)
+        self.entries[(task_id, kind)] = sequence
+        heapq.heappush(self.heap, (when, sequence, task_id, kind))
+
+    def unschedule(self, task_id, kind):
+        # The heap entry stays behind and is skipped when it surfaces.
+        self.entries.pop((task_id, kind), None)
+
+    def pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            when, sequence, task_id, kind = heapq.heappop(self.heap)
+            if self.entries.get((task_id, kind)) == sequence:
+                del self.entries[(task_id, kind)]
+                due.append((task_id, kind, when))
+        return due
+
+    def next_due(self):
+        while self.heap and self.entries.get((self.heap[0][2], self.heap[0][3])) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    # Loading
+
+    def refresh(self):
+        """Load tasks changed since the last refresh; returns the number loaded."""
+        now = timezone.now()
+        for task_id, kind, when in self.held:
+            self.schedule(task_id, kind, when)
+        self.held = []
+        if self.feed is None:
+            # The feed starts before the full load, so changes made during it are replayed.
+            self.feed = ChangeFeed(topics=[topic(Task)])
+            return self._load_rows(Task.objects.filter(Q(due_date__isnull=False) | Q(ai_config__has_key='schedule')), now)
+
+        changed, deleted = set(), set()
+        for event in self.feed.read_all():
+            (deleted if event.op == 'delete' else changed).add(event.object_id)
+        for task_id in deleted:
+            self.forget(task_id)
+        changed = sorted(changed - deleted)
+        count = 0
+        for start in range(0, len(changed), LOAD_CHUNK_SIZE):
+            count += self._load_rows(Task.objects.filter(id__in=changed[start:start + LOAD_CHUNK_SIZE]), now)
+        return count
+
+    def _load_rows(self, tasks, now):
+        count = 0
+        rows = tasks.order_by().values_list('id', 'is_active', 'completed', 'due_date', 'ai_config', 'last_executed_at')
+        for task_id, is_active, completed, due_date, ai_config, last_executed_at in rows.iterator(chunk_size=2000):
+            count += 1
+            self._load(task_id, is_active and not completed, due_date, ai_config, last_executed_at, now)
+        return count
+
+    def forget(self, task_id):
+        self.unschedule(task_id, 'due')
+        self.unschedule(task_id, 'recurring')
+        self.recurring.pop(task_id, None)
+        self.fired_due.pop(task_id, None)
+
+    def _load(self, task_id, runnable, due_date, ai_config, last_executed_at, now):
+        self.unschedule(task_id, 'due')
+        if (runnable and due_date is not None and self.fired_due.get(task_id) != due_date
+                and (last_executed_at is None or last_executed_at < due_date)):
+            self.schedule(task_id, 'due', due_date)
+
+        spec = ai_config.get('schedule') if runnable and isinstance(ai_config, dict) else None
+        current = self.recurring.get(task_id)
+        if current is not None and current[0] == spec and (task_id, 'recurring') in self.entries:
+            # Unchanged schedule: keep the pending fire time.
+            return
+        self.unschedule(task_id, 'recurring')
+        self.recurring.pop(task_id, None)
+        try:
+            trigger = recurring_trigger({'schedule': spec})
+        except ValueError as e:
+            logger.warning('Ignoring invalid schedule on task %s: %s', task_id, e)
+            return
+        if trigger is not None:
+            self.recurring[task_id] = (spec, trigger)
+            self._schedule_next(task_id, last_executed_at or now, now)
+
+    def _schedule_next(self, task_id, after, now):
+        trigger = self.recurring[task_id][1]
+        if isinstance(trigger, timedelta):
+            when = max(after + trigger, now)
+        else:
+            when = trigger.next_after(max(after, now))
+        if when is not None:
+            self.schedule(task_id, 'recurring', when)
+
+    # Firing
+
+    def fire_due(self, now=None):
+        """Create executions for every trigger that came due; returns the number fired."""
+        now = now or timezone.now()
+        due = self.pop_due(now)
+        if not due:
+            return 0
+        locked = locked_owner_ids()
+        fired = 0
+        for start in range(0, len(due), self.batch_size):
+            batch = due[start:start + self.batch_size]
+            # Tasks deleted or deactivated since they were loaded are dropped here.
+            tasks = Task.objects.filter(id__in={task_id for task_id, _, _ in batch}, is_active=True, completed=False)
+            if locked:
+                # Tasks of users being moved to another shard wait for the move to finish.
+                held = set(tasks.filter(owner_id__in=locked).values_list('id', flat=True))
+                self.held += [entry for entry in batch if entry[0] in held]
+                batch = [entry for entry in batch if entry[0] not in held]
+            runnable = set(tasks.values_list('id', flat=True))
+            fired += self._create_executions([(task_id, when) for task_id, _, when in batch if task_id in runnable])
+            for task_id, kind, when in batch:
+                if kind == 'due':
+                    self.fired_due[task_id] = when
+                elif task_id in runnable and task_id in self.recurring:
+                    self._schedule_next(task_id, when, now)
+        return fired
+
+    def _create_executions(self, triggers):
+        """Create an execution for each ``(task_id, scheduled_for)`` not fired yet; returns how many were created.
+
+        Executions are created without ``ignore_conflicts``, so they get their
+        ids and the outbox records their events.
+        """
+        triggers = list(dict.fromkeys(triggers))
+        if not triggers:
+            return 0
+        fired = set(
+            TaskExecution.objects.filter(
+                task_id__in={task_id for task_id, _ in triggers},
+                scheduled_for__in={when for _, when in triggers},
+            ).values_list('task_id', 'scheduled_for')
+        )
+        new = [(task_id, when) for task_id, when in triggers if (task_id, when) not in fired]
+        using = router.db_for_write(TaskExecution)
+        try:
+            with transaction.atomic(using=using):
+                TaskExecution.objects.bulk_create(
+                    [TaskExecution(task_id=task_id, scheduled_for=when) for task_id, when in new]
+                )
+            return len(new)
+        except IntegrityError:
+            pass
+        # Another scheduler fired some of them in the meantime.
+        created = 0
+        for task_id, when in new:
+            try:
+                with transaction.atomic(using=using):
+                    TaskExecution.objects.create(task_id=task_id, scheduled_for=when)
+                created += 1
+            except IntegrityError:
+                pass
+        return created
+
+    def run(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        next_refresh = timezone.now()
+        while not self.stopping.is_set():
+            now = timezone.now()
+            if now >= next_refresh:
+                self.refresh()
+                next_refresh = now + timedelta(seconds=self.refresh_interval)
+            self.fire_due(now)
+            wake = next_refresh
+            next_due = self.next_due()
+            if next_due is not None and next_due < wake:
+                wake = next_due
+            self.stopping.wait(max(0.0, (wake - timezone.now()).total_seconds()))
+
+    def stop(self, *args):
+        self.stopping.set()
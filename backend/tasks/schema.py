@@ -1,8 +1,13 @@
 import graphene
 from graphene_django import DjangoObjectType
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.utils import timezone
+from taskpilotx.sharding import shard_db
 from .models import Task, TaskExecution
+from .rules import validate_rules
+from .workflow import validate_chain
 
 
 # GraphQL Types
@@ -29,6 +34,53 @@ class TaskInput(graphene.InputObjectType):
     is_active = graphene.Boolean()
     max_executions = graphene.Int()
     ai_config = graphene.JSONString()
+    action_ids = graphene.List(graphene.ID)
+
+
+class TaskBulkInput(graphene.InputObjectType):
+    description = graphene.String()
+    status = graphene.String()
+    priority = graphene.String()
+    due_date = graphene.DateTime()
+    is_active = graphene.Boolean()
+    max_executions = graphene.Int()
+
+
+class TaskResultType(graphene.ObjectType):
+    task_id = graphene.ID()
+    success = graphene.Boolean()
+    errors = graphene.List(graphene.String)
+
+
+def _owned_task_ids(user, task_ids):
+    """Split ``task_ids`` into the ids of the user's tasks and per-ID results for the rest."""
+    requested = {}
+    for task_id in task_ids:
+        try:
+            requested[str(task_id)] = int(task_id)
+        except (TypeError, ValueError):
+            requested[str(task_id)] = None
+    found = set(Task.objects.filter(
+        owner=user, id__in=[pk for pk in requested.values() if pk is not None]
+    ).values_list('id', flat=True))
+    missing = [
+        TaskResultType(task_id=task_id, success=False, errors=['Task not found'])
+        for task_id, pk in requested.items() if pk not in found
+    ]
+    return found, missing
+
+
+def _bulk_update_tasks(user, task_ids, changes):
+    """Apply ``changes`` to the user's tasks in one UPDATE; returns per-ID results."""
+    found, results = _owned_task_ids(user, task_ids)
+    changes = {field: value for field, value in changes.items() if value is not None}
+    if changes.get('status') == 'completed':
+        changes['completed'] = True
+        changes['completed_at'] = timezone.now()
+    if found and changes:
+        # update() skips auto_now; the scheduler and embeddings rely on updated_at.
+        Task.objects.filter(owner=user, id__in=found).update(updated_at=timezone.now(), **changes)
+    return [TaskResultType(task_id=pk, success=True, errors=[]) for pk in sorted(found)] + results
 
 
 # Mutations
@@ -47,19 +99,27 @@ class CreateTask(graphene.Mutation):
             return CreateTask(success=False, errors=['Authentication required'])
 
         try:
-            task = Task.objects.create(
-                owner=user,
-                title=task_data.title,
-                description=task_data.get('description', ''),
-                status=task_data.get('status', 'pending'),
-                priority=task_data.get('priority', 'medium'),
-                prompt=task_data.get('prompt', ''),
-                due_date=task_data.get('due_date'),
-                is_active=task_data.get('is_active', True),
-                max_executions=task_data.get('max_executions', 0),
-                ai_config=task_data.get('ai_config', {})
-            )
+            action_ids = task_data.get('action_ids')
+            validate_rules(task_data.get('ai_config', {}))
+            validate_chain(user.id, None, task_data.get('ai_config', {}), action_ids)
+            with transaction.atomic(using=shard_db()):
+                task = Task.objects.create(
+                    owner=user,
+                    title=task_data.title,
+                    description=task_data.get('description', ''),
+                    status=task_data.get('status', 'pending'),
+                    priority=task_data.get('priority', 'medium'),
+                    prompt=task_data.get('prompt', ''),
+                    due_date=task_data.get('due_date'),
+                    is_active=task_data.get('is_active', True),
+                    max_executions=task_data.get('max_executions', 0),
+                    ai_config=task_data.get('ai_config', {})
+                )
+                if action_ids:
+                    task.actions.set(action_ids)
             return CreateTask(task=task, success=True, errors=[])
+        except ValidationError as e:
+            return CreateTask(success=False, errors=e.messages)
         except Exception as e:
             return CreateTask(success=False, errors=[str(e)])
 
@@ -81,20 +141,35 @@ class UpdateTask(graphene.Mutation):
 
         try:
             task = Task.objects.get(id=task_id, owner=user)
+            action_ids = task_data.get('action_ids')
             
             # Update fields
+            changed = ['updated_at']
             for field, value in task_data.items():
-                if value is not None:
+                if value is not None and field != 'action_ids':
                     setattr(task, field, value)
+                    changed.append(field)
             
             if task_data.get('status') == 'completed':
                 task.completed = True
                 task.completed_at = timezone.now()
-                
-            task.save()
+                changed += ['completed', 'completed_at']
+            
+            if task_data.get('ai_config') is not None:
+                validate_rules(task.ai_config)
+            if action_ids is not None or task_data.get('ai_config') is not None:
+                current_ids = action_ids if action_ids is not None else task.actions.values_list('id', flat=True)
+                validate_chain(user.id, task.id, task.ai_config, list(current_ids))
+            
+            with transaction.atomic(using=shard_db()):
+                task.save(update_fields=changed)
+                if action_ids is not None:
+                    task.actions.set(action_ids)
             return UpdateTask(task=task, success=True, errors=[])
         except Task.DoesNotExist:
             return UpdateTask(success=False, errors=['Task not found'])
+        except ValidationError as e:
+            return UpdateTask(success=False, errors=e.messages)
         except Exception as e:
             return UpdateTask(success=False, errors=[str(e)])
 
@@ -122,6 +197,83 @@ class DeleteTask(graphene.Mutation):
             return DeleteTask(success=False, errors=[str(e)])
 
 
+class UpdateTasks(graphene.Mutation):
+    class Arguments:
+        task_ids = graphene.List(graphene.ID, required=True)
+        task_data = TaskBulkInput(required=True)
+
+    results = graphene.List(TaskResultType)
+    success = graphene.Boolean()
+    errors = graphene.List(graphene.String)
+
+    @staticmethod
+    def mutate(root, info, task_ids, task_data):
+        user = info.context.user
+        if not user.is_authenticated:
+            return UpdateTasks(success=False, errors=['Authentication required'])
+        errors = []
+        if task_data.get('status') is not None and task_data.status not in dict(Task.STATUS_CHOICES):
+            errors.append(f'Invalid status: {task_data.status}')
+        if task_data.get('priority') is not None and task_data.priority not in dict(Task.PRIORITY_CHOICES):
+            errors.append(f'Invalid priority: {task_data.priority}')
+        if errors:
+            return UpdateTasks(success=False, errors=errors)
+
+        try:
+            results = _bulk_update_tasks(user, task_ids, dict(task_data))
+            return UpdateTasks(results=results, success=True, errors=[])
+        except Exception as e:
+            return UpdateTasks(success=False, errors=[str(e)])
+
+
+class SetTasksStatus(graphene.Mutation):
+    class Arguments:
+        task_ids = graphene.List(graphene.ID, required=True)
+        status = graphene.String(required=True)
+
+    results = graphene.List(TaskResultType)
+    success = graphene.Boolean()
+    errors = graphene.List(graphene.String)
+
+    @staticmethod
+    def mutate(root, info, task_ids, status):
+        user = info.context.user
+        if not user.is_authenticated:
+            return SetTasksStatus(success=False, errors=['Authentication required'])
+        if status not in dict(Task.STATUS_CHOICES):
+            return SetTasksStatus(success=False, errors=[f'Invalid status: {status}'])
+
+        try:
+            results = _bulk_update_tasks(user, task_ids, {'status': status})
+            return SetTasksStatus(results=results, success=True, errors=[])
+        except Exception as e:
+            return SetTasksStatus(success=False, errors=[str(e)])
+
+
+class DeleteTasks(graphene.Mutation):
+    class Arguments:
+        task_ids = graphene.List(graphene.ID, required=True)
+
+    results = graphene.List(TaskResultType)
+    success = graphene.Boolean()
+    errors = graphene.List(graphene.String)
+
+    @staticmethod
+    def mutate(root, info, task_ids):
+        user = info.context.user
+        if not user.is_authenticated:
+            return DeleteTasks(success=False, errors=['Authentication required'])
+
+        try:
+            found, results = _owned_task_ids(user, task_ids)
+            if found:
+                Task.objects.filter(owner=user, id__in=found).delete()
+            results = [TaskResultType(task_id=pk, success=True, errors=[]) for pk in sorted(found)] + results
+            return DeleteTasks(results=results, success=True, errors=[])
+        except Exception as e:
+            return DeleteTasks(success=False, errors=[str(e)])
+
+
 # Queries
 class Query(graphene.ObjectType):
     # Task queries
@@ -164,4 +316,7 @@ class Query(graphene.ObjectType):
 class Mutation(graphene.ObjectType):
     create_task = CreateTask.Field()
     update_task = UpdateTask.Field()
-    delete_task = DeleteTask.Field()
\ No newline at end of file
+    delete_task = DeleteTask.Field()
+    update_tasks = UpdateTasks.Field()
+    set_tasks_status = SetTasksStatus.Field()
+    delete_tasks = DeleteTasks.Field()
\ No newline at end of file
@@ -0,0 +1,290 @@
+"""
+Compact in-memory snapshot of tasks for the matching hot path.
+
+Holding millions of tasks as model instances (with their prompt text and JSON
+``ai_config``) costs kilobytes per task. The snapshot keeps only what matching
+needs, column by column in numpy arrays sorted by ``(owner, id)``:
+
+* flags and execution counters, to tell whether a task can run;
+* linked accounts as a 64-bit mask per task, one bit per account of the owner
+  (the rare owner with more than 64 accounts spills into a per-task set);
+* action ids in CSR form (offsets into one flat array);
+* the compiled rules (see ``tasks.rules``) of tasks that declare any
+  (``None`` otherwise), combined per owner into a ``RuleSet`` on demand.
+
+It is built from one ``values_list`` query and then follows the change feed
+(``events.feed``): tasks with new events are reloaded, deleted ones dropped.
+Changes to a task's accounts or actions touch ``updated_at``, which records an
+event for the task too. ``versions`` counts changes to the owner's task
+definitions, which the embeddings and rule sets are rebuilt from; updates of
+only the execution bookkeeping (``COUNTER_FIELDS``) reload the task without
+bumping it.
+"""
+import numpy as np
+from django.db.models import Aggregate, TextField
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from events.feed import ChangeFeed
+from events.outbox import topic
+from .models import Task
+from .rules import RuleSet, compile_rules
+
+
+# Changed tasks reloaded per query
+LOAD_CHUNK_SIZE = 2000
+
+# Updated by every execution; a change to only these leaves prompts and rules as they were
+COUNTER_FIELDS = frozenset({'execution_count', 'last_executed_at', 'updated_at'})
+
+FLAG_ACTIVE = 1
+FLAG_COMPLETED = 2
+
+
+class GroupIds(Aggregate):
+    """Related ids per row: an array on PostgreSQL, a comma-separated string elsewhere."""
+
+    function = 'GROUP_CONCAT'
+    allow_distinct = True
+    output_field = TextField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='ARRAY_AGG', **extra_context)
+
+
+def _ids(value):
+    if not value:
+        return ()
+    if isinstance(value, str):
+        return tuple(int(pk) for pk in value.split(','))
+    return tuple(pk for pk in value if pk is not None)
+
+
+def task_rows(queryset):
+    """Yield snapshot rows for ``queryset``, with related ids aggregated in the same query."""
+    rows = queryset.order_by().annotate(
+        account_ids=GroupIds('linked_accounts', distinct=True),
+        action_ids=GroupIds('actions', distinct=True),
+    ).values_list(
+        'id', 'owner_id', 'is_active', 'completed', 'max_executions', 'execution_count',
+        'ai_config', 'account_ids', 'action_ids',
+    )
+    for pk, owner_id, is_active, completed, max_executions, execution_count, ai_config, accounts, actions in rows.iterator(chunk_size=5000):
+        flags = (FLAG_ACTIVE if is_active else 0) | (FLAG_COMPLETED if completed else 0)
+        yield (pk, owner_id, flags, max_executions, execution_count,
+               _ids(accounts), _ids(actions), compile_rules(ai_config))
+
+
+class TaskSnapshot:
+    __slots__ = (
+        'ids', 'owners', 'flags', 'max_executions', 'execution_counts',
+        'account_masks', 'action_offsets', 'action_ids', 'rules',
+        'account_bits', 'overflow', 'versions', 'rule_sets', 'feed',
+    )
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.owners = np.empty(0, dtype=np.int64)
+        self.flags = np.empty(0, dtype=np.uint8)
+        self.max_executions = np.empty(0, dtype=np.int32)
+        self.execution_counts = np.empty(0, dtype=np.int32)
+        self.account_masks = np.empty(0, dtype=np.uint64)
+        self.action_offsets = np.zeros(1, dtype=np.int64)
+        self.action_ids = np.empty(0, dtype=np.int32)
+        self.rules = []
+        self.account_bits = {}   # owner_id -> {account_id: bit}
+        self.overflow = {}       # task_id -> account ids, for owners past 64 accounts
+        self.versions = {}       # owner_id -> number of changes to the owner's task definitions
+        self.rule_sets = {}      # owner_id -> (version, RuleSet)
+        self.feed = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the columns (not counting compiled rules)."""
+        arrays = (self.ids, self.owners, self.flags, self.max_executions, self.execution_counts,
+                  self.account_masks, self.action_offsets, self.action_ids)
+        return sum(array.nbytes for array in arrays) + 8 * len(self.rules)
+
+    # Loading
+
+    def refresh(self):
+        """Apply task changes since the last refresh; returns the number of tasks loaded."""
+        if self.feed is None:
+            # The feed starts before the full load, so changes made during it are replayed.
+            self.feed = ChangeFeed(topics=[topic(Task)])
+            return self.load(task_rows(Task.objects.filter(is_active=True, completed=False)))
+
+        changed, deleted, redefined = set(), set(), set()
+        for event in self.feed.read_all():
+            (deleted if event.op == 'delete' else changed).add(event.object_id)
+            if event.op != 'update' or not event.fields or not COUNTER_FIELDS.issuperset(event.fields):
+                redefined.add(event.object_id)
+        self.drop(deleted)
+        changed = sorted(changed - deleted)
+        count = 0
+        for start in range(0, len(changed), LOAD_CHUNK_SIZE):
+            rows = task_rows(Task.objects.filter(id__in=changed[start:start + LOAD_CHUNK_SIZE]))
+            count += self.load(rows, redefined=redefined)
+        return count
+
+    def drop(self, task_ids):
+        """Remove the tasks ``task_ids``."""
+        if not task_ids:
+            return
+        dropped = np.isin(self.ids, np.fromiter(task_ids, dtype=np.int64))
+        if dropped.any():
+            for pk in self.ids[dropped]:
+                self.overflow.pop(int(pk), None)
+            self._touch(self.owners[dropped])
+            self._take(np.flatnonzero(~dropped))
+
+    def load(self, rows, redefined=None):
+        """Insert or replace ``rows`` (as produced by ``task_rows``); returns the number loaded.
+
+        Only the owners of tasks in ``redefined`` (of all of them by default)
+        get a new version.
+        """
+        ids, owners, flags, max_executions, counts, masks, lengths, action_ids, rules = ([] for _ in range(9))
+        for pk, owner_id, flag, max_execs, count, accounts, actions, compiled in rows:
+            ids.append(pk)
+            owners.append(owner_id)
+            flags.append(flag)
+            max_executions.append(max_execs)
+            counts.append(count)
+            masks.append(self._account_mask(pk, owner_id, accounts))
+            lengths.append(len(actions))
+            action_ids.extend(actions)
+            rules.append(compiled)
+        if not ids:
+            return 0
+
+        self._touch([owner for pk, owner in zip(ids, owners) if redefined is None or pk in redefined])
+        ids = np.asarray(ids, dtype=np.int64)
+        # Replaced tasks are removed and re-added with their new values.
+        self._take(np.flatnonzero(~np.isin(self.ids, ids)))
+        offsets = np.concatenate(([0], np.cumsum(lengths))) + self.action_offsets[-1]
+        self.ids = np.concatenate((self.ids, ids))
+        self.owners = np.concatenate((self.owners, np.asarray(owners, dtype=np.int64)))
+        self.flags = np.concatenate((self.flags, np.asarray(flags, dtype=np.uint8)))
+        self.max_executions = np.concatenate((self.max_executions, np.asarray(max_executions, dtype=np.int32)))
+        self.execution_counts = np.concatenate((self.execution_counts, np.asarray(counts, dtype=np.int32)))
+        self.account_masks = np.concatenate((self.account_masks, np.asarray(masks, dtype=np.uint64)))
+        self.action_offsets = np.concatenate((self.action_offsets, offsets[1:]))
+        self.action_ids = np.concatenate((self.action_ids, np.asarray(action_ids, dtype=np.int32)))
+        self.rules.extend(rules)
+        self._take(np.lexsort((self.ids, self.owners)))
+        return len(ids)
+
+    def _touch(self, owners):
+        for owner_id in set(np.asarray(owners).tolist()):
+            self.versions[owner_id] = self.versions.get(owner_id, 0) + 1
+
+    def _account_mask(self, task_id, owner_id, accounts):
+        self.overflow.pop(task_id, None)
+        bits = self.account_bits.setdefault(owner_id, {})
+        mask = 0
+        for account_id in accounts:
+            bit = bits.setdefault(account_id, len(bits))
+            if bit >= 64:
+                self.overflow[task_id] = frozenset(accounts)
+                return 0
+            mask |= 1 << bit
+        return mask
+
+    def _take(self, positions):
+        """Keep the rows at ``positions``, in that order."""
+        lengths = np.diff(self.action_offsets)[positions]
+        starts = self.action_offsets[:-1][positions]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        gather = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        self.action_ids = self.action_ids[gather]
+        self.action_offsets = offsets.astype(np.int64)
+        self.ids = self.ids[positions]
+        self.owners = self.owners[positions]
+        self.flags = self.flags[positions]
+        self.max_executions = self.max_executions[positions]
+        self.execution_counts = self.execution_counts[positions]
+        self.account_masks = self.account_masks[positions]
+        self.rules = [self.rules[i] for i in positions]
+
+    # Lookups
+
+    def positions(self, owner_id, task_ids):
+        """Return the positions of the owner's tasks among ``task_ids`` (unknown ids are skipped)."""
+        start, end = np.searchsorted(self.owners, [owner_id, owner_id + 1])
+        task_ids = np.asarray(sorted(task_ids), dtype=np.int64)
+        found = np.searchsorted(self.ids[start:end], task_ids) + start
+        found = found[found < end]
+        return found[np.isin(self.ids[found], task_ids)]
+
+    def runnable(self, positions):
+        """Mask of ``positions`` whose task is active, not completed and under its execution cap."""
+        flags = self.flags[positions]
+        max_executions = self.max_executions[positions]
+        return ((flags & FLAG_ACTIVE) != 0) & ((flags & FLAG_COMPLETED) == 0) & (
+            (max_executions == 0) | (self.execution_counts[positions] < max_executions)
+        )
+
+    def watching(self, owner_id, task_ids, account_id):
+        """Return the runnable tasks among ``task_ids`` watching ``account_id``.
+
+        Tasks watching no account in particular watch all of them.
+        """
+        positions = self.positions(owner_id, task_ids)
+        positions = positions[self.runnable(positions)]
+        bit = self.account_bits.get(owner_id, {}).get(account_id)
+        masks = self.account_masks[positions]
+        watches = masks == 0
+        if bit is not None and bit < 64:
+            watches |= (masks & np.uint64(1 << bit)) != 0
+        result = []
+        for position, watches_account in zip(positions.tolist(), watches.tolist()):
+            task_id = int(self.ids[position])
+            accounts = self.overflow.get(task_id)
+            if accounts is not None:
+                watches_account = account_id in accounts
+            if watches_account:
+                result.append(task_id)
+        return result
+
+    def actions(self, position):
+        return self.action_ids[self.action_offsets[position]:self.action_offsets[position + 1]]
+
+    def rule_set(self, owner_id):
+        """Return the ``RuleSet`` of the owner's runnable tasks, rebuilt only after they change."""
+        version = self.versions.get(owner_id, 0)
+        cached = self.rule_sets.get(owner_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        start, end = np.searchsorted(self.owners, [owner_id, owner_id + 1])
+        positions = np.arange(start, end)
+        rules = {
+            int(self.ids[position]): self.rules[position]
+            for position in positions[self.runnable(positions)].tolist()
+            if self.rules[position] is not None
+        }
+        rule_set = RuleSet(rules)
+        self.rule_sets[owner_id] = (version, rule_set)
+        return rule_set
+
+
+@receiver(m2m_changed, sender=Task.linked_accounts.through)
+@receiver(m2m_changed, sender=Task.actions.through)
+def _touch_tasks(sender, instance, action, reverse, pk_set, **kwargs):
+    """Bump ``updated_at`` of tasks whose accounts or actions changed."""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Task.objects.filter(id=instance.id).update(updated_at=timezone.now())
+        return
+    if action in ('post_add', 'post_remove'):
+        tasks = Task.objects.filter(id__in=pk_set)
+    elif action == 'pre_clear':
+        field = 'linked_accounts' if sender is Task.linked_accounts.through else 'actions'
+        tasks = Task.objects.filter(**{field: instance})
+    else:
+        return
+    tasks.update(updated_at=timezone.now())
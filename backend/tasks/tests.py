@@ -1,3 +1,216 @@
-from django.test import TestCase
+import json
+import time
+from datetime import timedelta
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from actions.models import Action, ActionExecution, ActionType
+from events.models import ChangeEvent
+from events.outbox import topic
+from taskpilotx.sharding import shard_for, use_shard
+from users.tokens import RefreshToken
+from .models import Task, TaskExecution
+from .rules import RuleSet, compile_rules
+from .scheduler import CronSchedule, Scheduler
+from .snapshot import TaskSnapshot
+from .workflow import _create_children, trigger_tasks, validate_chain
+
+
+User = get_user_model()
+
+
+class CronScheduleTests(TestCase):
+    def test_fields(self):
+        cron = CronSchedule('5/15 */6 1-10/3 1,6 7')
+        self.assertEqual(cron.minutes, {5, 20, 35, 50})
+        self.assertEqual(cron.hours, {0, 6, 12, 18})
+        self.assertEqual(cron.days, {1, 4, 7, 10})
+        self.assertEqual(cron.months, {1, 6})
+        self.assertEqual(cron.weekdays, {0})
+
+    def test_invalid_fields(self):
+        for expression in ('60 * * * *', '* * * *', '5-1 * * * *', '* * 0 * *'):
+            with self.assertRaises(ValueError):
+                CronSchedule(expression)
+
+
+class SchedulerTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='scheduler', email='scheduler@example.com', password='x')
+        self.shard = use_shard(shard_for(self.user.pk))
+        self.shard.__enter__()
+        self.addCleanup(self.shard.__exit__, None, None, None)
+
+    def fire(self, now):
+        scheduler = Scheduler()
+        scheduler.refresh()
+        return scheduler.fire_due(now)
+
+    def test_fired_triggers_are_counted_once_and_announced(self):
+        now = timezone.now()
+        tasks = [
+            Task.objects.create(owner=self.user, title=f'due {i}', prompt='p', due_date=now - timedelta(minutes=i))
+            for i in range(1, 3)
+        ]
+        self.assertEqual(self.fire(now), 2)
+        executions = TaskExecution.objects.filter(task__in=tasks)
+        self.assertEqual(executions.count(), 2)
+        announced = ChangeEvent.objects.filter(topic=topic(TaskExecution), op='create')
+        self.assertEqual(
+            sorted(announced.values_list('object_id', flat=True)), sorted(executions.values_list('id', flat=True)),
+        )
+
+        # A restarted scheduler finds the same triggers due, but they already fired.
+        self.assertEqual(self.fire(now), 0)
+        self.assertEqual(TaskExecution.objects.count(), 2)
+        self.assertEqual(announced.count(), 2)
+
+
+class TaskSnapshotTests(TestCase):
+    databases = '__all__'
+
+    def test_executions_do_not_bump_the_owner_version(self):
+        user = User.objects.create_user(username='snapshot', email='snapshot@example.com', password='x')
+        with use_shard(shard_for(user.pk)):
+            task = Task.objects.create(owner=user, title='t', prompt='invoices')
+            snapshot = TaskSnapshot()
+            snapshot.refresh()
+            version = snapshot.versions[user.pk]
+
+            now = timezone.now()
+            Task.objects.filter(id=task.id).update(
+                execution_count=F('execution_count') + 1, last_executed_at=now, updated_at=now
+            )
+            snapshot.refresh()
+            self.assertEqual(snapshot.versions[user.pk], version)
+            self.assertEqual(snapshot.execution_counts.tolist(), [1])
+
+            Task.objects.filter(id=task.id).update(prompt='receipts', updated_at=now)
+            snapshot.refresh()
+            self.assertEqual(snapshot.versions[user.pk], version + 1)
+
+
+@override_settings(NEW_USER_SHARDS=['default'], TASK_CHAIN_MAX_DEPTH=8, TASK_CHAIN_MAX_FANOUT=16)
+class WorkflowTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='chains', email='chains@example.com', password='x')
+        self.trigger = Action.objects.create(name='Chain', action_type=ActionType.TRIGGER_TASK, description='Chain')
+        self.a, self.b, self.c, self.d = (
+            Task.objects.create(owner=self.user, title=title, prompt='p') for title in 'abcd'
+        )
+
+    def chain(self, task, *targets):
+        task.ai_config = self.chain_config(*targets)
+        task.save()
+        task.actions.add(self.trigger)
+
+    def chain_config(self, *targets):
+        return {'action_config': {str(self.trigger.pk): {'task_ids': [target.pk for target in targets]}}}
+
+    def run_chain(self, task_execution, *targets):
+        execution = ActionExecution(
+            action=self.trigger, executed_by=self.user, triggering_task=task_execution.task,
+            config_data={'task_ids': [target.pk for target in targets]},
+        )
+        return trigger_tasks(execution, task_execution=task_execution)
+
+    def test_cycles_are_rejected_when_configured(self):
+        self.chain(self.a, self.b)
+        self.chain(self.b, self.c)
+        with self.assertRaisesMessage(ValidationError, 'Task chain would create a cycle'):
+            validate_chain(self.user.pk, self.c.pk, self.chain_config(self.a), [self.trigger.pk])
+        validate_chain(self.user.pk, self.c.pk, self.chain_config(self.d), [self.trigger.pk])
+
+    @override_settings(TASK_CHAIN_MAX_DEPTH=1)
+    def test_chains_stop_at_the_depth_limit(self):
+        self.chain(self.a, self.b)
+        self.chain(self.b, self.c)
+        result = self.run_chain(TaskExecution.objects.create(task=self.a), self.b)
+        child = TaskExecution.objects.get(pk=result['task_execution_ids'][0])
+        self.assertEqual(child.depth, 1)
+        with self.assertRaisesMessage(ValueError, 'Task chain is deeper than 1'):
+            self.run_chain(child, self.c)
+        self.assertFalse(TaskExecution.objects.filter(task=self.c).exists())
+
+    def test_diamond_runs_each_task_once(self):
+        self.chain(self.a, self.b, self.c)
+        self.chain(self.b, self.d)
+        self.chain(self.c, self.d)
+        root = TaskExecution.objects.create(task=self.a)
+        result = self.run_chain(root, self.b, self.c)
+        b, c = TaskExecution.objects.filter(pk__in=result['task_execution_ids']).order_by('task_id')
+
+        self.assertEqual(self.run_chain(b, self.d)['triggered_task_ids'], [self.d.pk])
+        result = self.run_chain(c, self.d)
+        self.assertEqual((result['triggered_task_ids'], result['skipped_task_ids']), ([], [self.d.pk]))
+        self.assertEqual(TaskExecution.objects.filter(task=self.d, root=root).count(), 1)
+
+        # A branch that queues the same task at the same moment loses on the constraint.
+        self.assertEqual(_create_children([TaskExecution(task=self.d, parent=c, root=root, depth=2)]), [])
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class UpdateTasksTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='bulk', email='bulk@example.com', password='x')
+        with use_shard(shard_for(self.user.pk)):
+            self.task = Task.objects.create(owner=self.user, title='bulk', prompt='p')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+
+    def update(self, **task_data):
+        query = '''
+        mutation($ids: [ID]!, $data: TaskBulkInput!) {
+          updateTasks(taskIds: $ids, taskData: $data) { success errors }
+        }
+        '''
+        variables = {'ids': [str(self.task.pk)], 'data': task_data}
+        response = self.client.post(
+            '/api/graphql/', json.dumps({'query': query, 'variables': variables}), content_type='application/json',
+        )
+        return response.json()['data']['updateTasks']
+
+    def test_status_and_priority_must_be_known(self):
+        result = self.update(status='bogus', priority='extreme')
+        self.assertEqual(result, {'success': False, 'errors': ['Invalid status: bogus', 'Invalid priority: extreme']})
+        with use_shard(shard_for(self.user.pk)):
+            self.task.refresh_from_db()
+        self.assertEqual((self.task.status, self.task.priority), ('pending', 'medium'))
+
+        self.assertTrue(self.update(status='paused', priority='high')['success'])
+        with use_shard(shard_for(self.user.pk)):
+            self.task.refresh_from_db()
+        self.assertEqual((self.task.status, self.task.priority), ('paused', 'high'))
+
+
+@override_settings(TASK_RULES_TEXT_CHARS=100, TASK_RULES_REGEX_TIMEOUT=0.05)
+class RuleTests(SimpleTestCase):
+    def evaluate(self, condition, content):
+        message = SimpleNamespace(
+            title='hello', content=content, content_hash='', sender_info={'email': 'a@acme.com'},
+            priority='medium', source_account_id=1, source_account=SimpleNamespace(service_name='gmail'),
+        )
+        rules = compile_rules({'rules': {'conditions': [condition]}})
+        return RuleSet({1: rules}).evaluate(message)
+
+    def test_only_the_start_of_the_body_is_matched(self):
+        condition = {'field': 'content', 'op': 'contains_any', 'value': ['invoice']}
+        self.assertEqual(self.evaluate(condition, 'invoice ' + 'x' * 200), {1: None})
+        self.assertEqual(self.evaluate(condition, 'x' * 200 + ' invoice'), {})
+
+    def test_runaway_regex_is_stopped(self):
+        condition = {'field': 'content', 'op': 'regex', 'value': '(a|aa)+$'}
+        start = time.monotonic()
+        with self.assertLogs('tasks.rules', 'WARNING'):
+            self.assertEqual(self.evaluate(condition, 'a' * 99 + '!'), {})
+        self.assertLess(time.monotonic() - start, 1)
@@ -0,0 +1,297 @@
+"""
+Task chaining.
+
+A task chains to other tasks through a ``TRIGGER_TASK`` action whose config
+(``ai_config['action_config'][<action id>]``) names the targets::
+
+    {"action_config": {"7": {"task_ids": [12, 13]}}}
+
+The chains of a user's tasks form a graph that must stay acyclic. It is
+compiled once per user, cached in-process and recompiled after any change to
+the user's tasks or to actions; the version stamps live in the Django cache so
+every process notices. Saves that would close a cycle are rejected.
+
+At run time the handler queues a pending ``TaskExecution`` per target, so
+independent branches are picked up by separate workers in parallel. Every
+execution of a chain points to the chain's first one (``root``), and a task
+runs at most once per chain, so the branches of a diamond meet in one run.
+Depth and fan-out are capped by ``TASK_CHAIN_MAX_DEPTH`` and
+``TASK_CHAIN_MAX_FANOUT``.
+"""
+import threading
+import uuid
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, router, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from actions.handlers import register
+from actions.models import Action, ActionType
+from .models import Task, TaskExecution
+
+
+ACTIONS_VERSION_KEY = 'task-graph:actions'
+MAX_CACHED_GRAPHS = 1024
+
+
+def chain_targets(config):
+    """Return the task ids named by one TRIGGER_TASK action config."""
+    if not isinstance(config, dict):
+        return []
+    targets = config.get('task_ids') or []
+    if config.get('task_id') is not None:
+        targets = [config['task_id'], *targets]
+    try:
+        return list(dict.fromkeys(int(target) for target in targets))
+    except (TypeError, ValueError):
+        raise ValidationError('Chained task ids must be integers')
+
+
+def task_targets(ai_config, trigger_action_ids):
+    """Return the task ids a task chains to through its TRIGGER_TASK actions."""
+    action_config = ai_config.get('action_config', {}) if isinstance(ai_config, dict) else {}
+    targets = []
+    for action_id in sorted(trigger_action_ids):
+        targets += chain_targets(action_config.get(str(action_id)))
+    return list(dict.fromkeys(targets))
+
+
+class TaskGraph:
+    """Chain edges between one user's tasks."""
+
+    __slots__ = ('nodes', 'edges', 'order', 'blocked')
+
+    def __init__(self, nodes, edges):
+        self.nodes = frozenset(nodes)
+        self.edges = {source: tuple(targets) for source, targets in edges.items() if targets}
+        self.order, self.blocked = self._sort()
+
+    def successors(self, task_id):
+        return self.edges.get(task_id, ())
+
+    def _sort(self):
+        # Kahn's algorithm; whatever cannot be ordered is on or behind a cycle.
+        indegree = dict.fromkeys(self.nodes, 0)
+        for targets in self.edges.values():
+            for target in targets:
+                indegree[target] += 1
+        ready = deque(node for node, degree in indegree.items() if degree == 0)
+        order = []
+        while ready:
+            node = ready.popleft()
+            order.append(node)
+            for target in self.successors(node):
+                indegree[target] -= 1
+                if indegree[target] == 0:
+                    ready.append(target)
+        return tuple(order), frozenset(node for node, degree in indegree.items() if degree)
+
+    def find_cycle(self):
+        """Return one cycle as a list of task ids (first repeated last), or ``None``."""
+        if not self.blocked:
+            return None
+        predecessors = {}
+        for source, targets in self.edges.items():
+            if source in self.blocked:
+                for target in targets:
+                    if target in self.blocked:
+                        predecessors.setdefault(target, source)
+        # Every blocked node has a blocked predecessor, so walking back must repeat.
+        path, seen = [], {}
+        node = next(iter(self.blocked))
+        while node not in seen:
+            seen[node] = len(path)
+            path.append(node)
+            node = predecessors[node]
+        cycle = path[seen[node]:]
+        cycle.reverse()
+        return cycle + [cycle[0]]
+
+    def with_targets(self, task_id, targets):
+        """Return a copy of the graph with ``task_id`` chaining to ``targets`` instead."""
+        edges = dict(self.edges)
+        edges[task_id] = tuple(targets)
+        return TaskGraph(self.nodes | {task_id}, edges)
+
+
+def compile_graph(owner_id):
+    nodes = set(Task.objects.filter(owner_id=owner_id).values_list('id', flat=True))
+    links = Task.actions.through.objects.filter(
+        task__owner_id=owner_id, action__action_type=ActionType.TRIGGER_TASK
+    ).values_list('task_id', 'action_id', 'task__ai_config')
+
+    trigger_actions, configs = {}, {}
+    for task_id, action_id, ai_config in links:
+        trigger_actions.setdefault(task_id, set()).add(action_id)
+        configs[task_id] = ai_config
+    edges = {}
+    for task_id, action_ids in trigger_actions.items():
+        try:
+            targets = task_targets(configs[task_id], action_ids)
+        except ValidationError:
+            targets = []
+        # Targets that are gone or belong to someone else are never triggered.
+        edges[task_id] = [target for target in targets if target in nodes]
+    return TaskGraph(nodes, edges)
+
+
+# Per-process cache of compiled graphs
+
+_graphs = OrderedDict()  # owner_id -> (version, TaskGraph)
+_lock = threading.Lock()
+
+
+def _version_key(owner_id):
+    return f'task-graph:{owner_id}'
+
+
+def get_graph(owner_id):
+    versions = cache.get_many([_version_key(owner_id), ACTIONS_VERSION_KEY])
+    version = (versions.get(_version_key(owner_id)), versions.get(ACTIONS_VERSION_KEY))
+    with _lock:
+        cached = _graphs.get(owner_id)
+        if cached is not None and cached[0] == version:
+            _graphs.move_to_end(owner_id)
+            return cached[1]
+
+    # Compiled outside the lock; the version was read first, so a change made
+    # while compiling makes the next lookup compile again.
+    graph = compile_graph(owner_id)
+    with _lock:
+        _graphs[owner_id] = (version, graph)
+        _graphs.move_to_end(owner_id)
+        while len(_graphs) > MAX_CACHED_GRAPHS:
+            _graphs.popitem(last=False)
+    return graph
+
+
+def invalidate(owner_id=None):
+    """Drop the compiled graph of ``owner_id``, or of every user when ``None``."""
+    cache.set(_version_key(owner_id) if owner_id is not None else ACTIONS_VERSION_KEY, uuid.uuid4().hex, None)
+    with _lock:
+        if owner_id is None:
+            _graphs.clear()
+        else:
+            _graphs.pop(owner_id, None)
+
+
+@receiver([post_save, post_delete], sender=Task)
+def _task_changed(sender, instance, **kwargs):
+    invalidate(instance.owner_id)
+
+
+@receiver(m2m_changed, sender=Task.actions.through)
+def _task_actions_changed(sender, instance, action, reverse, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate(None if reverse else instance.owner_id)
+
+
+@receiver([post_save, post_delete], sender=Action)
+def _action_changed(sender, instance, **kwargs):
+    invalidate()
+
+
+# Validation
+
+def validate_chain(owner_id, task_id, ai_config, action_ids):
+    """Raise ``ValidationError`` if these chain settings are invalid for the task.
+
+    ``task_id`` is ``None`` for a task that is not saved yet.
+    """
+    trigger_ids = set(Action.objects.filter(
+        id__in=action_ids, action_type=ActionType.TRIGGER_TASK
+    ).values_list('id', flat=True)) if action_ids else set()
+    targets = task_targets(ai_config, trigger_ids)
+    if not targets:
+        return
+
+    graph = get_graph(owner_id)
+    unknown = [target for target in targets if target not in graph.nodes]
+    if unknown:
+        raise ValidationError(f'Chained tasks not found: {", ".join(map(str, unknown))}')
+    if task_id is None:
+        # Nothing can chain to a task that does not exist yet.
+        return
+    cycle = graph.with_targets(int(task_id), targets).find_cycle()
+    if cycle:
+        raise ValidationError(f'Task chain would create a cycle: {" -> ".join(map(str, cycle))}')
+
+
+# Execution
+
+@register(ActionType.TRIGGER_TASK)
+def trigger_tasks(execution, message=None, task_execution=None):
+    targets = chain_targets(execution.config_data)
+    if not targets:
+        raise ValueError('No task to trigger: set task_id or task_ids in the action config')
+
+    depth = task_execution.depth + 1 if task_execution is not None else 0
+    if depth > settings.TASK_CHAIN_MAX_DEPTH:
+        raise ValueError(f'Task chain is deeper than {settings.TASK_CHAIN_MAX_DEPTH}')
+
+    graph = get_graph(execution.executed_by_id)
+    source = execution.triggering_task_id
+    if source in graph.blocked:
+        # Only possible when chains were edited without validation (e.g. in the admin).
+        raise ValueError(f'Task {source} is part of a chain cycle')
+
+    runnable = set(Task.objects.filter(
+        id__in=targets, owner_id=execution.executed_by_id, is_active=True, completed=False
+    ).values_list('id', flat=True))
+    root_id = (task_execution.root_id or task_execution.id) if task_execution is not None else None
+    if root_id is not None:
+        # Reached by another branch of the chain already.
+        reached = TaskExecution.objects.filter(root_id=root_id, task_id__in=runnable)
+        runnable -= set(reached.values_list('task_id', flat=True))
+    triggered = [target for target in targets if target in runnable]
+    skipped = [target for target in targets if target not in runnable]
+    if len(triggered) > settings.TASK_CHAIN_MAX_FANOUT:
+        skipped += triggered[settings.TASK_CHAIN_MAX_FANOUT:]
+        triggered = triggered[:settings.TASK_CHAIN_MAX_FANOUT]
+
+    children = _create_children([
+        TaskExecution(
+            task_id=target,
+            triggering_message=message,
+            parent=task_execution,
+            root_id=root_id,
+            depth=depth,
+        )
+        for target in triggered
+    ])
+    created = {child.task_id for child in children}
+    skipped += [target for target in triggered if target not in created]
+    triggered = [target for target in triggered if target in created]
+    return {
+        'triggered_task_ids': triggered,
+        'task_execution_ids': [child.id for child in children],
+        'skipped_task_ids': skipped,
+    }
+
+
+def _create_children(children):
+    """Create the chained executions ``children``; returns the ones created.
+
+    They are created without ``ignore_conflicts``, so they get their ids and
+    the outbox records their events.
+    """
+    using = router.db_for_write(TaskExecution)
+    try:
+        with transaction.atomic(using=using):
+            return TaskExecution.objects.bulk_create(children)
+    except IntegrityError:
+        pass
+    # A parallel branch of the chain queued some of them in the meantime.
+    created = []
+    for child in children:
+        try:
+            with transaction.atomic(using=using):
+                child.save(force_insert=True)
+            created.append(child)
+        except IntegrityError:
+            pass
+    return created
@@ -3,4 +3,12 @@ from django.apps import AppConfig
 
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'users'
\ No newline at end of file
+    name = 'users'
+
+    def ready(self):
+        # Places new users on a shard and keeps their shard copies current.
+        from taskpilotx.sharding import connect_receivers
+        connect_receivers()
+        # Forgets a saved user's cached token state (users/tokens.py).
+        from .signals import connect_receivers as connect_token_receivers
+        connect_token_receivers()
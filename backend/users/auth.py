@@ -0,0 +1,89 @@
+"""
+Password authentication.
+
+Hashing is deliberately slow and memory hungry (Argon2, see ``users.hashers``),
+so it runs in a small pool of its own threads instead of wherever the request
+happens to be: at most ``PASSWORD_HASHING_THREADS`` hashes run at once, and
+at most ``PASSWORD_HASHING_QUEUE`` more wait for a thread. Requests beyond that
+fail fast with ``AuthBusy`` rather than tying up every request worker (and
+their memory) during a burst of logins. argon2 releases the GIL while hashing,
+so the pool's threads run in parallel with the request threads.
+
+Logins look the user up once and verify the password against the loaded row;
+hashes made with an older hasher or cost are replaced after a successful login.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password, verify_password
+
+
+class AuthBusy(Exception):
+    """Too many password hashes are queued; the client should retry later."""
+
+
+class HashingPool:
+    def __init__(self, threads=None, queue=None, timeout=None):
+        threads = threads or settings.PASSWORD_HASHING_THREADS
+        self.timeout = settings.PASSWORD_HASHING_TIMEOUT if timeout is None else timeout
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='password-hashing')
+        self.slots = threading.BoundedSemaphore(threads + (settings.PASSWORD_HASHING_QUEUE if queue is None else queue))
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise AuthBusy('Too many login attempts in progress; try again shortly')
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    """Process-wide pool sized by ``PASSWORD_HASHING_THREADS``."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HashingPool()
+    return _pool
+
+
+def hash_password(password):
+    return get_hashing_pool().run(make_password, password)
+
+
+def authenticate(password, email=None, username=None):
+    """Return the active user with ``email`` (or ``username``) and ``password``, or None."""
+    User = get_user_model()
+    lookup = {'email': email} if email else {User.USERNAME_FIELD: username}
+    user = User._default_manager.filter(**lookup).order_by('pk').first() if email or username else None
+    # Unknown users still cost one hash, so response times do not reveal who exists.
+    is_correct, must_update = get_hashing_pool().run(verify_password, password, user.password if user else None)
+    if not is_correct or not user.is_active:
+        return None
+    if must_update:
+        user.password = hash_password(password)
+        user.save(update_fields=['password'])
+    return user
+
+
+def create_user(username, email, password, **extra_fields):
+    """Create a user like ``UserManager.create_user``, hashing in the pool."""
+    User = get_user_model()
+    manager = User._default_manager
+    user = User(
+        username=User.normalize_username(username),
+        email=manager.normalize_email(email),
+        **extra_fields,
+    )
+    user.password = hash_password(password)
+    user.save(using=manager.db)
+    return user
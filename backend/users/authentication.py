@@ -0,0 +1,28 @@
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .tokens import USERNAME_CLAIM, VERSION_CLAIM, check_version
+
+
+class TokenUserAuthentication(JWTAuthentication):
+    """
+    JWT authentication that builds the user from the token's claims instead of
+    loading it (see users/tokens.py). Tokens issued without the claims, or any
+    token with TOKEN_CLAIMS_USER off, load the user as before.
+    """
+
+    def get_user(self, validated_token):
+        if not settings.TOKEN_CLAIMS_USER or USERNAME_CLAIM not in validated_token:
+            user = super().get_user(validated_token)
+            if validated_token.get(VERSION_CLAIM, 0) != user.token_version:
+                raise InvalidToken('Token has been revoked')
+            return user
+
+        try:
+            user_id = self.user_model._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError as e:
+            raise InvalidToken('Token contained no recognizable user identification') from e
+        check_version(validated_token)
+        return self.user_model.from_token(user_id, validated_token[USERNAME_CLAIM])
@@ -0,0 +1,161 @@
+"""
+Blacklist of refresh tokens.
+
+A refresh token is revoked when it is rotated (``BLACKLIST_AFTER_ROTATION``):
+its ``jti`` goes into ``RevokedToken`` as a 16 byte UUID, together with the
+token's expiry. Only revoked tokens are stored, never every token issued, and
+rows are deleted once the token has expired anyway, so the table holds at most
+one refresh lifetime's worth of rotations. Expired rows are purged every
+``TOKEN_BLACKLIST_PURGE_SECONDS`` by whichever process revokes next.
+
+Checks go through a Bloom filter of the revoked ids kept in each process; only
+ids it may contain are looked up in the table, so refreshing a valid token
+costs no read. The filter picks up revocations of other processes every
+``TOKEN_BLACKLIST_SYNC_SECONDS`` and is rebuilt from the table (dropping expired
+ids) every ``TOKEN_BLACKLIST_REBUILD_SECONDS``. Revocation itself is an INSERT
+into a unique index, so of two requests rotating the same token only one wins,
+however stale the filters are.
+"""
+import math
+import threading
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import RevokedToken
+
+
+def _jti_uuid(jti):
+    try:
+        return uuid.UUID(hex=jti)
+    except (TypeError, ValueError):
+        return uuid.uuid5(uuid.NAMESPACE_OID, str(jti))
+
+
+class BloomFilter:
+    """Set membership with false positives only, sized for ``capacity`` random UUIDs."""
+
+    def __init__(self, capacity, false_positive_rate=0.01):
+        self.size = max(64, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.offsets = np.arange(self.hashes, dtype=np.uint64)
+
+    def _positions(self, ids):
+        # jtis are random, so their halves serve as the two base hashes
+        # (Kirsch-Mitzenmacher double hashing).
+        raw = np.frombuffer(b''.join(value.bytes for value in ids), dtype=np.uint64).reshape(-1, 2)
+        h1, h2 = raw[:, :1], raw[:, 1:] | np.uint64(1)
+        return (h1 + self.offsets * h2) % np.uint64(self.size)
+
+    def add(self, ids):
+        if not ids:
+            return
+        positions = self._positions(ids).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def __contains__(self, value):
+        positions = self._positions([value])[0]
+        return bool(np.all(self.bits[positions >> np.uint64(3)] & np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)))
+
+
+class TokenBlacklist:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = None
+        self.last_id = 0
+        self.synced_at = self.built_at = self.purged_at = 0.0
+
+    def _rows(self):
+        return RevokedToken.objects.using('default')
+
+    def _rebuild(self):
+        bloom = BloomFilter(settings.TOKEN_BLACKLIST_CAPACITY, settings.TOKEN_BLACKLIST_FALSE_POSITIVE_RATE)
+        # Rows after last_id are picked up by the next sync.
+        last_id = self._rows().order_by('-id').values_list('id', flat=True).first() or 0
+        rows = self._rows().filter(id__lte=last_id, expires_at__gt=timezone.now()).values_list('jti', flat=True)
+        batch = []
+        for jti in rows.iterator(chunk_size=10000):
+            batch.append(jti)
+            if len(batch) >= 10000:
+                bloom.add(batch)
+                batch = []
+        bloom.add(batch)
+        self.filter, self.last_id = bloom, last_id
+        self.built_at = self.synced_at = time.monotonic()
+
+    def _sync(self):
+        now = time.monotonic()
+        if self.filter is None or now - self.built_at > settings.TOKEN_BLACKLIST_REBUILD_SECONDS:
+            self._rebuild()
+        elif now - self.synced_at > settings.TOKEN_BLACKLIST_SYNC_SECONDS:
+            rows = list(self._rows().filter(id__gt=self.last_id).order_by('id').values_list('id', 'jti'))
+            if rows:
+                self.filter.add([jti for _, jti in rows])
+                self.last_id = rows[-1][0]
+            self.synced_at = now
+
+    def warm(self):
+        """Load the filter now rather than on the first refresh."""
+        with self.lock:
+            self._sync()
+
+    def is_revoked(self, jti):
+        value = _jti_uuid(jti)
+        with self.lock:
+            self._sync()
+            if value not in self.filter:
+                return False
+        return self._rows().filter(jti=value).exists()
+
+    def revoke(self, jti, expires_at):
+        """Blacklist ``jti``; returns False if it already was (another request revoked it first)."""
+        value = _jti_uuid(jti)
+        try:
+            with transaction.atomic(using='default'):
+                RevokedToken.objects.using('default').create(jti=value, expires_at=expires_at)
+        except IntegrityError:
+            return False
+        with self.lock:
+            if self.filter is not None:
+                self.filter.add([value])
+        self._purge_if_due()
+        return True
+
+    def _purge_if_due(self):
+        now = time.monotonic()
+        if now - self.purged_at < settings.TOKEN_BLACKLIST_PURGE_SECONDS:
+            return
+        self.purged_at = now
+        purge_expired()
+
+
+def purge_expired(chunk_size=10000):
+    """Delete rows of tokens that have expired; returns the count."""
+    rows = RevokedToken.objects.using('default')
+    deleted = 0
+    while True:
+        ids = list(rows.filter(expires_at__lte=timezone.now()).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        deleted += rows.filter(id__in=ids).delete()[0]
+
+
+def token_expiry(token):
+    return datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc)
+
+
+_blacklist = None
+
+
+def get_blacklist():
+    """Process-wide blacklist with its Bloom filter."""
+    global _blacklist
+    if _blacklist is None:
+        _blacklist = TokenBlacklist()
+    return _blacklist
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from taskpilotx.sharding import ShardMoveError, move_user
+
+
+class Command(BaseCommand):
+    help = "Move a user's data to another database shard"
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', type=int)
+        parser.add_argument('shard', choices=settings.DATABASE_SHARDS)
+        parser.add_argument('--drain-timeout', type=float, default=60.0,
+                            help='Seconds to wait for work in flight before giving up')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows copied per INSERT')
+
+    def handle(self, *args, **options):
+        try:
+            moved = move_user(
+                options['user_id'], options['shard'],
+                drain_timeout=options['drain_timeout'], batch_size=options['batch_size'], log=self.stdout.write,
+            )
+        except ShardMoveError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Moved {moved} rows of user {options['user_id']} to {options['shard']}")
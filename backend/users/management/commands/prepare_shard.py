@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from taskpilotx.sharding import prepare_shard
+
+
+class Command(BaseCommand):
+    help = 'Set up the id range and action catalog of a database shard (run after migrate --database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shard', choices=settings.DATABASE_SHARDS)
+
+    def handle(self, *args, **options):
+        prepare_shard(options['shard'])
+        self.stdout.write(f"Shard {options['shard']} is ready")
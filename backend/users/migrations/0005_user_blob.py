@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_revoked_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('blob_hash', models.CharField(max_length=64)),
+                ('stored_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'blob_hash')},
+            },
+        ),
+    ]
@@ -8,10 +8,61 @@ class User(AbstractUser):
     display_name = models.CharField(max_length=100, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Part of every token issued; bumping it revokes them all (see users/tokens.py)
+    token_version = models.PositiveIntegerField(default=0)
     
+    @classmethod
+    def from_token(cls, user_id, username):
+        """A user built from token claims; its other fields load on first use, together."""
+        user = cls.from_db('default', ['id', 'username'], [user_id, username])
+        user._from_token = True
+        return user
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        if fields is not None and self.__dict__.pop('_from_token', False):
+            # The first deferred field needed loads all of them in one query.
+            fields = {*fields, *self.get_deferred_fields()}
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+
     def __str__(self):
         return self.display_name or self.username
     
     @property
     def full_name(self):
-        return f"{self.first_name} {self.last_name}".strip() or self.username
\ No newline at end of file
+        return f"{self.first_name} {self.last_name}".strip() or self.username
+
+
+class ShardAssignment(models.Model):
+    """Database shard holding a user's data (see taskpilotx/sharding.py)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='shard_assignment')
+    alias = models.CharField(max_length=50, db_index=True)
+    # Set while the user's data is being moved between shards
+    locked = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.alias}"
+
+
+class RevokedToken(models.Model):
+    """Refresh token that may not be used again, kept until it expires (see users/blacklist.py)."""
+    jti = models.UUIDField(unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return str(self.jti)
+
+
+
+class UserBlob(models.Model):
+    """Blob a user stored; only its owners may reference it (see taskpilotx/blobs.py)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blobs')
+    blob_hash = models.CharField(max_length=64)
+    # Refreshed each time the user stores the content again
+    stored_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'blob_hash')
+
+    def __str__(self):
+        return f"{self.user_id}: {self.blob_hash}"
@@ -1,10 +1,10 @@
 import graphene
 from graphene_django import DjangoObjectType
-from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from rest_framework_simplejwt.tokens import RefreshToken
+from .auth import authenticate, create_user
 from .models import User
+from .tokens import RefreshToken, revoke_tokens
 
 
 # GraphQL Types
@@ -56,7 +56,7 @@ class Register(graphene.Mutation):
                 return Register(success=False, errors=['Email already exists'])
 
             # Create user
-            user = User.objects.create_user(
+            user = create_user(
                 username=user_data.username,
                 email=user_data.email,
                 password=user_data.password,
@@ -97,17 +97,12 @@ class Login(graphene.Mutation):
     @staticmethod
     def mutate(root, info, credentials):
         try:
-            # Try to authenticate with email or username
-            user = None
-            
-            if credentials.get('email'):
-                try:
-                    user_obj = User.objects.get(email=credentials.email)
-                    user = authenticate(username=user_obj.username, password=credentials.password)
-                except User.DoesNotExist:
-                    pass
-            elif credentials.get('username'):
-                user = authenticate(username=credentials.username, password=credentials.password)
+            # Authenticate with email or username
+            user = authenticate(
+                credentials.password,
+                email=credentials.get('email'),
+                username=credentials.get('username'),
+            )
 
             if user is None:
                 return Login(success=False, errors=['Invalid credentials'])
@@ -129,6 +124,32 @@ class Login(graphene.Mutation):
             return Login(success=False, errors=[str(e)])
 
 
+class RevokeTokens(graphene.Mutation):
+    """Sign out everywhere: invalidate all tokens of the user and issue new ones."""
+    access_token = graphene.String()
+    refresh_token = graphene.String()
+    success = graphene.Boolean()
+    errors = graphene.List(graphene.String)
+
+    @staticmethod
+    def mutate(root, info):
+        user = info.context.user
+        if not user.is_authenticated:
+            return RevokeTokens(success=False, errors=['Authentication required'])
+
+        try:
+            revoke_tokens(user)
+            refresh = RefreshToken.for_user(user)
+            return RevokeTokens(
+                access_token=str(refresh.access_token),
+                refresh_token=str(refresh),
+                success=True,
+                errors=[]
+            )
+        except Exception as e:
+            return RevokeTokens(success=False, errors=[str(e)])
+
+
 # Queries
 class Query(graphene.ObjectType):
     me = graphene.Field(UserType)
@@ -150,4 +171,5 @@ class Query(graphene.ObjectType):
 # Mutations
 class Mutation(graphene.ObjectType):
     register = Register.Field()
-    login = Login.Field()
\ No newline at end of file
+    login = Login.Field()
+    revoke_tokens = RevokeTokens.Field()
\ No newline at end of file
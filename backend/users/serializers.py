@@ -1,6 +1,9 @@
 from rest_framework import serializers
-from django.contrib.auth.models import User
+from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
+from .auth import create_user
+
+User = get_user_model()
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -32,7 +35,7 @@ class RegisterSerializer(serializers.ModelSerializer):
         # Remove password2 as it's not needed for user creation
         validated_data.pop('password2')
         
-        user = User.objects.create_user(
+        user = create_user(
             username=validated_data['email'],  # Use email as username
             email=validated_data['email'],
             first_name=validated_data['first_name'],
@@ -0,0 +1,25 @@
+"""
+Receivers keeping the cached token state of users current.
+
+Kept apart from ``users.tokens`` so that connecting them in ``ready()`` does
+not import simplejwt and DRF into processes that never handle a token.
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+
+def token_state_key(user_id):
+    """Cache key of ``(token_version, is_active)`` of ``user_id`` (see ``users.tokens``)."""
+    return f'token-state:{user_id}'
+
+
+def _user_saved(sender, instance, using, raw=False, **kwargs):
+    # Deactivating a user stops their tokens at once, not when the cached state expires.
+    if using == 'default' and not raw:
+        cache.delete(token_state_key(instance.pk))
+
+
+def connect_receivers():
+    from django.db.models.signals import post_save
+
+    post_save.connect(_user_saved, sender=get_user_model(), dispatch_uid='tokens-user-saved')
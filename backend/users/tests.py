@@ -1,3 +1,323 @@
-from django.test import TestCase
+import json
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
\ No newline at end of file
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+
+from accounts.models import LinkedAccount
+from events.models import ChangeEvent
+from messages_app.models import Message
+from tasks.models import Task
+from taskpilotx import ratelimit
+from taskpilotx.sharding import SHARD_ID_BITS, prepare_shard, shard_assignment, shard_for, use_shard
+from . import blacklist
+from .auth import AuthBusy
+from .models import RevokedToken, ShardAssignment
+from .tokens import RefreshToken, revoke_tokens
+
+
+User = get_user_model()
+
+
+@skipUnless(
+    settings.DATABASE_SHARDS == ['default', 'shard_1', 'shard_2'],
+    'needs DB_SHARDS=shard_1,shard_2, e.g. as local SQLite databases (see manage.py)',
+)
+# Shard maps are not cached, so moves need not wait for other processes.
+@override_settings(RATE_LIMIT_ENABLED=False, SHARD_MAP_CACHE_SECONDS=0)
+class ShardingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        for alias in settings.DATABASE_SHARDS:
+            prepare_shard(alias)
+        # With every shard empty, new users go to default, shard_1, shard_2 in turn.
+        self.users = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='x')
+            for i in range(3)
+        ]
+        self.user = self.users[1]
+
+    def add_rows(self, user, content='quarterly zebra report'):
+        with use_shard(shard_for(user.pk)):
+            account = LinkedAccount.objects.create(
+                owner=user, service_name='gmail', account_identifier=user.email, encrypted_token='token',
+            )
+            message = Message.objects.create(owner=user, source_account=account, title='hello', content=content)
+            task = Task.objects.create(owner=user, title='sharded', prompt='zebra reports')
+        return account, message, task
+
+    def client_for(self, user):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+        return self.client
+
+    def graphql(self, user, query):
+        return self.client_for(user).post(
+            '/api/graphql/', json.dumps({'query': query}), content_type='application/json',
+        )
+
+    def test_new_users_are_spread_over_shards(self):
+        self.assertEqual([shard_for(user.pk) for user in self.users], ['default', 'shard_1', 'shard_2'])
+        self.assertEqual(ShardAssignment.objects.count(), 3)
+        # Each shard holds a copy of the users placed on it, for joins.
+        self.assertTrue(User.objects.using('shard_1').filter(pk=self.user.pk).exists())
+        self.assertFalse(User.objects.using('shard_2').filter(pk=self.user.pk).exists())
+
+    def test_ids_stay_in_the_shard_range(self):
+        for index, user in enumerate(self.users):
+            account, message, task = self.add_rows(user)
+            for row in (account, message, task):
+                self.assertEqual(row.pk >> SHARD_ID_BITS, index)
+
+    def test_rows_stay_on_the_owners_shard(self):
+        _, message, task = self.add_rows(self.user)
+        self.assertTrue(Task.objects.using('shard_1').filter(pk=task.pk).exists())
+        self.assertFalse(Task.objects.using('default').filter(pk=task.pk).exists())
+        self.assertFalse(Message.objects.using('shard_2').filter(pk=message.pk).exists())
+
+    def test_move_takes_the_change_history_along(self):
+        _, _, task = self.add_rows(self.user)
+        history = list(
+            ChangeEvent.objects.using('shard_1').filter(owner_id=self.user.pk).order_by('pk').values_list('topic', 'op')
+        )
+        self.assertIn(('tasks.task', 'create'), history)
+
+        call_command('move_user_shard', self.user.pk, 'shard_2', stdout=StringIO())
+        moved = ChangeEvent.objects.using('shard_2').filter(owner_id=self.user.pk).order_by('pk')
+        self.assertEqual(list(moved.values_list('topic', 'op')[:len(history)]), history)
+        # Appended to the target's feed, in its own id range.
+        self.assertTrue(all(pk >> SHARD_ID_BITS == 2 for pk in moved.values_list('pk', flat=True)))
+        # Only the deletes of the move are left on the source, for its consumers.
+        left = ChangeEvent.objects.using('shard_1').filter(owner_id=self.user.pk)
+        self.assertEqual(set(left.values_list('op', flat=True)), {'delete'})
+        self.assertTrue(left.filter(topic='tasks.task', object_id=task.pk).exists())
+
+    @override_settings(SHARD_MAP_CACHE_SECONDS=7)
+    def test_move_waits_for_cached_shard_maps(self):
+        self.add_rows(self.user)
+        with mock.patch('taskpilotx.sharding.time.sleep') as sleep:
+            call_command('move_user_shard', self.user.pk, 'shard_2', stdout=StringIO())
+        # Once after locking, once after switching the shard.
+        self.assertEqual(sleep.call_args_list, [mock.call(7), mock.call(7)])
+
+    def test_users_only_see_their_own_shard(self):
+        self.add_rows(self.user)
+        self.add_rows(self.users[2], content='other tenant')
+        data = self.graphql(self.user, '{ myTasks { title } myMessages { content } }').json()['data']
+        self.assertEqual(data['myTasks'], [{'title': 'sharded'}])
+        self.assertEqual(data['myMessages'], [{'content': 'quarterly zebra report'}])
+        data = self.graphql(self.users[2], '{ myMessages { content } }').json()['data']
+        self.assertEqual(data['myMessages'], [{'content': 'other tenant'}])
+
+    def test_export_reads_the_owners_shard(self):
+        _, message, _ = self.add_rows(self.user)
+        response = self.client_for(self.user).get('/api/export/messages/')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [message.pk])
+
+    def test_move_user_shard_and_back(self):
+        account, message, task = self.add_rows(self.user)
+        task.linked_accounts.add(account)
+
+        call_command('move_user_shard', self.user.pk, 'shard_2', stdout=StringIO())
+        self.assertEqual(shard_assignment(self.user.pk), ('shard_2', False))
+        self.assertEqual(Task.objects.using('shard_2').get(pk=task.pk).linked_accounts.get().pk, account.pk)
+        self.assertTrue(Message.objects.using('shard_2').filter(pk=message.pk).exists())
+        for model in (Task, Message, LinkedAccount):
+            self.assertFalse(model.objects.using('shard_1').filter(pk__in=[task.pk, message.pk, account.pk]).exists())
+        self.assertFalse(User.objects.using('shard_1').filter(pk=self.user.pk).exists())
+        data = self.graphql(self.user, '{ myTasks { id } }').json()['data']
+        self.assertEqual(data['myTasks'], [{'id': str(task.pk)}])
+
+        # New rows on the target continue in its own id range.
+        with use_shard('shard_2'):
+            self.assertEqual(Task.objects.create(owner=self.user, title='new', prompt='p').pk >> SHARD_ID_BITS, 2)
+
+        call_command('move_user_shard', self.user.pk, 'default', stdout=StringIO())
+        self.assertEqual(shard_assignment(self.user.pk), ('default', False))
+        self.assertEqual(Task.objects.using('default').filter(owner=self.user).count(), 2)
+        self.assertFalse(Task.objects.using('shard_2').filter(owner=self.user).exists())
+
+    def test_writes_are_refused_while_locked(self):
+        self.add_rows(self.user)
+        ShardAssignment.objects.filter(user=self.user).update(locked=True)
+        cache.clear()
+        response = self.graphql(self.user, 'mutation { revokeTokens { success } }')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        response = self.graphql(self.user, '{ myTasks { title } }')
+        self.assertEqual(response.json()['data']['myTasks'], [{'title': 'sharded'}])
+
+    def test_move_waits_for_work_in_flight(self):
+        _, message, _ = self.add_rows(self.user)
+        Message.objects.using('shard_1').filter(pk=message.pk).update(status='processing')
+        with self.assertRaises(CommandError):
+            call_command('move_user_shard', self.user.pk, 'shard_2', '--drain-timeout', '0')
+        # Nothing moved, and the lock is released again.
+        self.assertEqual(shard_assignment(self.user.pk), ('shard_1', False))
+        self.assertTrue(Message.objects.using('shard_1').filter(pk=message.pk).exists())
+        self.assertFalse(Message.objects.using('shard_2').filter(pk=message.pk).exists())
+
+
+@override_settings(
+    RATE_LIMIT_ENABLED=True,
+    RATE_LIMITS={'login': '100/min', 'login_account': '2/min', 'register': '2/hour'},
+)
+class AuthRateLimitTests(TestCase):
+    # Registered users are placed on a shard.
+    databases = '__all__'
+
+    def setUp(self):
+        # The limiter reads RATE_LIMITS when it is created.
+        ratelimit._limiter = None
+        self.addCleanup(setattr, ratelimit, '_limiter', None)
+
+    def graphql(self, query, variables=None):
+        return self.client.post(
+            '/api/graphql/', json.dumps({'query': query, 'variables': variables or {}}),
+            content_type='application/json',
+        )
+
+    def login(self, email, alias='login'):
+        return f'{alias}: login(credentials: {{email: "{email}", password: "wrong"}}) {{ success }}'
+
+    def test_graphql_login_is_limited_per_account(self):
+        for _ in range(2):
+            self.assertEqual(self.graphql(f'mutation {{ {self.login("a@example.com")} }}').status_code, 200)
+        self.assertEqual(self.graphql(f'mutation {{ {self.login(" A@example.com")} }}').status_code, 429)
+        self.assertEqual(self.graphql(f'mutation {{ {self.login("b@example.com")} }}').status_code, 200)
+
+    def test_graphql_login_counts_aliases_fragments_and_variables(self):
+        query = (
+            f'mutation($c: LoginInput!) {{ {self.login("a@example.com", "a")} ...F '
+            f'... on Mutation {{ c: login(credentials: $c) {{ success }} }} }} '
+            f'fragment F on Mutation {{ {self.login("a@example.com", "b")} }}'
+        )
+        response = self.graphql(query, {'c': {'email': 'a@example.com', 'password': 'wrong'}})
+        self.assertEqual(response.status_code, 429)
+        # Two logins fit the budget of the account.
+        query = 'mutation($c: LoginInput!) { c: login(credentials: $c) { success } }'
+        response = self.graphql(query, {'c': {'email': 'b@example.com', 'password': 'wrong'}})
+        self.assertEqual(response.status_code, 200)
+
+    def test_graphql_register_is_limited_per_address(self):
+        def register(i):
+            return self.graphql(
+                f'mutation {{ register(userData: {{username: "u{i}", email: "u{i}@example.com", '
+                f'password: "S3cure-pass!"}}) {{ success }} }}'
+            )
+
+        for i in range(2):
+            self.assertEqual(register(i).status_code, 200)
+        self.assertEqual(register(2).status_code, 429)
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class RegisterViewTests(TestCase):
+    databases = '__all__'
+
+    def test_busy_hashing_pool_returns_503(self):
+        data = {
+            'email': 'busy@example.com', 'first_name': 'B', 'last_name': 'Usy',
+            'password': 'S3cure-pass!', 'password2': 'S3cure-pass!',
+        }
+        with mock.patch('users.auth.HashingPool.run', side_effect=AuthBusy('busy')):
+            response = self.client.post('/api/users/register/', data)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertFalse(User.objects.filter(email='busy@example.com').exists())
+
+
+@override_settings(RATE_LIMIT_ENABLED=False, TOKEN_CLAIMS_USER=True)
+class TokenClaimsTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='claims', email='claims@example.com', password='x')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+
+    def me(self):
+        response = self.client.post(
+            '/api/graphql/', json.dumps({'query': '{ me { username } }'}), content_type='application/json',
+        )
+        return response.json()['data']['me']
+
+    def test_deactivated_user_is_rejected_despite_cached_state(self):
+        self.assertEqual(self.me(), {'username': 'claims'})
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(self.me())
+
+    def test_revoked_tokens_are_rejected(self):
+        self.assertEqual(self.me(), {'username': 'claims'})
+        revoke_tokens(self.user)
+        self.assertIsNone(self.me())
+
+
+@override_settings(RATE_LIMIT_ENABLED=False, TOKEN_BLACKLIST_CAPACITY=1000)
+class TokenBlacklistTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        # The process-wide blacklist is created on first use, with the settings of the time.
+        blacklist._blacklist = None
+        self.addCleanup(setattr, blacklist, '_blacklist', None)
+        self.user = User.objects.create_user(username='rotating', email='rotating@example.com', password='x')
+
+    def refresh(self, token):
+        return self.client.post(reverse('token_refresh'), {'refresh': str(token)}, content_type='application/json')
+
+    def test_rotated_token_is_rejected_on_reuse(self):
+        token = RefreshToken.for_user(self.user)
+        response = self.refresh(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh(token).status_code, 401)
+        # The token it was rotated to still works.
+        self.assertEqual(self.refresh(response.json()['refresh']).status_code, 200)
+
+    def test_only_one_of_two_concurrent_rotations_wins(self):
+        token = RefreshToken.for_user(self.user)
+        # Two processes whose filters both predate the rotation.
+        first, second = blacklist.TokenBlacklist(), blacklist.TokenBlacklist()
+        first.warm()
+        second.warm()
+        with mock.patch('users.tokens.get_blacklist', return_value=first):
+            token.blacklist()
+        with mock.patch('users.tokens.get_blacklist', return_value=second):
+            with self.assertRaisesMessage(TokenError, 'Token is blacklisted'):
+                token.blacklist()
+        self.assertEqual(RevokedToken.objects.count(), 1)
+
+    def test_purge_removes_expired_rows(self):
+        now = timezone.now()
+        RevokedToken.objects.bulk_create([
+            RevokedToken(jti=uuid.uuid4(), expires_at=now - timedelta(minutes=1)),
+            RevokedToken(jti=uuid.uuid4(), expires_at=now + timedelta(days=1)),
+        ])
+        self.assertEqual(blacklist.purge_expired(), 1)
+        self.assertFalse(RevokedToken.objects.filter(expires_at__lte=now).exists())
+        self.assertEqual(RevokedToken.objects.count(), 1)
+
+    def test_filter_miss_issues_no_query(self):
+        revoked = uuid.uuid4().hex
+        tokens = blacklist.TokenBlacklist()
+        tokens.revoke(revoked, timezone.now() + timedelta(days=1))
+        tokens.warm()
+        with self.assertNumQueries(0):
+            self.assertFalse(tokens.is_revoked(uuid.uuid4().hex))
+        # Only ids the filter may contain are looked up.
+        with self.assertNumQueries(1):
+            self.assertTrue(tokens.is_revoked(revoked))
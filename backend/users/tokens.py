@@ -0,0 +1,96 @@
+"""
+JWTs that carry enough of the user to skip loading it.
+
+Tokens hold the user's id, username and ``token_version``. Requests are
+authenticated from those claims alone (``users.authentication``): the user
+object is built from them, and its other fields are loaded only if something
+reads them. The version is compared with the user's current one, kept in the
+cache together with ``is_active``, so a request normally costs no query at all;
+``revoke_tokens()`` bumps it and every token issued before stops working, and
+saving an inactive user stops them too. With a per-process cache (no
+``REDIS_URL``) other processes notice after ``TOKEN_VERSION_CACHE_SECONDS``, as
+they do for users deactivated with ``QuerySet.update()``, which sends no signal.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import F
+from rest_framework_simplejwt import serializers, tokens
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from .blacklist import get_blacklist, token_expiry
+from .signals import token_state_key as _cache_key
+
+
+USERNAME_CLAIM = 'username'
+VERSION_CLAIM = 'ver'
+
+
+def _token_state(user_id):
+    """``(token_version, is_active)`` of ``user_id``, or ``None`` for unknown users."""
+    state = cache.get(_cache_key(user_id))
+    if state is None:
+        state = (
+            get_user_model()._default_manager.using('default')
+            .filter(pk=user_id).values_list('token_version', 'is_active').first()
+        )
+        if state is None:
+            return None
+        cache.set(_cache_key(user_id), state, settings.TOKEN_VERSION_CACHE_SECONDS)
+    return state
+
+
+def token_version(user_id):
+    """The current token version of ``user_id``; raises ``AuthenticationFailed`` for unknown or inactive users."""
+    state = _token_state(user_id)
+    if state is None:
+        raise AuthenticationFailed('User not found', code='user_not_found')
+    version, is_active = state
+    if not is_active:
+        raise AuthenticationFailed('User is inactive', code='user_inactive')
+    return version
+
+
+def check_version(token):
+    """Reject ``token`` if its user's tokens were revoked after it was issued."""
+    if token.get(VERSION_CLAIM, 0) != token_version(token[api_settings.USER_ID_CLAIM]):
+        raise InvalidToken('Token has been revoked')
+
+
+def revoke_tokens(user):
+    """Invalidate every token issued to ``user`` so far."""
+    User = get_user_model()
+    User._default_manager.using('default').filter(pk=user.pk).update(token_version=F('token_version') + 1)
+    user.token_version = User._default_manager.using('default').values_list('token_version', flat=True).get(pk=user.pk)
+    cache.delete(_cache_key(user.pk))
+
+
+class RefreshToken(tokens.RefreshToken):
+    """Refresh token with the user claims, checked against ``users.blacklist``."""
+
+    def verify(self):
+        super().verify()
+        if get_blacklist().is_revoked(self[api_settings.JTI_CLAIM]):
+            raise TokenError('Token is blacklisted')
+
+    def blacklist(self):
+        # Called by TokenRefreshView when rotating; of two concurrent refreshes only one gets here.
+        if not get_blacklist().revoke(self[api_settings.JTI_CLAIM], token_expiry(self)):
+            raise TokenError('Token is blacklisted')
+
+    @classmethod
+    def for_user(cls, user):
+        # Access tokens copy these claims from their refresh token.
+        token = super().for_user(user)
+        token[USERNAME_CLAIM] = user.get_username()
+        token[VERSION_CLAIM] = user.token_version
+        return token
+
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        check_version(self.token_class(attrs['refresh']))
+        return super().validate(attrs)
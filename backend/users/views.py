@@ -3,32 +3,28 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from .serializers import RegisterSerializer, UserSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.contrib.auth.models import User
-from django.contrib.auth import authenticate
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .auth import AuthBusy, authenticate
+from .tokens import RefreshToken
 
 class EmailTokenObtainPairSerializer(TokenObtainPairSerializer):
     username_field = 'email'
+    token_class = RefreshToken
 
     def validate(self, attrs):
         email = attrs.get('email')
         password = attrs.get('password')
         
         if email and password:
-            try:
-                # Find user by email
-                user = User.objects.get(email=email)
-                # Authenticate with username (which is email in our case)
-                user = authenticate(username=user.username, password=password)
-                if user and user.is_active:
-                    refresh = self.get_token(user)
-                    return {
-                        'refresh': str(refresh),
-                        'access': str(refresh.access_token),
-                    }
-            except User.DoesNotExist:
-                pass
+            # One query by email; the password is checked against the loaded row
+            user = authenticate(password, email=email)
+            if user is not None:
+                self.user = user
+                refresh = self.get_token(user)
+                return {
+                    'refresh': str(refresh),
+                    'access': str(refresh.access_token),
+                }
         
         raise serializers.ValidationError('No active account found with the given credentials')
 
@@ -39,15 +35,19 @@ class CustomTokenObtainPairView(TokenObtainPairView):
         serializer = self.get_serializer(data=request.data)
         try:
             serializer.is_valid(raise_exception=True)
-            email = request.data.get('email')
-            user = User.objects.get(email=email)
-            user_serializer = UserSerializer(user)
+            user_serializer = UserSerializer(serializer.user)
             
             return Response({
                 'user': user_serializer.data,
                 'access': serializer.validated_data['access'],
                 'refresh': serializer.validated_data['refresh']
             })
+        except AuthBusy as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '5'},
+            )
         except Exception as e:
             return Response(
                 {'error': 'Invalid credentials'}, 
@@ -62,7 +62,14 @@ class RegisterView(generics.CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        user = serializer.save()
+        try:
+            user = serializer.save()
+        except AuthBusy as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '5'},
+            )
         
         # Generate tokens for the new user
         refresh = RefreshToken.for_user(user)